@@ -1,14 +1,7 @@
-from flask import Flask, request, jsonify, send_file, render_template_string, session
-import tensorflow as tf
+from flask import Flask, Response, request, jsonify, send_file, session, stream_with_context
 import numpy as np
-import cv2
 from flask_cors import CORS
-import requests
-from fpdf import FPDF
-from fpdf.enums import XPos, YPos
 import os
-import joblib
-from tensorflow.keras.models import Model
 import logging
 from werkzeug.utils import secure_filename
 import traceback
@@ -16,21 +9,58 @@ from datetime import datetime
 import threading
 import time
 import atexit
-import gc
 import resource
+import socket
+import hmac
+import queue
+import random
+import uuid
+import weakref
+from collections import namedtuple
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+
+import audit_log
+import compact_upload
+import dedup
+import dicom
+import drift
+import explain
+import gc_policy
+import lazy_imports
+import model_registry
+import page_cache
+import preprocessing
+import request_log
+import similarity
+from buffers import BufferPool, resize_normalize_into
+from feature_store import FeatureStore, claim_writer
+from cascade import Cascade
+from metrics import metrics
+from model_utils import allowed_file, build_feature_extractor, hash_file
+from model_registry import ModelBundle
+from model_server import Inference, ModelClient
+from lazy_imports import lazy_import
+from status import StatusBroadcaster
+
+def _disable_ssl_warnings(requests):
+    """Disable SSL warnings"""
+    from requests.packages.urllib3.exceptions import InsecureRequestWarning
+    requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+
+# Heavy dependencies are imported on first use (see lazy_imports.py)
+tf = lazy_import("tensorflow")
+cv2 = lazy_import("cv2")
+joblib = lazy_import("joblib")
+requests = lazy_import("requests", on_load=_disable_ssl_warnings)
+fpdf = lazy_import("fpdf")
+# Preloaded once the models are ready. TensorFlow and joblib are left out: the local backend has
+# already imported them to load the models, and with the model server they stay in that process.
+ROUTE_MODULES = ("cv2", "requests", "fpdf")
 
-# Disable SSL warnings
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None)  # static assets are served from the page cache
 app.secret_key = 'your_super_secret_key_change_in_production'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 CORS(app)
@@ -38,16 +68,149 @@ CORS(app)
 # -------------------------------
 # CONFIGURATION
 # -------------------------------
-GOMAPS_API_KEY = "YOUR_GOMAPS_API_KEY"  # Replace with your actual API key
+GOMAPS_API_KEY = os.environ.get("GOMAPS_API_KEY", "YOUR_GOMAPS_API_KEY")  # Replace with your actual API key
+GOMAPS_PLACES_URL = os.environ.get("GOMAPS_PLACES_URL", "https://maps.googleapis.com/maps/api/place/nearbysearch/json")
 DISEASE_CLASSES = ["COPD", "fibrosis", "normal", "pneumonia", "pulmonary tb"]
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'}
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.abspath(os.path.join(BASE_DIR, ".."))
+MODELS_DIR = os.environ.get("MODELS_DIR", os.path.join(ROOT_DIR, "models"))
+
+# TensorFlow op threads per process (0 lets TensorFlow use every core)
+TF_INTRA_OP_THREADS = int(os.environ.get("TF_INTRA_OP_THREADS", "1"))
+TF_INTER_OP_THREADS = int(os.environ.get("TF_INTER_OP_THREADS", "1"))
+
+# Directory of the embedding feature store (empty disables it)
+FEATURE_STORE_DIR = os.environ.get("FEATURE_STORE_DIR", "")
+
+# Directory of the binary prediction audit log (empty disables it; see audit_log.py)
+AUDIT_LOG_DIR = os.environ.get("AUDIT_LOG_DIR", "")
+# Group commit window: records queued within it share one fsync
+AUDIT_FLUSH_MS = float(os.environ.get("AUDIT_FLUSH_MS", "20"))
+AUDIT_SEGMENT_MB = int(os.environ.get("AUDIT_SEGMENT_MB", "64"))
+
+# Cascade inference: "off", "cnn" (softmax head) or "linear" (logistic head on embeddings).
+# Confident first-stage answers skip the stacking ensemble; tune with `python app/cascade.py sweep`.
+CASCADE_MODE = os.environ.get("CASCADE_MODE", "off")
+CASCADE_THRESHOLD = float(os.environ.get("CASCADE_THRESHOLD", "0.95"))
+CASCADE_TEMPERATURE = float(os.environ.get("CASCADE_TEMPERATURE", "1.0"))
+CASCADE_HEAD_PATH = os.environ.get("CASCADE_HEAD_PATH", os.path.join(MODELS_DIR, "cascade_head.pkl"))
+
+# Versioned models: <MODEL_REGISTRY_DIR>/<version>/ plus a CURRENT pointer (see model_registry.py).
+# Without a registry the flat MODELS_DIR files are served.
+MODEL_REGISTRY_DIR = os.environ.get("MODEL_REGISTRY_DIR", os.path.join(MODELS_DIR, "registry"))
+# Seconds between checks for a new CURRENT version or replaced files (0 disables the watcher)
+MODEL_WATCH_INTERVAL = float(os.environ.get("MODEL_WATCH_INTERVAL", "0"))
+# Bearer token for the /admin endpoints (empty disables them)
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+# Mirror a fraction of predictions to another version to compare latency and outputs before promotion
+MODEL_SHADOW_VERSION = os.environ.get("MODEL_SHADOW_VERSION", "")
+MODEL_SHADOW_FRACTION = float(os.environ.get("MODEL_SHADOW_FRACTION", "0.1"))
+
+# Inference backend: "local" loads the models in every worker; "server" sends preprocessed
+# tensors to one app/model_server.py process per host through shared memory
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "local")
+MODEL_SERVER_SOCKET = os.environ.get("MODEL_SERVER_SOCKET", "/tmp/xray-model-server.sock")
+
+# Process role: "full" serves everything; "web" never loads models itself and only predicts
+# through the model server, so TensorFlow is never imported (pages, health, doctors, reports)
+APP_ROLE = os.environ.get("APP_ROLE", "full")
+SERVES_PREDICTIONS = APP_ROLE != "web" or INFERENCE_BACKEND == "server"
+
+# Upload mode of the chatbot page: "compact" resizes on a canvas and posts raw pixels plus a
+# small report JPEG (see compact_upload.py); "original" posts the file as picked
+UPLOAD_MODE = os.environ.get("UPLOAD_MODE", "compact")
+COMPACT_UPLOAD_SIZE = int(os.environ.get("COMPACT_UPLOAD_SIZE", "224"))
+# Longest side of the JPEG kept for the PDF report (0 keeps only the tensor)
+REPORT_MAX_SIDE = int(os.environ.get("REPORT_MAX_SIDE", "1024"))
+
+# Frame scored from multi-frame DICOM studies (empty picks the middle frame)
+DICOM_FRAME = os.environ.get("DICOM_FRAME", "")
+
+# Grad-CAM overlays: "on" records the serving forward pass on a gradient tape and embeds
+# the heatmap in the PDF report (local backend only); "off" skips it
+EXPLAIN_MODE = os.environ.get("EXPLAIN_MODE", "off")
+# Directory and size of the overlay cache, keyed by model version and input hash
+EXPLAIN_DIR = os.environ.get("EXPLAIN_DIR", os.path.join(os.getcwd(), "explanations"))
+EXPLAIN_CACHE_SIZE = int(os.environ.get("EXPLAIN_CACHE_SIZE", "512"))
+
+# Near-duplicate uploads (re-exports, re-compressions, re-scans): "on" reuses the result of an
+# earlier upload whose perceptual hash is within DEDUP_MAX_DISTANCE bits (see dedup.py)
+DEDUP_MODE = os.environ.get("DEDUP_MODE", "off")
+DEDUP_MAX_DISTANCE = int(os.environ.get("DEDUP_MAX_DISTANCE", "4"))
+DEDUP_INDEX_SIZE = int(os.environ.get("DEDUP_INDEX_SIZE", "10000"))
+
+# Similar-case retrieval over embeddings (see similarity.py; empty disables /similar_cases)
+SIMILARITY_INDEX_DIR = os.environ.get("SIMILARITY_INDEX_DIR", "")
+SIMILAR_CASES_K = int(os.environ.get("SIMILAR_CASES_K", "5"))
+# Coarse lists scanned per query on an IVF index
+SIMILARITY_NPROBE = int(os.environ.get("SIMILARITY_NPROBE", str(similarity.DEFAULT_NPROBE)))
+
+# Drift monitoring against a training baseline built by `python app/drift.py baseline` (empty disables)
+DRIFT_BASELINE_PATH = os.environ.get("DRIFT_BASELINE_PATH", "")
+# Requests after which an observation's weight in the live statistics has halved
+DRIFT_HALF_LIFE = int(os.environ.get("DRIFT_HALF_LIFE", "500"))
+
+# Logging: "text" or "json" lines, written by a background thread from a bounded queue
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+# Fraction of requests logged per route, e.g. "/predict=0.1,/health=0,*=1" (warnings and errors are always kept)
+LOG_SAMPLE_RATES = os.environ.get("LOG_SAMPLE_RATES", "")
+# Requests slower than this are always logged (0 disables)
+LOG_SLOW_MS = float(os.environ.get("LOG_SLOW_MS", "0"))
+
+# Garbage collection policy: "default", "thresholds" or "periodic" (see gc_policy.py)
+GC_POLICY = os.environ.get("GC_POLICY", "thresholds")
+GC_THRESHOLDS = gc_policy.parse_thresholds(os.environ.get("GC_THRESHOLDS", "50000,20,100"))
+GC_INTERVAL = float(os.environ.get("GC_INTERVAL", "30"))
+
+# Configure logging (request threads only enqueue records)
+request_log.configure(LOG_FORMAT, LOG_LEVEL, LOG_QUEUE_SIZE, LOG_SAMPLE_RATES, LOG_SLOW_MS)
 
 # Global variables for models
 cnn_model = None
 rf_model = None
 feature_extractor = None
+serving_model = None
+cascade = None
+cnn_model_version = None
+feature_store = None
+explanation_cache = None
+similarity_index = None
+drift_monitor = None
+prediction_audit = None
 models_loaded = False
 startup_complete = False
+tf_configured = False
+
+# Hot reload: requests hold the bundle they started on; swapped-out bundles drain and are freed
+active_bundle = None
+retired_bundles = queue.Queue()
+reload_lock = threading.Lock()
+reload_state = {"state": "idle", "version": None, "shadow": False, "error": None, "started": None}
+
+# Shadow traffic runs one request at a time off the request thread
+shadow_bundle = None
+shadow_fraction = MODEL_SHADOW_FRACTION
+shadow_executor = ThreadPoolExecutor(max_workers=1)
+shadow_slot = threading.Semaphore(1)
+
+# One model server connection (and shared-memory slot ring) per request thread
+model_clients = threading.local()
+
+# Readiness pushed to /readyz and /events subscribers; changes a few times per process lifetime
+readiness = StatusBroadcaster(role=APP_ROLE, models_loaded=False, model_version=None)
+
+# Seconds a threaded-WSGI /events stream stays open before the browser reconnects (frees its thread)
+EVENTS_STREAM_SECONDS = float(os.environ.get("EVENTS_STREAM_SECONDS", "300"))
+
+# Preallocated input/feature buffers, one set per worker thread
+buffer_pool = BufferPool()
+
+# Perceptual hashes of recent uploads and the predictions made for them
+duplicate_index = dedup.HashIndex(DEDUP_MAX_DISTANCE, DEDUP_INDEX_SIZE) if DEDUP_MODE == "on" else None
+PreviousPrediction = namedtuple("PreviousPrediction", "result explanation_path input_digest")
 
 # -------------------------------
 # MEMORY MONITORING (WITHOUT PSUTIL)
@@ -68,121 +231,519 @@ def get_memory_usage():
 # -------------------------------
 # MODEL LOADING WITH MEMORY OPTIMIZATION
 # -------------------------------
-def load_models():
+def build_serving_model(model, extractor):
+    """One graph returning [pooled embedding, CNN class probabilities] in a single forward pass"""
+    return tf.keras.Model(inputs=model.input, outputs=[extractor.output, model.output])
+
+def configure_tensorflow(intra_op_threads=None, inter_op_threads=None):
+    """Device and thread settings; TensorFlow only accepts them before its runtime starts"""
+    global tf_configured
+    if tf_configured:
+        return
+    
+    # Configure TensorFlow for memory efficiency
+    try:
+        # Limit TensorFlow memory growth
+        physical_devices = tf.config.list_physical_devices('GPU')
+        if physical_devices:
+            tf.config.experimental.set_memory_growth(physical_devices[0], True)
+        else:
+            tf.config.set_visible_devices([], 'GPU')
+    except Exception as e:
+        logger.warning(f"TensorFlow GPU config warning: {e}")
+    
+    # Reduce thread usage to save memory (batch tools pass 0 to use every core)
+    tf.config.threading.set_intra_op_parallelism_threads(
+        TF_INTRA_OP_THREADS if intra_op_threads is None else intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(
+        TF_INTER_OP_THREADS if inter_op_threads is None else inter_op_threads)
+    tf_configured = True
+
+def load_bundle(version=None):
+    """Load and warm one model version (default: the registry's current) without activating it"""
+    artifacts = model_registry.resolve(MODEL_REGISTRY_DIR, version, legacy_dir=MODELS_DIR,
+                                       legacy_head=CASCADE_HEAD_PATH)
+    
+    # Check if model files exist
+    if not os.path.exists(artifacts.cnn_path):
+        raise FileNotFoundError(f"CNN model not found at: {artifacts.cnn_path}")
+    if not os.path.exists(artifacts.stack_path):
+        raise FileNotFoundError(f"RF model not found at: {artifacts.stack_path}")
+    
+    # Load CNN model with memory optimization
+    logger.info(f"🔄 Loading CNN model for version {artifacts.version}...")
+    cnn = tf.keras.models.load_model(artifacts.cnn_path, compile=False)
+    logger.info(f"✅ CNN model loaded successfully. Memory: {get_memory_usage():.2f}MB")
+    
+    # Load Random Forest model
+    logger.info("🔄 Loading Random Forest model...")
+    stack = joblib.load(artifacts.stack_path)
+    logger.info(f"✅ Random Forest model loaded successfully. Memory: {get_memory_usage():.2f}MB")
+    
+    # Create feature extractor
+    logger.info("🔄 Creating feature extractor...")
+    extractor = build_feature_extractor(cnn)
+    if extractor is None:
+        raise RuntimeError(f"No feature layer in {artifacts.cnn_path}")
+    
+    # Optional early-exit first stage in front of the stack
+    head = joblib.load(artifacts.head_path) if CASCADE_MODE == "linear" else None
+    bundle_cascade = Cascade(CASCADE_MODE, CASCADE_THRESHOLD, CASCADE_TEMPERATURE, head)
+    
+    # Optional explanation graph sharing the serving model's layers
+    explain_model = explain.build_explain_model(cnn, extractor) if EXPLAIN_MODE == "on" else None
+    
+    bundle = ModelBundle(artifacts, cnn, stack, extractor, build_serving_model(cnn, extractor), bundle_cascade,
+                         explain_model)
+    warm_up(bundle)
+    return bundle
+
+def warm_up(bundle):
+    """Push one blank image through every stage so the first real request isn't slow"""
+    start = time.perf_counter()
+    with tf.device('/CPU:0'):
+        pooled, _ = bundle.serving_model(np.zeros((1, 224, 224, 3), dtype=np.float32), training=False)
+    stack_probabilities(np.reshape(pooled, (1, -1)), bundle.rf_model)
+    logger.info(f"🔥 Model version {bundle.version} warmed up in {time.perf_counter() - start:.2f}s")
+
+def activate(bundle):
+    """Atomically make `bundle` the serving version; the previous one drains and is released"""
+    global active_bundle, cnn_model, rf_model, feature_extractor, serving_model, cascade, cnn_model_version
+    
+    previous, active_bundle = active_bundle, bundle
+    # Module-level references for batch tools (bulk_score) that drive the models directly
+    cnn_model, rf_model = bundle.cnn_model, bundle.rf_model
+    feature_extractor, serving_model = bundle.feature_extractor, bundle.serving_model
+    cascade, cnn_model_version = bundle.cascade, bundle.cnn_version
+    
+    if cascade.enabled:
+        logger.info(f"✅ Cascade enabled: {CASCADE_MODE} first stage, threshold {CASCADE_THRESHOLD}")
+    logger.info(f"🔀 Serving model version {bundle.version}")
+    readiness.update(model_version=bundle.version)
+    metrics.incr("model_swaps")
+    if previous is not None:
+        retired_bundles.put(previous)
+
+def retire_bundles():
+    """Background thread: wait for each swapped-out bundle to drain, then free it"""
+    while True:
+        bundle = retired_bundles.get()
+        if not bundle.wait_idle(timeout=300):
+            logger.warning(f"⚠️ Version {bundle.version} still has {bundle.inflight} requests after 5 min; releasing anyway")
+        version = bundle.version
+        # Requests drop their local reference just after releasing; the finalizer fires when the last one does
+        freed = threading.Event()
+        weakref.finalize(bundle, freed.set)
+        del bundle
+        if not freed.wait(timeout=30):
+            logger.warning(f"⚠️ Version {version} is still referenced after draining; collecting what is unreachable")
+        pause_ms = gc_policy.refreeze()
+        metrics.observe("gc_refreeze", pause_ms / 1000)
+        logger.info(f"🗑️ Released model version {version} ({pause_ms:.0f}ms GC pause). "
+                    f"Memory: {get_memory_usage():.2f}MB")
+
+def load_models(intra_op_threads=None, inter_op_threads=None, version=None):
     """Load models with memory optimization and proper error handling"""
-    global cnn_model, rf_model, feature_extractor, models_loaded
+    global explanation_cache, models_loaded
     
     try:
         logger.info(f"🔄 Starting model loading process... Current memory: {get_memory_usage():.2f}MB")
         
-        # Base directory setup
-        BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-        ROOT_DIR = os.path.abspath(os.path.join(BASE_DIR, ".."))
+        configure_tensorflow(intra_op_threads, inter_op_threads)
+        activate(load_bundle(version))
         
-        # Model paths
-        cnn_model_path = os.path.join(ROOT_DIR, "models", "densenet_new_finetuned_v3.h5")
-        rf_model_path = os.path.join(ROOT_DIR, "models", "fast_rf_xgb_stack2.pkl")
-        
-        # Check if model files exist
-        if not os.path.exists(cnn_model_path):
-            logger.error(f"❌ CNN model not found at: {cnn_model_path}")
-            return False
-            
-        if not os.path.exists(rf_model_path):
-            logger.error(f"❌ RF model not found at: {rf_model_path}")
-            return False
+        # Open the embedding store, one writer slot per worker process
+        if FEATURE_STORE_DIR and feature_store is None:
+            open_feature_store(int(feature_extractor.output_shape[-1]))
         
-        # Configure TensorFlow for memory efficiency
-        try:
-            # Limit TensorFlow memory growth
-            physical_devices = tf.config.list_physical_devices('GPU')
-            if physical_devices:
-                tf.config.experimental.set_memory_growth(physical_devices[0], True)
-            else:
-                tf.config.set_visible_devices([], 'GPU')
-        except Exception as e:
-            logger.warning(f"TensorFlow GPU config warning: {e}")
-        
-        # Reduce thread usage to save memory
-        tf.config.threading.set_intra_op_parallelism_threads(1)
-        tf.config.threading.set_inter_op_parallelism_threads(1)
-        
-        # Load CNN model with memory optimization
-        logger.info("🔄 Loading CNN model...")
-        cnn_model = tf.keras.models.load_model(cnn_model_path, compile=False)
-        gc.collect()  # Force garbage collection
-        logger.info(f"✅ CNN model loaded successfully. Memory: {get_memory_usage():.2f}MB")
-        
-        # Load Random Forest model
-        logger.info("🔄 Loading Random Forest model...")
-        rf_model = joblib.load(rf_model_path)
-        gc.collect()
-        logger.info(f"✅ Random Forest model loaded successfully. Memory: {get_memory_usage():.2f}MB")
-        
-        # Create feature extractor
-        logger.info("🔄 Creating feature extractor...")
-        try:
-            feature_extractor = Model(
-                inputs=cnn_model.input,
-                outputs=cnn_model.get_layer("global_average_pooling2d").output
-            )
-            logger.info("✅ Feature extractor created successfully")
-        except Exception as e:
-            logger.warning(f"⚠️ Could not find 'global_average_pooling2d' layer, trying alternatives...")
-            # Try to find a suitable layer for feature extraction
-            for layer in reversed(cnn_model.layers):
-                if 'pool' in layer.name.lower() or 'flatten' in layer.name.lower():
-                    feature_extractor = Model(inputs=cnn_model.input, outputs=layer.output)
-                    logger.info(f"✅ Using layer '{layer.name}' for feature extraction")
-                    break
-            else:
-                logger.error("❌ Could not create feature extractor")
-                return False
+        if EXPLAIN_MODE == "on" and explanation_cache is None:
+            explanation_cache = explain.ExplanationCache(EXPLAIN_DIR, EXPLAIN_CACHE_SIZE)
+            logger.info(f"✅ Grad-CAM explanations enabled, cache at {EXPLAIN_DIR}")
         
-        gc.collect()
+        gc_policy.freeze()
         models_loaded = True
+        readiness.update(status="ready", ready=True, models_loaded=True, message=None)
         logger.info(f"🎉 All models loaded successfully! Final memory: {get_memory_usage():.2f}MB")
+        
+        if MODEL_SHADOW_VERSION:
+            reload_models(MODEL_SHADOW_VERSION, shadow=True, fraction=MODEL_SHADOW_FRACTION)
         return True
         
     except Exception as e:
         logger.error(f"❌ Error loading models: {str(e)}")
         logger.error(traceback.format_exc())
+        readiness.update(status="failed", ready=False, message="AI models failed to load")
         return False
 
-def allowed_file(filename):
-    """Check if file has allowed extension"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def connect_model_server(timeout=120):
+    """Wait for the model server instead of loading models in this worker"""
+    global models_loaded
+    
+    deadline = time.time() + timeout
+    while True:
+        try:
+            client = model_client()
+            break
+        except OSError as e:
+            if time.time() > deadline:
+                logger.error(f"❌ Model server not reachable at {MODEL_SERVER_SOCKET}: {e}")
+                readiness.update(status="failed", ready=False, message="Model server not reachable")
+                return False
+            time.sleep(1)
+    
+    if FEATURE_STORE_DIR and feature_store is None:
+        open_feature_store(client.feature_dim)
+    models_loaded = True
+    readiness.update(status="ready", ready=True, models_loaded=True, message=None)
+    logger.info(f"🔌 Using model server at {MODEL_SERVER_SOCKET}")
+    return True
+
+def open_feature_store(dim):
+    """Open the embedding store under a writer name that survives restarts (one per worker)"""
+    global feature_store
+    writer = claim_writer(FEATURE_STORE_DIR, f"web-{socket.gethostname()}")
+    feature_store = FeatureStore(FEATURE_STORE_DIR, dim=dim, writer=writer)
+    logger.info(f"✅ Feature store opened at {FEATURE_STORE_DIR} as {writer} ({len(feature_store)} embeddings)")
+
+def prepare_inference():
+    """Load the models in this process, or connect to the model server"""
+    ready = connect_model_server() if INFERENCE_BACKEND == "server" else load_models()
+    if ready and SIMILARITY_INDEX_DIR:
+        open_similarity_index()
+    if ready and DRIFT_BASELINE_PATH:
+        open_drift_monitor()
+    if ready and AUDIT_LOG_DIR:
+        open_audit_log()
+    return ready
+
+def open_similarity_index():
+    """Map the similar-case index; predictions still work without it"""
+    global similarity_index
+    try:
+        similarity_index = similarity.SimilarityIndex(SIMILARITY_INDEX_DIR, nprobe=SIMILARITY_NPROBE)
+        logger.info(f"✅ Similarity index opened: {similarity_index.stats()}")
+    except Exception as e:
+        logger.warning(f"⚠️ Could not open similarity index at {SIMILARITY_INDEX_DIR}: {e}")
+
+def open_audit_log():
+    """Start this process's audit writer (one set of segments per worker)"""
+    global prediction_audit
+    if prediction_audit is None:
+        prediction_audit = audit_log.AuditLog(
+            AUDIT_LOG_DIR,
+            writer=f"web-{socket.gethostname()}-{os.getpid()}",
+            segment_bytes=AUDIT_SEGMENT_MB * 1024 * 1024,
+            flush_interval=AUDIT_FLUSH_MS / 1000
+        )
+        logger.info(f"✅ Audit log writing to {AUDIT_LOG_DIR}")
+
+def open_drift_monitor():
+    """Load the drift baseline; predictions still work without it"""
+    global drift_monitor
+    try:
+        drift_monitor = drift.DriftMonitor(drift.load_baseline(DRIFT_BASELINE_PATH), half_life=DRIFT_HALF_LIFE)
+        logger.info(f"✅ Drift baseline loaded from {DRIFT_BASELINE_PATH} ({drift_monitor.dim}-d)")
+    except Exception as e:
+        logger.warning(f"⚠️ Could not load drift baseline at {DRIFT_BASELINE_PATH}: {e}")
+
+def reload_models(version=None, shadow=False, fraction=None, promote=False):
+    """Load `version` in the background, then swap it in (or attach it as the shadow).
+
+    With `promote`, CURRENT is pointed at `version` once the reload slot is
+    claimed (ValueError for an unknown version). A version that is already
+    loaded as the shadow is swapped in as is rather than loaded again.
+    Returns False when another load is already running.
+    """
+    if not reload_lock.acquire(blocking=False):
+        return False
+    if promote:
+        try:
+            model_registry.promote(MODEL_REGISTRY_DIR, version)
+        except Exception:
+            reload_lock.release()
+            raise
+    reload_state.update(state="loading", version=version, shadow=shadow, error=None,
+                        started=datetime.now().isoformat())
+    
+    def worker():
+        global shadow_bundle, shadow_fraction
+        try:
+            if not shadow and version and shadow_bundle is not None and shadow_bundle.version == version:
+                bundle, shadow_bundle = shadow_bundle, None
+                logger.info(f"👥 Promoting shadow version {version} without reloading it")
+            else:
+                bundle = load_bundle(version)
+            if shadow:
+                previous, shadow_bundle = shadow_bundle, bundle
+                if fraction is not None:
+                    shadow_fraction = fraction
+                logger.info(f"👥 Shadowing {shadow_fraction:.0%} of predictions to version {bundle.version}")
+            else:
+                previous = None
+                activate(bundle)
+            if previous is not None:
+                retired_bundles.put(previous)
+            gc_policy.freeze()
+            reload_state.update(state="idle", version=bundle.version)
+            readiness.update(status="ready", message=None)
+        except Exception as e:
+            logger.error(f"❌ Error reloading models: {str(e)}")
+            logger.error(traceback.format_exc())
+            reload_state.update(state="failed", error=str(e))
+            # Still serving the previous version
+            if models_loaded:
+                readiness.update(status="degraded", message=f"Model reload failed; serving {active_bundle.version}")
+        finally:
+            reload_lock.release()
+    
+    threading.Thread(target=worker, daemon=True).start()
+    return True
+
+def stop_shadow():
+    """Detach the shadow version and release it"""
+    global shadow_bundle
+    previous, shadow_bundle = shadow_bundle, None
+    if previous is not None:
+        retired_bundles.put(previous)
+        logger.info(f"👥 Stopped shadowing version {previous.version}")
+
+def watch_registry(interval):
+    """Poll the registry's CURRENT pointer and the active files; reload when either changes"""
+    attempted = None
+    while True:
+        time.sleep(interval)
+        bundle = active_bundle
+        if bundle is None or reload_state["state"] == "loading":
+            continue
+        try:
+            version = model_registry.current_version(MODEL_REGISTRY_DIR)
+            mtime = model_registry.artifacts_mtime(bundle.artifacts)
+            changed = (version is not None and version != bundle.version) or mtime > bundle.loaded_at
+            # Retry a failed load only once the pointer or files change again
+            if changed and (version, mtime) != attempted:
+                attempted = (version, mtime)
+                logger.info(f"👀 Model artifacts changed ({bundle.version} -> {version or 'legacy files'}), reloading")
+                reload_models(version)
+        except Exception as e:
+            logger.warning(f"⚠️ Model watcher error: {e}")
+
+def class_probabilities(probs):
+    """Map a probability vector onto DISEASE_CLASSES names"""
+    return {name: round(float(p), 4) for name, p in zip(DISEASE_CLASSES, probs)}
+
+def stack_probabilities(features, model=None):
+    """Stacking-model class probabilities for each row, aligned with DISEASE_CLASSES"""
+    model = model if model is not None else rf_model
+    proba = model.predict_proba(features)
+    aligned = np.zeros((len(proba), len(DISEASE_CLASSES)), dtype=np.float32)
+    aligned[:, model.classes_.astype(int)] = proba
+    return aligned
+
+def classify(bundle, features, cnn_probs, timer="stack_predict"):
+    """Final probabilities for one embedding; a confident cascade first stage skips the stack.
+
+    Returns `(final_probs, stack_probs or None, stage)`.
+    """
+    if bundle.cascade.enabled:
+        first_probs = bundle.cascade.first_stage(features, cnn_probs[None, :])[0]
+        if bundle.cascade.accepts(first_probs):
+            return first_probs, None, bundle.cascade.mode
+    stack_start = time.perf_counter()
+    stack_probs = stack_probabilities(features, bundle.rf_model)[0]
+    metrics.observe(timer, time.perf_counter() - stack_start)
+    return stack_probs, stack_probs, "stack"
+
+def model_client():
+    """This thread's model server connection, opened on first use"""
+    client = getattr(model_clients, "client", None)
+    if client is None:
+        client = model_clients.client = ModelClient(MODEL_SERVER_SOCKET)
+    return client
+
+def infer_remote(img):
+    """Score one preprocessed image on the model server"""
+    try:
+        result = model_client().infer(img)
+    except (OSError, ConnectionError):
+        # Reconnect on the next request, e.g. after a model server restart
+        client, model_clients.client = getattr(model_clients, "client", None), None
+        if client is not None:
+            client.close()
+        readiness.update(status="degraded", ready=False, message="Model server unavailable")
+        raise
+    if readiness.state["status"] != "ready" or readiness.state["model_version"] != result.version:
+        readiness.update(status="ready", ready=True, message=None, model_version=result.version)
+    return result
+
+def infer_local(img, buffers, explain_image=False):
+    """Score one preprocessed image with the models loaded in this process.
+
+    Returns `(Inference, heatmap)`; with `explain_image` the same forward pass
+    also yields a Grad-CAM heatmap of the final class, otherwise the heatmap is None.
+    """
+    heatmap = tape = None
+    # The request finishes on the version it started with, even if a reload swaps it meanwhile
+    with active_bundle.use() as bundle:
+        # Force CPU processing; calling the model directly skips predict()'s per-call dataset setup
+        with tf.device('/CPU:0'):
+            if explain_image and bundle.explain_model is not None:
+                tape, conv, pooled, cnn_output = explain.forward(bundle.explain_model, img)
+            else:
+                pooled, cnn_output = bundle.serving_model(img, training=False)
+            features = buffers.feature_row(int(np.prod(pooled.shape[1:])))
+            features[...] = np.reshape(pooled, (1, -1))
+            cnn_probs = np.asarray(cnn_output)[0]
+        
+        # A confident first stage answers without the stacking ensemble
+        final_probs, stack_probs, stage = classify(bundle, features, cnn_probs)
+        
+        # Explain the class that is reported, which the stack may have changed from the CNN's top class
+        if tape is not None:
+            with tf.device('/CPU:0'):
+                heatmap, seconds = explain.heatmap(tape, conv, cnn_output, int(np.argmax(final_probs)))
+            metrics.observe("explain", seconds)
+            request_log.current().add("explain", seconds)
+    result = Inference(features, cnn_probs, final_probs, stack_probs, stage, bundle.version, bundle.cnn_version)
+    return result, heatmap
+
+def save_explanation(digest, version, buffers, heatmap):
+    """Render a heatmap over the resized model input and cache it; returns the overlay path"""
+    start = time.perf_counter()
+    path = explanation_cache.put(digest, version, explain.render_overlay(cv2.cvtColor(buffers.resized, cv2.COLOR_RGB2BGR), heatmap))
+    metrics.observe("explain_render", time.perf_counter() - start)
+    metrics.incr("explanations")
+    return path
+
+def find_duplicate(image):
+    """Perceptual hash of a resized upload and the earlier prediction it duplicates, or None"""
+    start = time.perf_counter()
+    fingerprint = dedup.phash(image)
+    metrics.observe("phash", time.perf_counter() - start)
+    start = time.perf_counter()
+    match = duplicate_index.lookup(fingerprint)
+    metrics.observe("dedup_lookup", time.perf_counter() - start)
+    if match is None:
+        return fingerprint, None
+    distance, previous = match
+    # Results from a version that has since been swapped out are not reused
+    if previous.result.version != readiness.state["model_version"]:
+        return fingerprint, None
+    request_log.current().set(duplicate_distance=distance)
+    return fingerprint, previous
+
+def find_similar_cases(result):
+    """Nearest indexed cases to a prediction's embedding, or None"""
+    index = similarity_index
+    if index is None:
+        return None
+    # Embeddings from another CNN version live in a different space
+    if index.model_version and index.model_version != result.cnn_version:
+        metrics.incr("similar_version_mismatch")
+        return None
+    start = time.perf_counter()
+    cases = index.neighbours(result.features, SIMILAR_CASES_K)
+    metrics.observe("similar_search", time.perf_counter() - start)
+    for case in cases:
+        # Labels are ground-truth class indices (y_*.npy or the store); served uploads have none
+        if case["label"].isdigit() and int(case["label"]) < len(DISEASE_CLASSES):
+            case["label"] = DISEASE_CLASSES[int(case["label"])]
+    return cases
+
+def track_drift(result):
+    """Fold a prediction into the running drift statistics"""
+    monitor = drift_monitor
+    if monitor is None:
+        return
+    # A baseline describes one CNN's embedding space
+    if monitor.model_version and monitor.model_version != result.cnn_version:
+        metrics.incr("drift_version_mismatch")
+        return
+    start = time.perf_counter()
+    # The baseline's class and confidence profile comes from the stack; cascade early exits
+    # (CNN scores above the exit threshold) would read as confidence drift
+    monitor.update(result.features, result.stack_probs if result.stage == "stack" else None)
+    metrics.observe("drift_update", time.perf_counter() - start)
+
+def shadow_predict(bundle, img, primary_class):
+    """Score a copied input on the shadow version and record latency and agreement"""
+    try:
+        start = time.perf_counter()
+        with bundle.use():
+            with tf.device('/CPU:0'):
+                pooled, cnn_output = bundle.serving_model(img, training=False)
+            features = np.reshape(pooled, (1, -1))
+            final_probs, _, stage = classify(bundle, features, np.asarray(cnn_output)[0],
+                                               timer="shadow_stack_predict")
+        metrics.observe("shadow_inference", time.perf_counter() - start)
+        metrics.incr("shadow_requests")
+        metrics.incr(f"shadow_stage_{stage}")
+        if int(np.argmax(final_probs)) == primary_class:
+            metrics.incr("shadow_agree")
+    except Exception as e:
+        metrics.incr("shadow_errors")
+        logger.warning(f"⚠️ Shadow prediction failed: {e}")
+    finally:
+        shadow_slot.release()
+
+def maybe_shadow(img, primary_class):
+    """Mirror a sample of requests to the shadow version, dropping them while it is busy"""
+    bundle = shadow_bundle
+    if bundle is None or random.random() >= shadow_fraction:
+        return
+    if not shadow_slot.acquire(blocking=False):
+        metrics.incr("shadow_dropped")
+        return
+    # The pooled input buffer is reused by this thread's next request
+    shadow_executor.submit(shadow_predict, bundle, np.array(img, copy=True), primary_class)
 
 # -------------------------------
 # UTILITIES
 # -------------------------------
-def preprocess_image(image_path):
-    """Preprocess image with memory optimization"""
+def preprocess_image(image_path, buffers=None):
+    """Preprocess image with memory optimization.
+
+    When `buffers` (a WorkerBuffers) is given the image is resized and
+    normalized in place into its preallocated batch, which is returned.
+    """
     try:
-        logger.info(f"🔄 Preprocessing image: {image_path}")
-        
-        # Read image
-        img = cv2.imread(image_path)
-        if img is None:
-            raise ValueError(f"Could not read image from {image_path}")
-        
-        # Resize image to reduce memory usage
-        img = cv2.resize(img, (224, 224))
+        logger.debug(f"🔄 Preprocessing image: {image_path}")
         
-        # Normalize and convert to float32 (uses less memory than float64)
-        img = img.astype(np.float32) / 255.0
+        # DICOM is windowed straight to model size from memory-mapped pixels
+        if dicom.is_dicom_path(image_path):
+            return preprocess_dicom(image_path, buffers)[0]
         
-        # Add batch dimension
-        img = np.expand_dims(img, axis=0)
+        # Read image (BGR, like cv2.imread)
+        img = preprocessing.decode(image_path)
         
-        logger.info("✅ Image preprocessed successfully")
-        return img
+        return preprocess_array(img, buffers)
         
     except Exception as e:
         logger.error(f"❌ Error preprocessing image: {str(e)}")
         raise
 
+def preprocess_dicom(image_path, buffers=None, report_path=None):
+    """Preprocess one DICOM frame; also writes a PNG rendition to `report_path` when given.
+
+    Returns `(batch, report_path)`.
+    """
+    with dicom.DicomImage(image_path) as image:
+        frame = image.frame(int(DICOM_FRAME) if DICOM_FRAME else None)
+        if report_path is not None:
+            # The PDF report cannot embed DICOM, so keep a viewable rendition
+            cv2.imwrite(report_path, image.render(frame, image.fit(REPORT_MAX_SIDE or 1024)))
+        batch = preprocess_array(image.render(frame, (224, 224)), buffers)
+        logger.debug(f"✅ DICOM preprocessed ({image.frames} frame(s), {image.bits_allocated}-bit)")
+    return batch, report_path
+
+def preprocess_array(img, buffers=None):
+    """Convert a decoded BGR uint8 image into a model batch the way training did (RGB, nearest, 1/255)"""
+    if buffers is not None:
+        batch = resize_normalize_into(img, buffers)
+    else:
+        batch = preprocessing.preprocess_batch([img])
+    logger.debug("✅ Image preprocessed successfully")
+    return batch
+
 def cleanup_old_files():
     """Clean up old uploaded files and reports"""
     try:
@@ -208,9 +769,6 @@ def cleanup_old_files():
                     if current_time - os.path.getmtime(file_path) > 3600:  # 1 hour
                         os.remove(file_path)
                         logger.info(f"🗑️ Cleaned up old report: {filename}")
-        
-        # Force garbage collection after cleanup
-        gc.collect()
                         
     except Exception as e:
         logger.warning(f"⚠️ Error during cleanup: {str(e)}")
@@ -224,14 +782,21 @@ def ensure_startup():
         
         # Load models in background thread
         def load_models_background():
-            success = load_models()
+            success = models_loaded or prepare_inference()
             if success:
                 logger.info("🎉 System ready for predictions!")
+                # Import what the other routes need now rather than on their first request
+                if APP_ROLE == "full":
+                    lazy_imports.preload(*ROUTE_MODULES)
             else:
                 logger.error("❌ System startup failed - models not loaded")
         
         # Start model loading in background
-        threading.Thread(target=load_models_background, daemon=True).start()
+        if SERVES_PREDICTIONS:
+            threading.Thread(target=load_models_background, daemon=True).start()
+        else:
+            logger.info("🌐 APP_ROLE=web: no models in this process, /predict is disabled")
+            readiness.update(status="ready", ready=True, predictions=False)
         
         # Start cleanup scheduler
         def periodic_cleanup():
@@ -240,696 +805,57 @@ def ensure_startup():
                 cleanup_old_files()
         
         threading.Thread(target=periodic_cleanup, daemon=True).start()
+        
+        # Pick up new model versions without a restart
+        if MODEL_WATCH_INTERVAL > 0:
+            threading.Thread(target=watch_registry, args=(MODEL_WATCH_INTERVAL,), daemon=True).start()
         startup_complete = True
 
 # -------------------------------
-# HTML TEMPLATE
+# PAGE AND STATIC ASSETS
 # -------------------------------
-chatbot_html = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-<meta charset="UTF-8">
-<meta name="viewport" content="width=device-width, initial-scale=1.0">
-<title>Multi-Chronic Disease Detection Chatbot</title>
-<style>
-@import url('https://fonts.googleapis.com/css2?family=Roboto:wght@400;500;700&display=swap');
-
-:root {
-    --primary: #667eea;
-    --secondary: #764ba2;
-    --tertiary: #f2f4f8;
-    --card-bg: rgba(255,255,255,0.92);
-    --bot-bg: rgba(255,255,255,0.88);
-    --user-bg: #764ba2;
-    --border-radius: 22px;
-    --indicator-shadow: 0 2px 8px rgba(0,0,0,0.15);
-    --error-color: #e74c3c;
-    --success-color: #27ae60;
-    --warning-color: #f39c12;
-}
-
-body {
-    font-family: 'Roboto', sans-serif;
-    margin: 0;
-    min-height: 100vh;
-    display: flex;
-    justify-content: center;
-    align-items: center;
-    background: linear-gradient(135deg,#667eea,#764ba2 60%, #f2f4f8 100%);
-    position: relative;
-    overflow: hidden;
-}
-
-.floating-elements {
-    position: fixed;
-    top: 0;
-    left: 0;
-    width: 100%;
-    height: 100%;
-    pointer-events: none;
-    z-index: 0;
-}
-
-.floating-circle {
-    position: absolute;
-    border-radius: 50%;
-    background: rgba(255, 255, 255, 0.1);
-    animation: float 15s infinite ease-in-out;
-}
-
-.floating-circle:nth-child(1) {
-    width: 80px;
-    height: 80px;
-    top: 20%;
-    left: 10%;
-    animation-delay: 0s;
-    animation-duration: 20s;
-}
-
-.floating-circle:nth-child(2) {
-    width: 120px;
-    height: 120px;
-    top: 60%;
-    right: 15%;
-    animation-delay: -5s;
-    animation-duration: 25s;
-}
-
-.floating-circle:nth-child(3) {
-    width: 60px;
-    height: 60px;
-    top: 80%;
-    left: 20%;
-    animation-delay: -10s;
-    animation-duration: 18s;
-}
-
-@keyframes float {
-    0%, 100% { transform: translateY(0px) rotate(0deg); }
-    25% { transform: translateY(-20px) rotate(90deg); }
-    50% { transform: translateY(-40px) rotate(180deg); }
-    75% { transform: translateY(-20px) rotate(270deg); }
-}
-
-.container {
-    width: 100%;
-    max-width: 560px;
-    height: 90vh;
-    background: rgba(255,255,255,0.13);
-    backdrop-filter: blur(25px);
-    border-radius: var(--border-radius);
-    box-shadow: 0 25px 50px rgba(0,0,0,0.15), 0 0 0 1px rgba(255,255,255,0.2);
-    display: flex;
-    flex-direction: column;
-    overflow: hidden;
-    border: 1px solid rgba(255,255,255,0.22);
-    position: relative;
-    z-index: 1;
-    animation: containerFloat 8s ease-in-out infinite;
-}
-
-@keyframes containerFloat {
-    0%, 100% { transform: translateY(0px); }
-    50% { transform: translateY(-10px); }
-}
-
-.chat-header {
-    background: linear-gradient(135deg, #667eea, #764ba2 80%);
-    color: #fff;
-    padding: 24px;
-    font-size: 1.42rem;
-    font-weight: 700;
-    text-align: center;
-    letter-spacing: 1.2px;
-    box-shadow: 0 1px 10px rgba(118, 75, 162, 0.08);
-    border-bottom: 1px solid rgba(255,255,255,0.15);
-    position: relative;
-    overflow: hidden;
-}
-
-.status-dot {
-    position: absolute;
-    top: 20px;
-    right: 20px;
-    width: 12px;
-    height: 12px;
-    background: var(--success-color);
-    border-radius: 50%;
-    box-shadow: 0 0 0 4px rgba(39, 174, 96, 0.3);
-    animation: pulse 2s infinite;
-}
-
-.status-dot.error {
-    background: var(--error-color);
-    box-shadow: 0 0 0 4px rgba(231, 76, 60, 0.3);
-}
-
-@keyframes pulse {
-    0% { box-shadow: 0 0 0 0 rgba(39, 174, 96, 0.7); }
-    70% { box-shadow: 0 0 0 10px rgba(39, 174, 96, 0); }
-    100% { box-shadow: 0 0 0 0 rgba(39, 174, 96, 0); }
-}
-
-.chat-window {
-    flex-grow: 1;
-    padding: 24px 20px;
-    overflow-y: auto;
-    display: flex;
-    flex-direction: column;
-    gap: 8px;
-    background: none;
-    position: relative;
-}
-
-.chat-window::-webkit-scrollbar {
-    width: 8px;
-}
-.chat-window::-webkit-scrollbar-thumb {
-    background: rgba(102, 126, 234, 0.14);
-    border-radius: 5px;
-}
-
-.message {
-    max-width: 82%;
-    padding: 16px 20px;
-    border-radius: 18px;
-    margin-bottom: 12px;
-    line-height: 1.52;
-    word-wrap: break-word;
-    background: var(--card-bg);
-    box-shadow: 0 2px 12px rgba(130,140,153,0.06);
-    animation: messageFloat 0.6s cubic-bezier(0.4,0,0.2,1);
-    font-size: 1.05rem;
-    position: relative;
-    transition: transform 0.3s ease, box-shadow 0.3s ease;
-}
-
-.message:hover {
-    transform: translateY(-2px);
-    box-shadow: 0 8px 25px rgba(130,140,153,0.12);
-}
-
-@keyframes messageFloat {
-    0% { 
-        opacity: 0; 
-        transform: translateY(30px) scale(0.9);
-    }
-    50% {
-        opacity: 0.8;
-        transform: translateY(-5px) scale(1.02);
-    }
-    100% { 
-        opacity: 1; 
-        transform: translateY(0) scale(1);
-    }
-}
-
-.bot-message {
-    background: var(--bot-bg);
-    color: #212941;
-    align-self: flex-start;
-    box-shadow: 0 2px 10px rgba(118, 75, 162, 0.06);
-    border-left: 3px solid rgba(118, 75, 162, 0.3);
-}
-
-.bot-message strong { color: #764ba2; }
-
-.user-message {
-    background: var(--user-bg);
-    color: #fff;
-    align-self: flex-end;
-    box-shadow: 0 2px 10px rgba(102, 126, 234, 0.10);
-    border-right: 3px solid rgba(255, 255, 255, 0.3);
-}
-
-.error-message {
-    background: linear-gradient(135deg, #e74c3c, #c0392b);
-    color: #fff;
-    border-left: 3px solid rgba(255, 255, 255, 0.5);
-}
-
-.success-message {
-    background: linear-gradient(135deg, #27ae60, #2ecc71);
-    color: #fff;
-    border-left: 3px solid rgba(255, 255, 255, 0.5);
-}
-
-.disease-indicator {
-    display: inline-block;
-    width: 15px;
-    height: 15px;
-    border-radius: 50%;
-    margin-right: 8px;
-    vertical-align: middle;
-    box-shadow: var(--indicator-shadow);
-    position: relative;
-    cursor: pointer;
-    animation: indicatorPulse 2s infinite;
-}
-
-@keyframes indicatorPulse {
-    0%, 100% { transform: scale(1); }
-    50% { transform: scale(1.1); }
-}
-
-.disease-indicator.copd { background-color: #e74c3c; }
-.disease-indicator.fibrosis { background-color: #f39c12; }
-.disease-indicator.normal { background-color: #27ae60; }
-.disease-indicator.pneumonia { background-color: #e67e22; }
-.disease-indicator.tb { background-color: #8e44ad; }
-
-.chat-input-area {
-    border-top: 1px solid rgba(255,255,255,0.13);
-    background: rgba(255,255,255,0.10);
-    padding: 18px 16px 16px 16px;
-    display: flex;
-    flex-direction: column;
-    position: relative;
-}
-
-.action-buttons {
-    display: flex;
-    justify-content: space-between;
-    gap: 14px;
-    margin-bottom: 12px;
-}
-
-.action-buttons button {
-    flex-grow: 1;
-    padding: 13px 0;
-    font-size: 1.08rem;
-    background: linear-gradient(136deg,#667eea 40%,#764ba2 100%);
-    color: white;
-    border: none;
-    border-radius: 14px;
-    cursor: pointer;
-    font-weight: 540;
-    letter-spacing: 0.02em;
-    box-shadow: 0 4px 14px rgba(102, 126, 234, 0.06);
-    transition: all 0.3s cubic-bezier(0.4,0,0.2,1);
-    outline: none;
-    position: relative;
-    overflow: hidden;
-}
-
-.action-buttons button:hover:not(:disabled) {
-    background: linear-gradient(136deg,#667eea 20%,#b191db 100%);
-    transform: translateY(-3px) scale(1.05);
-    box-shadow: 0 8px 30px rgba(118, 75, 162, 0.2);
-}
-
-.action-buttons button:disabled {
-    background: linear-gradient(136deg, #b8bdd9 30%, #c7b7e4 70%);
-    cursor: not-allowed;
-    opacity: 0.6;
-    transform: none;
-}
-
-#message-input {
-    width: 100%;
-    border: 1px solid rgba(145,145,180,0.26);
-    border-radius: 14px;
-    padding: 13px;
-    font-size: 1.09rem;
-    background: rgba(255,255,255,0.18);
-    color: #212941;
-    transition: all 0.3s ease;
-}
-
-#message-input::placeholder { 
-    color: rgba(145,145,180,0.56);
-}
-
-#message-input:focus { 
-    outline: none; 
-    border-color: #764ba2; 
-    box-shadow: 0 0 15px rgba(118, 75, 162, 0.3);
-    background: rgba(255,255,255,0.25);
-}
-
-.loading-dots {
-    display: inline-block;
-    position: relative;
-    width: 40px;
-    height: 10px;
-}
-
-.loading-dots div {
-    position: absolute;
-    top: 0;
-    width: 6px;
-    height: 6px;
-    border-radius: 50%;
-    background: #764ba2;
-    animation-timing-function: cubic-bezier(0, 1, 1, 0);
-}
-
-.loading-dots div:nth-child(1) {
-    left: 4px;
-    animation: loading1 0.6s infinite;
-}
-
-.loading-dots div:nth-child(2) {
-    left: 4px;
-    animation: loading2 0.6s infinite;
-}
-
-.loading-dots div:nth-child(3) {
-    left: 16px;
-    animation: loading2 0.6s infinite;
-}
-
-.loading-dots div:nth-child(4) {
-    left: 28px;
-    animation: loading3 0.6s infinite;
-}
-
-@keyframes loading1 {
-    0% { transform: scale(0); }
-    100% { transform: scale(1); }
-}
-
-@keyframes loading3 {
-    0% { transform: scale(1); }
-    100% { transform: scale(0); }
-}
-
-@keyframes loading2 {
-    0% { transform: translate(0, 0); }
-    100% { transform: translate(12px, 0); }
-}
-
-.doctor-card { 
-    background: var(--card-bg); 
-    padding: 12px; 
-    margin: 6px 0; 
-    border-radius: 13px;
-    transition: transform 0.3s ease, box-shadow 0.3s ease;
-    border-left: 3px solid #764ba2;
-}
-
-.doctor-card:hover {
-    transform: translateX(5px);
-    box-shadow: 0 5px 20px rgba(118, 75, 162, 0.1);
-}
-
-.doctor-card a { 
-    color: #764ba2; 
-    text-decoration: none; 
-    font-weight: 500; 
-}
-
-.pdf-preview { 
-    background: var(--card-bg); 
-    padding: 13px; 
-    margin: 6px 0; 
-    border-radius: 13px; 
-    text-align: center;
-    animation: pulseGlow 2s infinite;
-}
-
-@keyframes pulseGlow {
-    0%, 100% { box-shadow: 0 0 5px rgba(118, 75, 162, 0.3); }
-    50% { box-shadow: 0 0 20px rgba(118, 75, 162, 0.6); }
-}
-
-@media (max-width: 600px) {
-    .container { 
-        max-width: 95vw; 
-        border-radius: 20px; 
-        height: 95vh;
-    }
-    .chat-header { 
-        font-size: 1.1rem; 
-        padding: 16px;
-    }
-    .chat-window { 
-        padding: 16px; 
-    }
-    .action-buttons button { 
-        font-size: 0.95rem; 
-        padding: 11px 0;
-    }
-}
-</style>
-</head>
-<body>
-<div class="floating-elements">
-    <div class="floating-circle"></div>
-    <div class="floating-circle"></div>
-    <div class="floating-circle"></div>
-</div>
-
-<div class="container">
-    <div class="chat-header">
-        Multi-Chronic Disease Detection Chatbot
-        <div class="status-dot" id="status-dot"></div>
-    </div>
-    <div class="chat-window" id="chat-window"></div>
-    <div class="chat-input-area">
-        <div class="action-buttons">
-            <button id="find-doctors-btn" disabled title="Find nearby respiratory doctors">Find Doctors</button>
-            <button id="download-report-btn" disabled title="Download medical PDF report">Download Report</button>
-            <button id="upload-xray-btn" title="Upload your X-ray image for analysis">Upload X-ray</button>
-        </div>
-        <div class="message-input-bar">
-            <input type="text" id="message-input" placeholder="Type a message..." disabled aria-label="Chat input">
-        </div>
-    </div>
-    <input type="file" id="file-input" accept="image/*" style="display:none;">
-</div>
-
-<script>
-function getDiseaseIndicator(disease) {
-    const indicators = {
-        "COPD": {class: "copd", text: "COPD - Chronic Obstructive Pulmonary Disease"},
-        "fibrosis": {class: "fibrosis", text: "Fibrosis - Lung Scarring"},
-        "normal": {class: "normal", text: "Normal - Healthy Lungs"},
-        "pneumonia": {class: "pneumonia", text: "Pneumonia - Lung Infection"},
-        "pulmonary tb": {class: "tb", text: "Tuberculosis - Bacterial Infection"}
-    };
-    return indicators[disease] || {class: "normal", text: "Normal - Healthy Lungs"};
-}
-
-const chatWindow = document.getElementById('chat-window');
-const uploadBtn = document.getElementById('upload-xray-btn');
-const fileInput = document.getElementById('file-input');
-const doctorsBtn = document.getElementById('find-doctors-btn');
-const reportBtn = document.getElementById('download-report-btn');
-const messageInput = document.getElementById('message-input');
-const statusDot = document.getElementById('status-dot');
-
-function addMessage(message, sender='bot', type='normal') {
-    const div = document.createElement('div');
-    let className = `message ${sender}-message`;
-    if (type === 'error') className += ' error-message';
-    if (type === 'success') className += ' success-message';
-    
-    div.className = className;
-    div.innerHTML = message;
-    chatWindow.appendChild(div);
-    chatWindow.scrollTop = chatWindow.scrollHeight;
-}
-
-function addLoadingMessage() {
-    const loadingHtml = `
-        Processing your X-ray image... 
-        <div class="loading-dots">
-            <div></div><div></div><div></div><div></div>
-        </div>
-    `;
-    addMessage(loadingHtml, 'bot');
-}
-
-function removeLastMessage() {
-    const messages = chatWindow.querySelectorAll('.message');
-    if (messages.length > 0) {
-        const lastMessage = messages[messages.length - 1];
-        if (lastMessage.innerHTML.includes('loading-dots')) {
-            lastMessage.remove();
-        }
-    }
-}
-
-function updateStatusDot(isHealthy) {
-    if (isHealthy) {
-        statusDot.classList.remove('error');
-    } else {
-        statusDot.classList.add('error');
+# The template has no per-request variables: render and compress it once
+pages = page_cache.PageCache(
+    os.path.join(BASE_DIR, "templates", "chatbot.html"),
+    os.path.join(BASE_DIR, "static"),
+    render=lambda source, **context: app.jinja_env.from_string(source).render(**context),
+    context={
+        "upload_mode": UPLOAD_MODE,
+        "compact_upload_size": COMPACT_UPLOAD_SIZE,
+        "report_max_side": REPORT_MAX_SIDE,
     }
-}
-
-async function checkHealth() {
-    try {
-        const response = await fetch('/health');
-        const data = await response.json();
-        updateStatusDot(data.status === 'healthy' && data.models_loaded);
-        
-        if (!data.models_loaded) {
-            addMessage("⚠️ <strong>System Warning:</strong> AI models are loading. Please wait a moment before uploading images.", 'bot', 'error');
-        }
-    } catch (error) {
-        updateStatusDot(false);
-        addMessage("❌ <strong>System Error:</strong> Cannot connect to server. Please refresh the page.", 'bot', 'error');
-    }
-}
-
-checkHealth();
-setInterval(checkHealth, 10000); // Check every 10 seconds
-
-addMessage(`
-    <strong>Hello! Welcome to our AI Medical Assistant</strong><br>
-    <span style='color:#767c8b;font-size:.95em;'>
-        Upload your chest X-ray to begin advanced disease detection analysis.
-        Our AI system can identify multiple chronic conditions with high accuracy.
-    </span>
-`, 'bot');
-
-uploadBtn.addEventListener('click', () => fileInput.click());
-
-fileInput.addEventListener('change', async(event) => {
-    const file = event.target.files[0];
-    if (!file) return;
-    
-    const validTypes = ['image/jpeg', 'image/png', 'image/gif', 'image/bmp', 'image/tiff'];
-    if (!validTypes.includes(file.type)) {
-        addMessage("❌ <strong>Invalid File Type:</strong> Please upload a valid image file (JPEG, PNG, GIF, BMP, or TIFF).", 'bot', 'error');
-        return;
-    }
-    
-    if (file.size > 16 * 1024 * 1024) {
-        addMessage("❌ <strong>File Too Large:</strong> Please upload an image smaller than 16MB.", 'bot', 'error');
-        return;
-    }
-    
-    addMessage(`📤 <strong>Uploading:</strong> ${file.name}<br><span style='font-size:0.9em;color:#767c8b;'>File size: ${(file.size/1024/1024).toFixed(2)} MB</span>`, 'bot');
-    
-    const formData = new FormData();
-    formData.append('file', file);
-
-    try {
-        addLoadingMessage();
-        uploadBtn.disabled = true;
-        uploadBtn.textContent = 'Processing...';
-        
-        const controller = new AbortController();
-        const timeoutId = setTimeout(() => controller.abort(), 180000); // 3 minutes timeout
-        
-        const response = await fetch('/predict', {
-            method: 'POST',
-            body: formData,
-            signal: controller.signal
-        });
-        
-        clearTimeout(timeoutId);
-        const data = await response.json();
-        
-        removeLastMessage();
-        
-        if (data.status === 'success') {
-            const indicatorInfo = getDiseaseIndicator(data.disease);
-            addMessage(
-                `<span class="disease-indicator ${indicatorInfo.class}" data-tooltip="${indicatorInfo.text}"></span>
-                 <strong>Analysis Complete!</strong><br>
-                 <strong>Detected Condition:</strong> ${data.disease.toUpperCase()}<br>
-                 <span style='color:#767c8b;font-size:.9em;'>
-                    Hover over the colored indicator for more information
-                 </span>
-                `, 'bot', 'success');
-            doctorsBtn.disabled = false;
-            reportBtn.disabled = false;
-            messageInput.disabled = false;
-        } else {
-            addMessage(`❌ <strong>Error:</strong> ${data.error}`, 'bot', 'error');
-        }
-    } catch (err) {
-        removeLastMessage();
-        if (err.name === 'AbortError') {
-            addMessage("⏱️ <strong>Timeout:</strong> Processing took too long. Server may be under heavy load. Please try again later.", 'bot', 'error');
-        } else {
-            addMessage("⚠️ <strong>Connection Failed:</strong> Server resources may be exhausted. Please try again in a few moments.", 'bot', 'error');
-        }
-    } finally {
-        uploadBtn.disabled = false;
-        uploadBtn.textContent = 'Upload X-ray';
-    }
-});
-
-reportBtn.addEventListener('click', () => {
-    addMessage(`
-        <div class='pdf-preview'>
-            📄 <strong>Generating comprehensive medical report...</strong><br>
-            <span style='font-size:0.9em;color:#767c8b;'>Including analysis results, recommendations, and disclaimers</span><br>
-            <a href='/generate_report' target='_blank'>📥 View & Download PDF Report</a>
-        </div>
-    `, 'bot');
-});
-
-doctorsBtn.addEventListener('click', () => {
-    addMessage("🔍 <strong>Locating nearby medical specialists...</strong><br><span style='font-size:0.9em;color:#767c8b;'>Searching for respiratory and pulmonary experts in your area</span>", 'bot');
-    
-    if (!navigator.geolocation) {
-        addMessage("❌ <strong>Location Error:</strong> Geolocation is not supported by your browser. Please enable location services.", 'bot', 'error');
-        return;
-    }
-    
-    navigator.geolocation.getCurrentPosition(async(pos) => {
-        const {latitude, longitude} = pos.coords;
-        try {
-            const resp = await fetch('/get_doctors', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({latitude, longitude})
-            });
-            const data = await resp.json();
-            if (data.doctors && data.doctors.length > 0) {
-                let html = "🏥 <strong>Found Nearby Specialists:</strong><br><br>";
-                data.doctors.slice(0, 5).forEach((doc, index) => {
-                    html += `<div class='doctor-card'>
-                        <strong>${index + 1}. ${doc.name}</strong><br>
-                        <a href='https://www.google.com/maps/search/?api=1&query=${encodeURIComponent(doc.location)}' target='_blank'>
-                            📍 ${doc.location}
-                        </a>
-                    </div>`;
-                });
-                addMessage(html, 'bot');
-            } else {
-                addMessage("❌ <strong>No Results:</strong> No medical specialists found in your immediate area.", 'bot', 'error');
-            }
-        } catch (err) {
-            addMessage("⚠️ <strong>Search Failed:</strong> Unable to fetch doctor information. Please try again later.", 'bot', 'error');
-        }
-    }, (error) => {
-        addMessage("❌ <strong>Location Access Denied:</strong> Please enable location permissions.", 'bot', 'error');
-    });
-});
-
-messageInput.addEventListener('keypress', (e) => {
-    if (e.key === 'Enter' && !messageInput.disabled) {
-        const message = messageInput.value.trim();
-        if (message) {
-            addMessage(message, 'user');
-            messageInput.value = '';
-            
-            setTimeout(() => {
-                addMessage("Thank you for your message! For detailed medical advice, please consult with a healthcare professional or use our diagnostic tools.", 'bot');
-            }, 1000);
-        }
-    }
-});
-</script>
-</body>
-</html>
-"""
+)
 
 # -------------------------------
 # ROUTES
 # -------------------------------
+@app.before_request
+def begin_request_log():
+    request_log.begin(request.method, request.path)
+
+@app.after_request
+def record_request_status(response):
+    request_log.current().status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_log(exc=None):
+    # Runs when the request context ends: after the view returns, or after the body for streams wrapped in
+    # stream_with_context (/events). An unhandled exception leaves no status (logged as an error)
+    request_log.finish()
+
 @app.route("/")
 def index(): 
     ensure_startup()  # Ensure startup tasks run on first request
-    return render_template_string(chatbot_html)
+    return pages.respond(pages.page, request, Response)
+
+@app.route("/assets/<name>")
+def asset(name):
+    """Content-hashed CSS/JS, cacheable forever"""
+    cached = pages.assets.get(name)
+    if cached is None:
+        return jsonify({"status": "error", "error": "Endpoint not found."}), 404
+    return pages.respond(cached, request, Response)
 
 @app.route("/health")
 def health_check():
@@ -937,31 +863,153 @@ def health_check():
     ensure_startup()  # Ensure startup tasks run
     return jsonify({
         "status": "healthy",
+        "role": APP_ROLE,
         "models_loaded": models_loaded,
+        "model_version": active_bundle.version if active_bundle is not None else None,
         "memory_usage_mb": get_memory_usage(),
+        "gc": gc_policy.stats(),
+        "imports": lazy_imports.stats(),
         "timestamp": datetime.now().isoformat()
     })
 
+@app.route("/livez")
+def livez():
+    """Liveness: the process answers; no startup work, no syscalls"""
+    return Response(b'{"status": "alive"}', content_type="application/json")
+
+@app.route("/readyz")
+def readyz():
+    """Readiness: cached payload, 503 until models are loaded"""
+    ensure_startup()
+    return Response(readiness.payload, status=200 if readiness.ready else 503,
+                    content_type="application/json")
+
+@app.route("/events")
+def events():
+    """Server-Sent Events stream of readiness changes"""
+    ensure_startup()
+    if not request.environ.get("wsgi.multithread"):
+        # A sync worker (the procfile's gunicorn default) would be held by one idle tab;
+        # 204 tells EventSource not to reconnect, and the page polls /readyz instead
+        return Response(status=204)
+    # Keep the request context (and its log record) open until the stream ends
+    return Response(stream_with_context(readiness.stream(EVENTS_STREAM_SECONDS)),
+                    content_type="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Per-process counters, latency percentiles and subsystem gauges"""
+    return jsonify(metrics.snapshot())
+
+def admin_required(view):
+    """Reject requests without `Authorization: Bearer $ADMIN_TOKEN`; 404 when no token is set"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({"status": "error", "error": "Endpoint not found."}), 404
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {ADMIN_TOKEN}"):
+            return jsonify({"status": "error", "error": "Unauthorized."}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route("/admin/models")
+@admin_required
+def admin_models():
+    """Registry contents plus the active and shadow versions"""
+    return jsonify({
+        "registry": MODEL_REGISTRY_DIR,
+        "current": model_registry.current_version(MODEL_REGISTRY_DIR),
+        "versions": model_registry.list_versions(MODEL_REGISTRY_DIR),
+        "active": active_bundle.describe() if active_bundle is not None else None,
+        "shadow": shadow_bundle.describe() if shadow_bundle is not None else None,
+        "shadow_fraction": shadow_fraction,
+        "reload": dict(reload_state),
+    })
+
+@app.route("/admin/reload", methods=["POST"])
+@admin_required
+def admin_reload():
+    """Load a version (default: registry CURRENT) in the background and swap it in"""
+    version = (request.get_json(silent=True) or {}).get("version")
+    if not reload_models(version):
+        return jsonify({"status": "error", "error": "A model load is already running."}), 409
+    return jsonify({"status": "loading", "version": version}), 202
+
+@app.route("/admin/promote", methods=["POST"])
+@admin_required
+def admin_promote():
+    """Point the registry's CURRENT at a version and serve it"""
+    version = (request.get_json(silent=True) or {}).get("version")
+    if not version:
+        return jsonify({"status": "error", "error": "version is required."}), 400
+    try:
+        started = reload_models(version, promote=True)
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 404
+    if not started:
+        return jsonify({"status": "error", "error": "A model load is already running."}), 409
+    return jsonify({"status": "loading", "version": version}), 202
+
+@app.route("/admin/shadow", methods=["POST"])
+@admin_required
+def admin_shadow():
+    """Start shadowing `version` on `fraction` of predictions, or stop with no version"""
+    global shadow_fraction
+    data = request.get_json(silent=True) or {}
+    if "fraction" in data:
+        shadow_fraction = min(max(float(data["fraction"]), 0.0), 1.0)
+    version = data.get("version")
+    if not version:
+        stop_shadow()
+        return jsonify({"status": "stopped"})
+    if shadow_bundle is not None and shadow_bundle.version == version:
+        return jsonify({"status": "shadowing", "version": version, "fraction": shadow_fraction})
+    if not reload_models(version, shadow=True):
+        return jsonify({"status": "error", "error": "A model load is already running."}), 409
+    return jsonify({"status": "loading", "version": version, "fraction": shadow_fraction}), 202
+
 @app.route("/predict", methods=["POST"])
 def predict():
     """Memory-optimized prediction endpoint"""
     ensure_startup()  # Ensure startup tasks run
+    request_start = time.perf_counter()
+    # Stage timings go into one summary record per request (see request_log.py)
+    trace = request_log.current()
     
-    logger.info(f"🔄 Starting prediction. Memory before: {get_memory_usage():.2f}MB")
+    if not SERVES_PREDICTIONS:
+        return jsonify({"status": "error", "error": "Predictions are not served by this process."}), 503
     
     if not models_loaded:
         logger.error("Models not loaded")
         return jsonify({"status": "error", "error": "AI models are still loading. Please wait a moment and try again."}), 503
     
-    if "file" not in request.files: 
-        return jsonify({"status": "error", "error": "No file uploaded"}), 400
-    
-    file = request.files["file"]
-    if file.filename == '': 
-        return jsonify({"status": "error", "error": "No file selected"}), 400
-    
-    if not allowed_file(file.filename):
-        return jsonify({"status": "error", "error": "Invalid file type. Please upload an image file."}), 400
+    # Compact mode: the browser already resized the X-ray and sent raw pixels
+    compact = None
+    if "tensor" in request.files:
+        try:
+            compact = compact_upload.decode(
+                request.files["tensor"].read(),
+                request.form.get("format"),
+                request.form.get("width"),
+                request.form.get("height"),
+                request.form.get("encoding", "identity")
+            )
+        except compact_upload.CompactUploadError as e:
+            return jsonify({"status": "error", "error": f"Invalid compact upload: {e}"}), 400
+        file = request.files.get("report")
+        if file is not None and not allowed_file(file.filename):
+            return jsonify({"status": "error", "error": "Invalid report image type."}), 400
+    else:
+        if "file" not in request.files: 
+            return jsonify({"status": "error", "error": "No file uploaded"}), 400
+        
+        file = request.files["file"]
+        if file.filename == '': 
+            return jsonify({"status": "error", "error": "No file selected"}), 400
+        
+        if not allowed_file(file.filename):
+            return jsonify({"status": "error", "error": "Invalid file type. Please upload an image file."}), 400
     
     try:
         # Create uploads directory
@@ -969,66 +1017,161 @@ def predict():
         os.makedirs(uploads_dir, exist_ok=True)
         
         # Secure filename
-        filename = secure_filename(file.filename)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_")
-        filename = timestamp + filename
+        if compact is not None:
+            # Canvas uploads all carry the same generic names, so add a unique suffix
+            name = secure_filename(file.filename) if file is not None else "xray.png"
+            filename = f"{timestamp}{uuid.uuid4().hex[:8]}_{name}"
+        else:
+            filename = timestamp + secure_filename(file.filename)
         xray_path = os.path.join(uploads_dir, filename)
         
-        logger.info(f"🔄 Saving uploaded file: {filename}")
-        file.save(xray_path)
+        # Keep an image for the PDF report: the report rendition, or the tensor itself
+        with trace.stage("save"):
+            if file is not None:
+                file.save(xray_path)
+            else:
+                cv2.imwrite(xray_path, compact)
         
         # Preprocess image with memory optimization
-        logger.info("🔄 Starting image preprocessing...")
-        img = preprocess_image(xray_path)
-        logger.info(f"🔄 Image preprocessed. Memory: {get_memory_usage():.2f}MB")
-        
-        # Extract features with explicit memory management
-        logger.info("🔄 Extracting features...")
-        
-        # Force CPU processing and use batch size of 1
-        with tf.device('/CPU:0'):
-            features = feature_extractor.predict(img, batch_size=1, verbose=0)
-            features = features.reshape(1, -1)
-        
-        # Clear image from memory immediately
-        del img
-        gc.collect()
+        buffers = buffer_pool.get()
+        report_path = xray_path
+        with trace.stage("preprocess"):
+            if compact is not None:
+                img = preprocess_array(compact, buffers=buffers)
+                upload = "compact"
+            elif dicom.is_dicom_path(xray_path):
+                img, report_path = preprocess_dicom(xray_path, buffers, report_path=xray_path + ".png")
+                upload = "dicom"
+            else:
+                img = preprocess_image(xray_path, buffers=buffers)
+                upload = "original"
+        metrics.incr(f"uploads_{upload}")
+        trace.set(upload=upload, file=filename)
+        
+        # The image id for the feature store and audit log
+        image_hash = hash_file(xray_path) if feature_store is not None or prediction_audit is not None else None
+        
+        # A near-duplicate of an earlier upload reuses its result instead of running the models again
+        fingerprint = previous = None
+        if duplicate_index is not None:
+            with trace.stage("dedup"):
+                fingerprint, previous = find_duplicate(buffers.resized)
+        
+        if previous is not None:
+            # Only the prediction is reused: the report keeps this upload, and the earlier overlay
+            # (drawn over the earlier image) only when both had the very same model input
+            result, explanation_path = previous.result, None
+            if previous.explanation_path and previous.input_digest == explain.input_digest(img):
+                explanation_path = previous.explanation_path
+            final_probs, stack_probs, stage = result.final_probs, result.stack_probs, result.stage
+            metrics.incr("predictions_reused")
+            class_index = int(np.argmax(final_probs))
+        else:
+            # One forward pass yields the embedding and the CNN head's probabilities, here or on the model server
+            inference_start = time.perf_counter()
+            explanation_path = digest = heatmap = None
+            if INFERENCE_BACKEND == "server":
+                result = infer_remote(img)
+            else:
+                # A cached overlay for this exact input and version means the tape can be skipped
+                if explanation_cache is not None:
+                    digest = explain.input_digest(img)
+                    explanation_path = explanation_cache.get(digest, active_bundle.version)
+                result, heatmap = infer_local(img, buffers, explain_image=digest is not None and explanation_path is None)
+            final_probs, stack_probs, stage = result.final_probs, result.stack_probs, result.stage
+            metrics.observe("inference", time.perf_counter() - inference_start)
+            trace.add("inference", time.perf_counter() - inference_start)
+            metrics.incr("predictions")
+            metrics.incr(f"predictions_stage_{stage}")
+            
+            class_index = int(np.argmax(final_probs))
+            maybe_shadow(img, class_index)
+            
+            if heatmap is not None:
+                try:
+                    with trace.stage("explain_render"):
+                        explanation_path = save_explanation(digest, result.version, buffers, heatmap)
+                except Exception as e:
+                    logger.warning(f"⚠️ Could not render explanation: {e}")
+            
+            # Keep the embedding so a new classifier can re-score history without the CNN
+            if feature_store is not None:
+                try:
+                    with trace.stage("feature_store"):
+                        feature_store.append(image_hash, result.features, result.cnn_version,
+                                             prediction=class_index)
+                except Exception as e:
+                    logger.warning(f"⚠️ Could not store embedding: {e}")
+            
+            if fingerprint is not None:
+                # The features buffer belongs to this thread and is overwritten by its next request
+                result = result._replace(features=np.array(result.features, copy=True))
+                duplicate_index.add(fingerprint, PreviousPrediction(result, explanation_path, digest))
         
-        logger.info(f"🔄 Features extracted. Memory: {get_memory_usage():.2f}MB")
+        disease = DISEASE_CLASSES[class_index]
+        confidence = float(final_probs[class_index])
         
-        # Make prediction
-        logger.info("🔄 Making prediction...")
-        rf_prediction = rf_model.predict(features)[0]
-        disease = DISEASE_CLASSES[int(rf_prediction)]
+        similar_cases = None
+        try:
+            with trace.stage("similar"):
+                similar_cases = find_similar_cases(result)
+        except Exception as e:
+            logger.warning(f"⚠️ Similar-case search failed: {e}")
         
-        # Clear features from memory
-        del features
-        gc.collect()
+        if previous is None:
+            # A reused result is not new traffic
+            try:
+                with trace.stage("drift"):
+                    track_drift(result)
+            except Exception as e:
+                logger.warning(f"⚠️ Drift update failed: {e}")
         
         # Store in session
         session['disease'] = disease
-        session['xray_path'] = xray_path
+        session['confidence'] = confidence
+        session['xray_path'] = report_path
+        session['explanation_path'] = explanation_path
+        session['similar_cases'] = similar_cases
         session['prediction_time'] = datetime.now().isoformat()
         
-        logger.info(f"✅ Prediction successful: {disease}. Final memory: {get_memory_usage():.2f}MB")
+        if prediction_audit is not None:
+            try:
+                prediction_audit.append(time.time(), image_hash, (time.perf_counter() - request_start) * 1000,
+                                        class_index, stage, final_probs, result.version, reused=previous is not None)
+            except Exception as e:
+                logger.error(f"❌ Could not write audit record: {e}")
+        
+        memory_mb = get_memory_usage()
+        trace.set(disease=disease, confidence=round(confidence, 4), stage=stage, model_version=result.version,
+                  reused=previous is not None, memory_mb=round(memory_mb, 1))
         
         # Cleanup old files in background
         threading.Thread(target=cleanup_old_files, daemon=True).start()
         
+        metrics.observe("predict", time.perf_counter() - request_start)
         return jsonify({
             "status": "success",
             "disease": disease,
-            "confidence": "high",
+            "confidence": round(confidence, 4),
+            "stage": stage,
+            "model_version": result.version,
+            "explanation": explanation_path is not None,
+            "reused": previous is not None,
+            "probabilities": {
+                "stack": class_probabilities(stack_probs) if stack_probs is not None else None,
+                "cnn": class_probabilities(result.cnn_probs)
+            },
             "timestamp": session['prediction_time'],
-            "memory_usage_mb": get_memory_usage()
+            "memory_usage_mb": memory_mb
         })
         
-    except Exception as e:
-        logger.error(f"❌ Prediction error: {str(e)}")
-        logger.error(traceback.format_exc())
+    except dicom.DicomError as e:
+        logger.warning(f"⚠️ Rejected DICOM upload: {e}")
+        return jsonify({"status": "error", "error": f"Unsupported DICOM file: {e}"}), 400
         
-        # Force cleanup on error
-        gc.collect()
+    except Exception as e:
+        logger.error(f"❌ Prediction error: {str(e)}", exc_info=True)
         
         error_msg = "An error occurred during analysis. Please try again."
         if "memory" in str(e).lower() or "resource" in str(e).lower():
@@ -1040,6 +1183,39 @@ def predict():
         
         return jsonify({"status": "error", "error": error_msg}), 500
 
+# Demo results when no maps API key is configured
+MOCK_DOCTORS = [
+    {"name": "Dr. Smith Pulmonology Clinic", "location": "123 Medical Center Dr, City"},
+    {"name": "Respiratory Care Associates", "location": "456 Health Plaza, City"},
+    {"name": "City General Hospital - Pulmonology", "location": "789 Hospital Ave, City"}
+]
+
+def doctor_search_params(latitude, longitude):
+    """Places API query for pulmonologists near a point, or None when no API key is configured"""
+    if GOMAPS_API_KEY == "YOUR_GOMAPS_API_KEY":
+        logger.warning("Google Maps API key not configured")
+        return None
+    return {
+        "location": f"{latitude},{longitude}",
+        "radius": 15000,
+        "type": "doctor",
+        "keyword": "pulmonologist respiratory",
+        "key": GOMAPS_API_KEY
+    }
+
+def parse_doctors(payload):
+    """Doctor entries from a Places API response body"""
+    doctors = []
+    for r in payload.get("results", []):
+        doctor_info = {
+            "name": r.get("name", "Unknown Doctor"),
+            "location": r.get("vicinity", "Address not available"),
+            "rating": r.get("rating", "N/A"),
+            "place_id": r.get("place_id", "")
+        }
+        doctors.append(doctor_info)
+    return doctors
+
 @app.route("/get_doctors", methods=["POST"])
 def get_doctors():
     """Enhanced doctor finder with better error handling"""
@@ -1054,42 +1230,16 @@ def get_doctors():
         if latitude is None or longitude is None:
             return jsonify({"error": "Invalid location coordinates"}), 400
 
-        # Check if API key is configured
-        if GOMAPS_API_KEY == "YOUR_GOMAPS_API_KEY":
-            logger.warning("Google Maps API key not configured")
-            # Return mock data for demo purposes
-            mock_doctors = [
-                {"name": "Dr. Smith Pulmonology Clinic", "location": "123 Medical Center Dr, City"},
-                {"name": "Respiratory Care Associates", "location": "456 Health Plaza, City"},
-                {"name": "City General Hospital - Pulmonology", "location": "789 Hospital Ave, City"}
-            ]
-            return jsonify({"doctors": mock_doctors})
-
-        url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
-        params = {
-            "location": f"{latitude},{longitude}",
-            "radius": 15000,
-            "type": "doctor",
-            "keyword": "pulmonologist respiratory",
-            "key": GOMAPS_API_KEY
-        }
+        # Return mock data for demo purposes when the API key is not configured
+        params = doctor_search_params(latitude, longitude)
+        if params is None:
+            return jsonify({"doctors": MOCK_DOCTORS})
 
         logger.info(f"🔄 Searching for doctors near {latitude}, {longitude}")
-        response = requests.get(url, params=params, verify=False, timeout=10)
+        response = requests.get(GOMAPS_PLACES_URL, params=params, verify=False, timeout=10)
         response.raise_for_status()
         
-        results = response.json().get("results", [])
-        doctors = []
-        
-        for r in results:
-            doctor_info = {
-                "name": r.get("name", "Unknown Doctor"),
-                "location": r.get("vicinity", "Address not available"),
-                "rating": r.get("rating", "N/A"),
-                "place_id": r.get("place_id", "")
-            }
-            doctors.append(doctor_info)
-        
+        doctors = parse_doctors(response.json())
         logger.info(f"✅ Found {len(doctors)} doctors")
         return jsonify({"doctors": doctors})
         
@@ -1097,11 +1247,27 @@ def get_doctors():
         logger.error(f"Error in get_doctors: {e}")
         return jsonify({"doctors": [], "error": "Unable to search for doctors at this time."}), 503
 
+@app.route("/similar_cases")
+def similar_cases():
+    """Most similar indexed cases to the last uploaded X-ray"""
+    if similarity_index is None:
+        return jsonify({"status": "error", "error": "Similar-case search is not enabled."}), 404
+    if not session.get('disease'):
+        return jsonify({"status": "error", "error": "No diagnosis data available. Please upload an X-ray first."}), 400
+    
+    cases = session.get('similar_cases')
+    if cases is None:
+        return jsonify({"status": "error", "error": "No similar cases for this X-ray's model version."}), 404
+    k = request.args.get("k", default=SIMILAR_CASES_K, type=int)
+    return jsonify({"status": "success", "disease": session['disease'], "cases": cases[:max(k, 0)]})
+
 @app.route("/generate_report")
 def generate_report():
     """Enhanced report generation with better formatting"""
     disease = session.get('disease')
+    confidence = session.get('confidence')
     xray_path = session.get('xray_path')
+    explanation_path = session.get('explanation_path')
     prediction_time = session.get('prediction_time')
     
     if not disease:
@@ -1112,7 +1278,7 @@ def generate_report():
         reports_dir = os.path.join(os.getcwd(), 'reports')
         os.makedirs(reports_dir, exist_ok=True)
         
-        pdf = FPDF()
+        pdf = fpdf.FPDF()
         pdf.add_page()
         
         # Header
@@ -1152,6 +1318,9 @@ def generate_report():
         
         pdf.set_font("Arial", "B", 12)
         pdf.cell(0, 8, f"Detected Condition: {title.upper()}", ln=True)
+        if confidence is not None:
+            pdf.set_font("Arial", "", 11)
+            pdf.cell(0, 6, f"Model Confidence: {confidence * 100:.1f}%", ln=True)
         pdf.ln(3)
         
         pdf.set_font("Arial", "", 11)
@@ -1171,6 +1340,19 @@ def generate_report():
                 pdf.cell(0, 8, "X-ray image could not be included in report.", ln=True)
                 pdf.ln(10)
         
+        # Grad-CAM overlay: the regions that drove the predicted class
+        if explanation_path and os.path.exists(explanation_path):
+            try:
+                pdf.set_font("Arial", "B", 12)
+                pdf.cell(0, 8, "Model Attention (Grad-CAM):", ln=True)
+                pdf.ln(3)
+                pdf.image(explanation_path, x=65, w=80, h=80)
+                pdf.set_font("Arial", "I", 9)
+                pdf.multi_cell(0, 5, "Warmer colors mark the regions that contributed most to the detected condition.")
+                pdf.ln(8)
+            except Exception as e:
+                logger.warning(f"Could not insert explanation in PDF: {e}")
+        
         # Recommendations Section
         pdf.set_font("Arial", "B", 14)
         pdf.cell(0, 10, "Recommendations", ln=True)
@@ -1278,15 +1460,69 @@ def cleanup_on_exit():
     """Cleanup function to run on application exit"""
     logger.info("🧹 Cleaning up resources...")
     cleanup_old_files()
+    if feature_store is not None:
+        feature_store.close()
+    if prediction_audit is not None:
+        prediction_audit.close()
 
 atexit.register(cleanup_on_exit)
 
+gc_policy.configure(GC_POLICY, GC_THRESHOLDS, GC_INTERVAL)
+
+def cascade_stats():
+    """Live early-exit rate of the cascade"""
+    total = metrics.counters.get("predictions", 0)
+    escalated = metrics.counters.get("predictions_stage_stack", 0)
+    return {
+        "mode": CASCADE_MODE,
+        "threshold": CASCADE_THRESHOLD,
+        "early_exit_rate": round((total - escalated) / total, 4) if total else 0.0
+    }
+
+def model_stats():
+    """Active and shadow versions, reload status and shadow agreement"""
+    return {
+        "active": active_bundle.version if active_bundle is not None else None,
+        "shadow": shadow_bundle.version if shadow_bundle is not None else None,
+        "shadow_fraction": shadow_fraction,
+        "shadow_agreement": metrics.ratio("shadow_agree", "shadow_requests"),
+        "reload": dict(reload_state),
+    }
+
+def explain_stats():
+    """Explanation mode and overlay cache hit rate"""
+    stats = {"mode": EXPLAIN_MODE}
+    if explanation_cache is not None:
+        stats.update(explanation_cache.stats())
+    return stats
+
+def dedup_stats():
+    """Near-duplicate index size and hit rate"""
+    stats = {"mode": DEDUP_MODE}
+    if duplicate_index is not None:
+        stats.update(duplicate_index.stats())
+    return stats
+
+metrics.gauge("gc", gc_policy.stats)
+metrics.gauge("cascade", cascade_stats)
+metrics.gauge("models", model_stats)
+metrics.gauge("explain", explain_stats)
+metrics.gauge("dedup", dedup_stats)
+metrics.gauge("logging", request_log.stats)
+metrics.gauge("similarity", lambda: similarity_index.stats() if similarity_index is not None else None)
+metrics.gauge("audit", lambda: prediction_audit.stats() if prediction_audit is not None else None)
+metrics.gauge("drift", lambda: drift_monitor.scores() if drift_monitor is not None else None)
+if INFERENCE_BACKEND == "server":
+    metrics.gauge("model_server", lambda: model_client().stats())
+threading.Thread(target=retire_bundles, daemon=True).start()
+
 # -------------------------------
 # RUN APPLICATION
 # -------------------------------
 if __name__ == "__main__":
-    # Load models at startup for development
-    load_models()
+    # Load models (or connect to the model server) at startup for development
+    if SERVES_PREDICTIONS:
+        prepare_inference()
     
     port = int(os.environ.get("PORT", 5000))
     debug_mode = os.environ.get("FLASK_ENV", "production") == "development"
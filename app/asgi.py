@@ -0,0 +1,308 @@
+"""Asyncio front end for the Flask app.
+
+Under `app.run(threaded=True)` or sync gunicorn workers, every slow upload
+and every maps API call holds a thread for its whole duration, competing
+with inference for the same pool. Here an asyncio event loop owns all
+socket I/O instead:
+
+* request bodies are read on the event loop, so slow clients cost a
+  coroutine, not a thread
+* `/get_doctors` calls the maps API with an async HTTP client
+* a fully received request is handed to the unchanged Flask app (WSGI) on
+  an executor, and `/predict` gets its own bounded executor so page and
+  report requests never queue behind inference
+
+    uvicorn asgi:application --app-dir app --host 0.0.0.0 --port 5000
+    python app/asgi.py
+"""
+import asyncio
+import io
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+import app as service
+import request_log
+from status import HEARTBEAT_SECONDS, retry_event, sse_event
+
+logger = logging.getLogger("asgi")
+
+# Threads running /predict through Flask (CPU-bound inference)
+ASGI_INFERENCE_THREADS = int(os.environ.get("ASGI_INFERENCE_THREADS", str(os.cpu_count() or 1)))
+# Threads running every other Flask route (pages, health, reports)
+ASGI_WSGI_THREADS = int(os.environ.get("ASGI_WSGI_THREADS", "16"))
+# Concurrent outbound maps API connections
+ASGI_HTTP_CONNECTIONS = int(os.environ.get("ASGI_HTTP_CONNECTIONS", "100"))
+
+INFERENCE_PATHS = {"/predict"}
+
+inference_executor = ThreadPoolExecutor(max_workers=ASGI_INFERENCE_THREADS, thread_name_prefix="inference")
+wsgi_executor = ThreadPoolExecutor(max_workers=ASGI_WSGI_THREADS, thread_name_prefix="wsgi")
+http_client = None
+
+
+# -------------------------------
+# ASGI HELPERS
+# -------------------------------
+class BodyTooLarge(Exception):
+    pass
+
+
+class BadContentLength(Exception):
+    pass
+
+
+async def read_body(scope, receive, limit):
+    """Read the whole request body on the event loop, refusing anything over `limit` bytes"""
+    headers = dict(scope["headers"])
+    declared = headers.get(b"content-length")
+    if declared is not None:
+        try:
+            declared = int(declared)
+        except ValueError:
+            raise BadContentLength()
+        if declared > limit:
+            raise BodyTooLarge()
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ConnectionError("Client disconnected")
+        body += message.get("body", b"")
+        if len(body) > limit:
+            raise BodyTooLarge()
+        if not message.get("more_body", False):
+            return bytes(body)
+
+
+async def send_response(send, status, headers, body):
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_json(send, payload, status=200):
+    body = json.dumps(payload).encode()
+    await send_response(send, status, [(b"content-type", b"application/json"),
+                                       (b"content-length", str(len(body)).encode())], body)
+
+
+def cors_headers(scope):
+    """What CORS(app) adds to a simple response under WSGI with its defaults: the request's Origin, echoed"""
+    origin = dict(scope["headers"]).get(b"origin")
+    if origin is None:
+        return []
+    return [(b"access-control-allow-origin", origin), (b"vary", b"Origin")]
+
+
+async def respond_natively(handler, scope, receive, body, send):
+    """Run a route outside Flask with the same CORS headers and request_log summary Flask would give it"""
+    trace = request_log.begin(scope["method"], scope["path"], bind=False)
+    extra = cors_headers(scope)
+
+    async def send_traced(message):
+        if message["type"] == "http.response.start":
+            trace.status = message["status"]
+            message = dict(message, headers=list(message.get("headers", [])) + extra)
+        await send(message)
+
+    try:
+        return await handler(scope, receive, body, send_traced)
+    finally:
+        request_log.finish(trace=trace)
+
+
+def rejection(status, error):
+    """Handler answering a request that never reaches a route"""
+    async def reject(scope, receive, body, send):
+        await send_json(send, {"status": "error", "error": error}, status)
+    return reject
+
+
+# -------------------------------
+# WSGI BRIDGE
+# -------------------------------
+def wsgi_environ(scope, body):
+    """WSGI environ for a fully received ASGI HTTP request"""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        key = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if key == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif key != "CONTENT_LENGTH":
+            key = f"HTTP_{key}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def call_wsgi(environ):
+    """Run the Flask app to completion; returns `(status, headers, body)`"""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+
+    result = service.app(environ, start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return started["status"], started["headers"], body
+
+
+async def dispatch_wsgi(scope, body, send):
+    executor = inference_executor if scope["path"] in INFERENCE_PATHS else wsgi_executor
+    loop = asyncio.get_running_loop()
+    status, headers, payload = await loop.run_in_executor(executor, call_wsgi, wsgi_environ(scope, body))
+    await send_response(send, status, headers, payload)
+
+
+# -------------------------------
+# ASYNC ROUTES
+# -------------------------------
+async def get_doctors(scope, receive, body, send):
+    """Async twin of the Flask /get_doctors route"""
+    try:
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            data = None
+        if not data:
+            return await send_json(send, {"error": "No location data provided"}, 400)
+
+        latitude = data.get("latitude")
+        longitude = data.get("longitude")
+        if latitude is None or longitude is None:
+            return await send_json(send, {"error": "Invalid location coordinates"}, 400)
+
+        params = service.doctor_search_params(latitude, longitude)
+        if params is None:
+            return await send_json(send, {"doctors": service.MOCK_DOCTORS})
+
+        logger.info(f"🔄 Searching for doctors near {latitude}, {longitude}")
+        response = await http_client.get(service.GOMAPS_PLACES_URL, params=params)
+        response.raise_for_status()
+        doctors = service.parse_doctors(response.json())
+        logger.info(f"✅ Found {len(doctors)} doctors")
+        await send_json(send, {"doctors": doctors})
+    except Exception as e:
+        logger.error(f"Error in get_doctors: {e}")
+        await send_json(send, {"doctors": [], "error": "Unable to search for doctors at this time."}, 503)
+
+
+async def events(scope, receive, body, send):
+    """Readiness stream held by a coroutine instead of a thread, for as long as the tab is open"""
+    service.ensure_startup()
+    loop = asyncio.get_running_loop()
+    changed = asyncio.Event()
+    listener = lambda: loop.call_soon_threadsafe(changed.set)  # noqa: E731
+    disconnected = asyncio.ensure_future(receive())
+    service.readiness.add_listener(listener)
+    try:
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no")]})
+        version, payload = service.readiness.snapshot()
+        await send({"type": "http.response.body", "body": retry_event() + sse_event(payload, version),
+                    "more_body": True})
+        while True:
+            waiter = asyncio.ensure_future(changed.wait())
+            done, _ = await asyncio.wait({waiter, disconnected}, timeout=HEARTBEAT_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            if disconnected in done:
+                return
+            # Clear before reading, so a change landing in between wakes the next wait
+            changed.clear()
+            new_version, payload = service.readiness.snapshot()
+            if new_version != version:
+                version = new_version
+                chunk = sse_event(payload, version)
+            else:
+                chunk = b": keepalive\n\n"
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    finally:
+        service.readiness.remove_listener(listener)
+        disconnected.cancel()
+
+
+ASYNC_ROUTES = {
+    ("POST", "/get_doctors"): get_doctors,
+    ("GET", "/events"): events,
+}
+
+
+# -------------------------------
+# APPLICATION
+# -------------------------------
+async def lifespan(receive, send):
+    global http_client
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            http_client = httpx.AsyncClient(
+                verify=False, timeout=10,
+                limits=httpx.Limits(max_connections=ASGI_HTTP_CONNECTIONS))
+            # Starts model loading and the cleanup scheduler in background threads
+            service.ensure_startup()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await http_client.aclose()
+            inference_executor.shutdown(wait=False, cancel_futures=True)
+            wsgi_executor.shutdown(wait=False, cancel_futures=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        raise RuntimeError(f"Unsupported ASGI scope {scope['type']!r}")
+
+    try:
+        body = await read_body(scope, receive, service.app.config["MAX_CONTENT_LENGTH"])
+    except BodyTooLarge:
+        return await respond_natively(rejection(413, "File too large. Maximum size is 16MB."),
+                                      scope, receive, b"", send)
+    except BadContentLength:
+        return await respond_natively(rejection(400, "Invalid Content-Length header."), scope, receive, b"", send)
+    except ConnectionError:
+        return
+
+    # Flask traces and adds CORS headers to the routes it serves; native routes get the same here
+    route = ASYNC_ROUTES.get((scope["method"], scope["path"]))
+    if route is not None:
+        return await respond_natively(route, scope, receive, body, send)
+    await dispatch_wsgi(scope, body, send)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(application, host="0.0.0.0", port=int(os.environ.get("PORT", 5000)), lifespan="on")
@@ -0,0 +1,344 @@
+"""Append-only binary audit log of predictions.
+
+Layout of a log directory::
+
+    <writer>-000000.audit    segments, rotated once they pass segment_bytes
+
+Each segment starts with an 8-byte magic, followed by records::
+
+    uint32 length, uint32 crc32      of the payload
+    float64 timestamp                seconds since the epoch
+    32 bytes image SHA-256
+    float32 latency_ms
+    uint8 class_index, uint8 stage (index into STAGES), uint8 flags, uint8 classes
+    float32[classes] probabilities
+    uint16 length + utf-8 model version
+
+Request threads only encode a record and hand it to a writer thread. The
+writer appends everything queued since its last pass with one write and
+one fsync (group commit), so a burst of predictions shares a single disk
+sync. A record is durable within about ``flush_interval`` seconds;
+``flush()`` waits for everything queued so far. Each process writes its
+own segments, and a torn record at the end of a segment (a crash mid-write)
+fails its CRC and ends the scan of that segment.
+
+    python app/audit_log.py stats audit
+    python app/audit_log.py export audit --since 2025-01-01 --format csv --output audit.csv
+"""
+import argparse
+import csv
+import glob
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import namedtuple
+from datetime import datetime
+
+from model_server import STAGES
+
+MAGIC = b"XRAUDIT1"
+FRAME = struct.Struct("<II")
+BODY = struct.Struct("<d32sfBBBB")
+VERSION_LENGTH = struct.Struct("<H")
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+FLAG_REUSED = 1
+
+Record = namedtuple("Record", "timestamp image_hash latency_ms class_index stage reused probabilities model_version")
+
+
+def encode(timestamp, image_hash, latency_ms, class_index, stage, probabilities, model_version, reused=False):
+    """One framed record; `image_hash` is a SHA-256 hex digest"""
+    version = model_version.encode("utf-8")
+    probabilities = [float(p) for p in probabilities]
+    payload = b"".join((
+        BODY.pack(timestamp, bytes.fromhex(image_hash), latency_ms, class_index, STAGES.index(stage),
+                  FLAG_REUSED if reused else 0, len(probabilities)),
+        struct.pack(f"<{len(probabilities)}f", *probabilities),
+        VERSION_LENGTH.pack(len(version)),
+        version,
+    ))
+    return FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode(payload):
+    timestamp, digest, latency_ms, class_index, stage, flags, classes = BODY.unpack_from(payload)
+    offset = BODY.size
+    probabilities = struct.unpack_from(f"<{classes}f", payload, offset)
+    offset += 4 * classes
+    (length,) = VERSION_LENGTH.unpack_from(payload, offset)
+    offset += VERSION_LENGTH.size
+    version = bytes(payload[offset:offset + length]).decode("utf-8")
+    return Record(timestamp, digest.hex(), latency_ms, class_index, STAGES[stage], bool(flags & FLAG_REUSED),
+                  probabilities, version)
+
+
+# -------------------------------
+# WRITING
+# -------------------------------
+class AuditLog:
+    """Group-committing writer for one process's segments"""
+
+    def __init__(self, root, writer="main", segment_bytes=DEFAULT_SEGMENT_BYTES, flush_interval=0.02):
+        self.root = root
+        self.writer = writer
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        os.makedirs(root, exist_ok=True)
+
+        self._cond = threading.Condition()
+        self._pending = []
+        self._queued = 0
+        self._written = 0
+        self._closed = False
+        self._fd = None
+        self._segment_size = 0
+        own = glob.glob(os.path.join(root, f"{writer}-*.audit"))
+        # Never append after a possibly torn tail: a restarted writer opens a new segment
+        self._sequence = max((_sequence(path) for path in own), default=-1)
+
+        self.records = 0
+        self.bytes = 0
+        self.commits = 0
+        self.sync_seconds = 0.0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._run, name=f"audit-{writer}", daemon=True)
+        self._thread.start()
+
+    def append(self, timestamp, image_hash, latency_ms, class_index, stage, probabilities, model_version,
+               reused=False):
+        """Queue one record; returns without touching the disk"""
+        data = encode(timestamp, image_hash, latency_ms, class_index, stage, probabilities, model_version, reused)
+        with self._cond:
+            if self._closed:
+                raise ValueError("Audit log is closed")
+            self._pending.append(data)
+            self._queued += 1
+            if len(self._pending) == 1:
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait until every record queued so far is on disk"""
+        with self._cond:
+            target = self._queued
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._written >= target or not self._thread.is_alive(), timeout)
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending and self._closed:
+                    break
+            # Let concurrent requests join this commit
+            time.sleep(self.flush_interval)
+            with self._cond:
+                batch, self._pending = self._pending, []
+            try:
+                self._commit(batch)
+            except OSError:
+                # Retry into a fresh segment; a partial write there is a torn tail that scans skip
+                self.errors += 1
+                self._close_segment()
+                with self._cond:
+                    self._pending[:0] = batch
+                time.sleep(1.0)
+                continue
+            with self._cond:
+                self._written += len(batch)
+                self._cond.notify_all()
+        self._close_segment()
+
+    def _close_segment(self):
+        if self._fd is not None:
+            fd, self._fd = self._fd, None
+            os.close(fd)
+
+    def _commit(self, batch):
+        data = b"".join(batch)
+        if self._fd is None or self._segment_size + len(data) > self.segment_bytes:
+            self._rotate()
+        start = time.perf_counter()
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._fd, view):]
+        getattr(os, "fdatasync", os.fsync)(self._fd)
+        self.sync_seconds += time.perf_counter() - start
+        self._segment_size += len(data)
+        self.records += len(batch)
+        self.bytes += len(data)
+        self.commits += 1
+
+    def _rotate(self):
+        self._close_segment()
+        self._sequence += 1
+        path = os.path.join(self.root, f"{self.writer}-{self._sequence:06d}.audit")
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o640)
+        os.write(self._fd, MAGIC)
+        self._segment_size = len(MAGIC)
+        # Make the new directory entry durable too
+        dir_fd = os.open(self.root, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            "records": self.records,
+            "pending": pending,
+            "bytes": self.bytes,
+            "commits": self.commits,
+            "records_per_commit": round(self.records / self.commits, 2) if self.commits else None,
+            "avg_sync_ms": round(self.sync_seconds * 1000 / self.commits, 3) if self.commits else None,
+            "segment": self._sequence,
+            "errors": self.errors,
+        }
+
+
+# -------------------------------
+# READING
+# -------------------------------
+def _sequence(path):
+    return int(os.path.basename(path).rsplit("-", 1)[1].split(".")[0])
+
+
+def segments(root):
+    """Segment paths ordered by writer and sequence"""
+    return sorted(glob.glob(os.path.join(root, "*.audit")), key=lambda p: (os.path.basename(p).rsplit("-", 1)[0],
+                                                                           _sequence(p)))
+
+
+def scan_segment(path):
+    """Yield the records of one segment, stopping at a torn or corrupt tail"""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= len(MAGIC):
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not an audit segment")
+            view = memoryview(mm)
+            offset = len(MAGIC)
+            payload = None
+            try:
+                while offset + FRAME.size <= size:
+                    length, crc = FRAME.unpack_from(view, offset)
+                    start = offset + FRAME.size
+                    payload = view[start:start + length]
+                    if len(payload) < length or zlib.crc32(payload) != crc:
+                        break
+                    yield decode(payload)
+                    offset = start + length
+            finally:
+                del payload
+                view.release()
+
+
+def scan(root, since=None, until=None):
+    """Yield every record in the log, optionally limited to a [since, until) time range"""
+    for path in segments(root):
+        for record in scan_segment(path):
+            if since is not None and record.timestamp < since:
+                continue
+            if until is not None and record.timestamp >= until:
+                continue
+            yield record
+
+
+# -------------------------------
+# COMMAND LINE
+# -------------------------------
+def _timestamp(text):
+    return datetime.fromisoformat(text).timestamp() if text else None
+
+
+def _cmd_stats(args):
+    count = reused = 0
+    first = last = None
+    versions = {}
+    classes = {}
+    latencies = []
+    for record in scan(args.root, _timestamp(args.since), _timestamp(args.until)):
+        count += 1
+        reused += record.reused
+        first = record.timestamp if first is None else min(first, record.timestamp)
+        last = record.timestamp if last is None else max(last, record.timestamp)
+        versions[record.model_version] = versions.get(record.model_version, 0) + 1
+        classes[record.class_index] = classes.get(record.class_index, 0) + 1
+        latencies.append(record.latency_ms)
+    latencies.sort()
+    print(json.dumps({
+        "segments": len(segments(args.root)),
+        "records": count,
+        "reused": reused,
+        "first": datetime.fromtimestamp(first).isoformat() if first else None,
+        "last": datetime.fromtimestamp(last).isoformat() if last else None,
+        "model_versions": versions,
+        "classes": {str(k): v for k, v in sorted(classes.items())},
+        "p50_latency_ms": round(latencies[len(latencies) // 2], 2) if latencies else None,
+        "p99_latency_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 2)
+        if latencies else None,
+    }, indent=2))
+
+
+def _cmd_export(args):
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    count = 0
+    try:
+        writer = csv.writer(out) if args.format == "csv" else None
+        for record in scan(args.root, _timestamp(args.since), _timestamp(args.until)):
+            if args.model_version and record.model_version != args.model_version:
+                continue
+            if writer is not None:
+                if count == 0:
+                    writer.writerow(["timestamp", "image_hash", "model_version", "class_index", "stage", "reused",
+                                     "latency_ms"] + [f"prob_{i}" for i in range(len(record.probabilities))])
+                writer.writerow([f"{record.timestamp:.6f}", record.image_hash, record.model_version,
+                                 record.class_index, record.stage, int(record.reused), f"{record.latency_ms:.3f}"]
+                                + [f"{p:.6f}" for p in record.probabilities])
+            else:
+                out.write(json.dumps(record._asdict()) + "\n")
+            count += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"Exported {count} records", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    for name, func, help_text in (("stats", _cmd_stats, "Summarize the log"),
+                                  ("export", _cmd_export, "Write records as CSV or JSON lines")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("root")
+        p.add_argument("--since", help="ISO date or time (inclusive)")
+        p.add_argument("--until", help="ISO date or time (exclusive)")
+        p.set_defaults(func=func)
+        if name == "export":
+            p.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+            p.add_argument("--model-version")
+            p.add_argument("--output", help="Default: stdout")
+
+    args = parser.parse_args(argv)
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""Preallocated per-worker buffers for the prediction hot path.
+
+Every worker thread gets its own uint8 RGB resize target, float32 model input
+batch and feature row the first time it serves a prediction. Later requests
+on the same thread resize and normalize in place into those arrays instead
+of allocating fresh copies.
+"""
+import threading
+
+import numpy as np
+
+import preprocessing
+
+INPUT_SIZE = (224, 224)
+INPUT_CHANNELS = 3
+
+
+class WorkerBuffers:
+    """Buffers owned by a single worker thread"""
+
+    def __init__(self, input_size=INPUT_SIZE, channels=INPUT_CHANNELS):
+        height, width = input_size
+        self.resized = np.empty((height, width, channels), dtype=np.uint8)
+        self.batch = np.empty((1, height, width, channels), dtype=np.float32)
+        self.features = None
+
+    def feature_row(self, dim):
+        """Return the (1, dim) feature buffer, allocating it on first use"""
+        if self.features is None or self.features.shape[1] != dim:
+            self.features = np.empty((1, dim), dtype=np.float32)
+        return self.features
+
+
+class BufferPool:
+    """Thread-local pool handing each worker thread its own WorkerBuffers"""
+
+    def __init__(self, input_size=INPUT_SIZE, channels=INPUT_CHANNELS):
+        self.input_size = input_size
+        self.channels = channels
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.workers = 0
+
+    def get(self):
+        """Return the calling thread's buffers"""
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None:
+            buffers = WorkerBuffers(self.input_size, self.channels)
+            self._local.buffers = buffers
+            with self._lock:
+                self.workers += 1
+        return buffers
+
+
+def resize_normalize_into(img, buffers):
+    """Resize a decoded BGR uint8 image to RGB and scale it to [0, 1] inside `buffers`.
+
+    Returns `buffers.batch`, which stays valid only until the same thread
+    preprocesses its next image.
+    """
+    preprocessing.resize_into(img, buffers.resized)
+    preprocessing.normalize_into(buffers.resized, buffers.batch[0])
+    return buffers.batch
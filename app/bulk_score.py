@@ -0,0 +1,236 @@
+"""Offline bulk scoring of archived X-rays.
+
+Walks a directory (or reads a manifest of paths), decodes and preprocesses
+images on a process pool, batches them through the DenseNet feature
+extractor while the next batches are being decoded, and appends results to
+CSV or Parquet as it goes. Finished paths are recorded in a checkpoint file
+next to the output, so an interrupted run picks up where it stopped.
+
+    python app/bulk_score.py /data/archive --output scores.csv
+    python app/bulk_score.py manifest.txt --output scores_parquet/ --format parquet
+"""
+import argparse
+import csv
+import importlib.util
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+import preprocessing
+from model_utils import allowed_file
+from pipeline import prefetch_batches, start_process_pool
+
+logger = logging.getLogger("bulk_score")
+
+
+# -------------------------------
+# INPUTS AND CHECKPOINTS
+# -------------------------------
+def iter_inputs(source, allowed):
+    """Yield image paths from a directory tree or a manifest file"""
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if allowed(name):
+                    yield os.path.join(root, name)
+        return
+
+    with open(source, newline="") as f:
+        first = f.readline()
+        f.seek(0)
+        if "path" in next(csv.reader([first.strip()]), []):
+            # CSV manifest with a "path" column (a plain list may start with e.g. pathology/...)
+            for row in csv.DictReader(f):
+                if row.get("path"):
+                    yield row["path"].strip()
+        else:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield line
+
+
+def checkpoint_path(output, fmt):
+    """CSV runs keep the checkpoint beside the file, Parquet runs inside the part directory"""
+    if fmt == "parquet":
+        return os.path.join(output, "_checkpoint.txt")
+    return output + ".checkpoint"
+
+
+def clear_output(output, fmt):
+    """Remove the checkpoint and earlier results, so a restart does not append duplicate rows"""
+    paths = [checkpoint_path(output, fmt)]
+    if fmt == "csv":
+        paths.append(output)
+    elif os.path.isdir(output):
+        paths += [os.path.join(output, n) for n in os.listdir(output) if n.startswith("part-")]
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+def _sync(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+
+# -------------------------------
+# WRITERS
+# -------------------------------
+class CsvResultWriter:
+    def __init__(self, path, columns):
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self.f = open(path, "a", newline="")
+        self.writer = csv.DictWriter(self.f, fieldnames=columns)
+        if not exists:
+            self.writer.writeheader()
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+        _sync(self.f)
+
+    def close(self):
+        self.f.close()
+
+
+def parquet_engine():
+    """Name of an installed pandas Parquet engine, or None"""
+    for name in ("pyarrow", "fastparquet"):
+        if importlib.util.find_spec(name) is not None:
+            return name
+    return None
+
+
+class ParquetResultWriter:
+    """Writes one part file per flushed batch so completed parts are never rewritten"""
+
+    def __init__(self, directory, columns):
+        import pandas as pd
+
+        self.pd = pd
+        self.directory = directory
+        self.columns = columns
+        os.makedirs(directory, exist_ok=True)
+        self.part = len([n for n in os.listdir(directory) if n.endswith(".parquet")])
+
+    def write(self, rows):
+        frame = self.pd.DataFrame(rows, columns=self.columns)
+        path = os.path.join(self.directory, f"part-{self.part:05d}.parquet")
+        tmp = path + ".tmp"
+        frame.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+        self.part += 1
+
+    def close(self):
+        pass
+
+
+# -------------------------------
+# SCORING
+# -------------------------------
+def score(source, output, fmt="csv", batch_size=32, workers=None, prefetch=4, tf_threads=0):
+    """Score every image under `source`, appending results to `output`"""
+    ckpt_path = checkpoint_path(output, fmt)
+    done = load_checkpoint(ckpt_path)
+    paths = [p for p in iter_inputs(source, allowed_file) if p not in done]
+    logger.info(f"📂 {len(paths)} images to score ({len(done)} already done)")
+    if not paths:
+        return 0
+
+    # Start the decode workers before TensorFlow creates its thread pools, so forking is safe
+    pool = start_process_pool(workers)
+
+    # The web app owns model loading (registry, cascade, warm-up); only import it once there is work
+    import app as service
+
+    if not service.load_models(intra_op_threads=tf_threads, inter_op_threads=tf_threads):
+        pool.shutdown()
+        raise RuntimeError("Models failed to load")
+
+    classes = service.DISEASE_CLASSES
+    prob_columns = [f"prob_{c.replace(' ', '_')}" for c in classes]
+    cnn_columns = [f"cnn_prob_{c.replace(' ', '_')}" for c in classes]
+    columns = ["path", "disease", "class_index"] + prob_columns + cnn_columns + ["error"]
+    if fmt == "parquet":
+        writer = ParquetResultWriter(output, columns)
+    else:
+        writer = CsvResultWriter(output, columns)
+    if os.path.dirname(ckpt_path):
+        os.makedirs(os.path.dirname(ckpt_path), exist_ok=True)
+    ckpt = open(ckpt_path, "a")
+
+    scored = 0
+    start = time.perf_counter()
+    try:
+        for batch in prefetch_batches(paths, pool, batch_size=batch_size, prefetch=prefetch):
+            rows = []
+            good = [(path, img) for path, img, err in batch if err is None]
+            for path, _, err in batch:
+                if err is not None:
+                    rows.append({"path": path, "error": err})
+
+            if good:
+                tensor = preprocessing.normalize_batch(np.stack([img for _, img in good]))
+                pooled, cnn_probs = service.serving_model.predict_on_batch(tensor)
+                features = np.asarray(pooled).reshape(len(good), -1)
+                probs = service.stack_probabilities(features)
+                labels = probs.argmax(axis=1)
+                for (path, _), label, p, cp in zip(good, labels, probs, np.asarray(cnn_probs)):
+                    row = {"path": path, "disease": classes[int(label)], "class_index": int(label), "error": ""}
+                    row.update({col: float(v) for col, v in zip(prob_columns, p)})
+                    row.update({col: float(v) for col, v in zip(cnn_columns, cp)})
+                    rows.append(row)
+
+            # Results first, then the checkpoint, so a crash can only re-score a batch
+            writer.write(rows)
+            ckpt.write("".join(f"{row['path']}\n" for row in rows))
+            _sync(ckpt)
+
+            scored += len(rows)
+            rate = scored / (time.perf_counter() - start)
+            logger.info(f"✅ {scored}/{len(paths)} scored ({rate:.1f} img/s)")
+    finally:
+        writer.close()
+        ckpt.close()
+        pool.shutdown(cancel_futures=True)
+
+    return scored
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="Directory of X-rays, or a manifest (one path per line, or CSV with a 'path' column)")
+    parser.add_argument("--output", required=True, help="CSV file, or directory of Parquet parts")
+    parser.add_argument("--format", choices=["csv", "parquet"], help="Defaults from the output extension")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=None, help="Decode processes (default: all cores)")
+    parser.add_argument("--prefetch", type=int, default=4, help="Decoded batches queued ahead of the CNN")
+    parser.add_argument("--tf-threads", type=int, default=0, help="TensorFlow op threads (0 = all cores)")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and score everything again")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("parquet" if not args.output.lower().endswith(".csv") else "csv")
+    # Fail before anything is cleared or loaded, not after the models are up
+    if fmt == "parquet" and parquet_engine() is None:
+        parser.error("Parquet output needs pyarrow (or fastparquet); install it or pass a .csv --output")
+    if args.restart:
+        clear_output(args.output, fmt)
+
+    scored = score(args.source, args.output, fmt, args.batch_size, args.workers, args.prefetch, args.tf_threads)
+    logger.info(f"🎉 Finished: {scored} images scored")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+"""Confidence-gated cascade in front of the stacking ensemble.
+
+A cheap first stage answers on its own when its calibrated top-class
+probability reaches a threshold; only uncertain cases escalate to the
+RF + XGB + GradientBoosting stack. Two first stages are supported:
+
+* ``cnn``    - the DenseNet softmax head, already computed by the forward pass
+* ``linear`` - a small logistic-regression head fitted on the embeddings
+
+Calibration is a single softmax temperature fitted on the validation
+features. The command line sweeps thresholds on the saved test features and
+reports accuracy lost against average latency saved:
+
+    python app/cascade.py fit-head --features notebooks/X_train.npy --labels notebooks/y_train.npy --output models/cascade_head.pkl
+    python app/cascade.py sweep --stack models/fast_rf_xgb_stack2.pkl --cnn-model models/densenet_new_finetuned_v3.h5 \\
+        --val-features notebooks/X_val.npy --val-labels notebooks/y_val.npy \\
+        --test-features notebooks/X_test.npy --test-labels notebooks/y_test.npy
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+MODES = ("off", "cnn", "linear")
+
+
+def softmax(logits):
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def temperature_scale(probs, temperature):
+    """Re-soften (T > 1) or sharpen (T < 1) probabilities via their log-odds"""
+    if temperature == 1.0:
+        return probs
+    return softmax(np.log(np.clip(probs, 1e-12, 1.0)) / temperature)
+
+
+def fit_temperature(probs, labels, grid=np.linspace(0.25, 5.0, 96)):
+    """Temperature minimizing validation negative log-likelihood"""
+    labels = np.asarray(labels, dtype=int)
+    best, best_nll = 1.0, np.inf
+    for t in grid:
+        scaled = temperature_scale(probs, t)
+        nll = -np.log(np.clip(scaled[np.arange(len(labels)), labels], 1e-12, 1.0)).mean()
+        if nll < best_nll:
+            best, best_nll = float(t), nll
+    return best
+
+
+class Cascade:
+    """Decides per request whether the first stage may answer alone"""
+
+    def __init__(self, mode="off", threshold=0.95, temperature=1.0, head=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cascade mode {mode!r}; expected one of {MODES}")
+        if mode == "linear" and head is None:
+            raise ValueError("Cascade mode 'linear' needs a fitted head")
+        self.mode = mode
+        self.threshold = threshold
+        self.temperature = temperature
+        self.head = head
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    def first_stage(self, features, cnn_probs):
+        """Calibrated first-stage probabilities for a batch"""
+        if self.mode == "linear":
+            probs = self.head.predict_proba(features)
+        else:
+            probs = np.asarray(cnn_probs).reshape(len(features), -1)
+        return temperature_scale(probs, self.temperature)
+
+    def accepts(self, probs):
+        """Boolean mask of rows confident enough to skip the stack"""
+        return np.asarray(probs).max(axis=-1) >= self.threshold
+
+
+# -------------------------------
+# OFFLINE EVALUATION
+# -------------------------------
+def cnn_head_weights(model_path):
+    """Kernel and bias of the final Dense softmax layer of the fine-tuned CNN"""
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(model_path, compile=False)
+    for layer in reversed(model.layers):
+        if isinstance(layer, tf.keras.layers.Dense):
+            kernel, bias = layer.get_weights()
+            return kernel, bias
+    raise ValueError(f"No Dense layer in {model_path}")
+
+
+def per_row_latency(fn, X, samples=200):
+    """Mean seconds for single-row calls of `fn` over a sample of X"""
+    rows = X[np.linspace(0, len(X) - 1, min(samples, len(X))).astype(int)]
+    fn(rows[:1])
+    start = time.perf_counter()
+    for row in rows:
+        fn(row[None, :])
+    return (time.perf_counter() - start) / len(rows)
+
+
+def sweep(stack, first_stage_fn, X_test, y_test, thresholds, temperature=1.0):
+    """Accuracy and expected latency of the cascade at each threshold"""
+    stack_probs = stack.predict_proba(X_test)
+    stack_pred = stack.classes_[stack_probs.argmax(axis=1)].astype(int)
+    stage1 = temperature_scale(first_stage_fn(X_test), temperature)
+    stage1_pred = stage1.argmax(axis=1)
+    stage1_conf = stage1.max(axis=1)
+    baseline_acc = float((stack_pred == y_test).mean())
+
+    stage1_s = per_row_latency(first_stage_fn, X_test)
+    stack_s = per_row_latency(stack.predict_proba, X_test)
+
+    rows = []
+    for t in thresholds:
+        exit_mask = stage1_conf >= t
+        pred = np.where(exit_mask, stage1_pred, stack_pred)
+        acc = float((pred == y_test).mean())
+        exit_rate = float(exit_mask.mean())
+        latency = stage1_s + (1.0 - exit_rate) * stack_s
+        rows.append({
+            "threshold": round(float(t), 4),
+            "early_exit_rate": round(exit_rate, 4),
+            "accuracy": round(acc, 4),
+            "accuracy_lost": round(baseline_acc - acc, 4),
+            "early_exit_accuracy": round(float((stage1_pred[exit_mask] == y_test[exit_mask]).mean()), 4)
+            if exit_mask.any() else None,
+            "mean_latency_ms": round(latency * 1000, 3),
+            "latency_saved_ms": round((stack_s - latency) * 1000, 3),
+        })
+    return {
+        "stack_accuracy": round(baseline_acc, 4),
+        "stack_latency_ms": round(stack_s * 1000, 3),
+        "first_stage_latency_ms": round(stage1_s * 1000, 3),
+        "temperature": temperature,
+        "thresholds": rows,
+    }
+
+
+def _cmd_fit_head(args):
+    import joblib
+    from sklearn.linear_model import LogisticRegression
+
+    X = np.load(args.features, mmap_mode="r")
+    y = np.load(args.labels)
+    head = LogisticRegression(max_iter=args.max_iter, C=args.c, n_jobs=-1)
+    head.fit(X, y)
+    joblib.dump(head, args.output)
+    print(f"Linear head saved to {args.output} (train accuracy {head.score(X, y):.4f})")
+
+
+def _cmd_sweep(args):
+    import joblib
+
+    stack = joblib.load(args.stack)
+    X_test = np.load(args.test_features, mmap_mode="r")
+    y_test = np.load(args.test_labels).astype(int)
+
+    if args.head:
+        head = joblib.load(args.head)
+        first_stage_fn = head.predict_proba
+    elif args.cnn_model:
+        kernel, bias = cnn_head_weights(args.cnn_model)
+        first_stage_fn = lambda X: softmax(np.asarray(X, dtype=np.float32) @ kernel + bias)  # noqa: E731
+    else:
+        raise SystemExit("Pass --cnn-model or --head for the first stage")
+
+    temperature = args.temperature
+    if temperature is None and args.val_features:
+        X_val = np.load(args.val_features, mmap_mode="r")
+        y_val = np.load(args.val_labels).astype(int)
+        temperature = fit_temperature(first_stage_fn(X_val), y_val)
+    temperature = temperature or 1.0
+
+    thresholds = np.round(np.arange(args.start, args.stop + 1e-9, args.step), 4)
+    report = sweep(stack, first_stage_fn, X_test, y_test, thresholds, temperature)
+
+    print(f"Stack accuracy {report['stack_accuracy']:.4f}, {report['stack_latency_ms']:.2f} ms/row; "
+          f"first stage {report['first_stage_latency_ms']:.3f} ms/row; temperature {temperature:.2f}")
+    print(f"{'threshold':>9} {'exit':>7} {'accuracy':>9} {'lost':>7} {'latency':>9} {'saved':>8}")
+    for r in report["thresholds"]:
+        print(f"{r['threshold']:>9.3f} {r['early_exit_rate']:>7.1%} {r['accuracy']:>9.4f} "
+              f"{r['accuracy_lost']:>7.4f} {r['mean_latency_ms']:>7.2f}ms {r['latency_saved_ms']:>6.2f}ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("fit-head", help="Fit the logistic-regression first stage on embeddings")
+    p.add_argument("--features", required=True)
+    p.add_argument("--labels", required=True)
+    p.add_argument("--output", required=True)
+    p.add_argument("--c", type=float, default=1.0)
+    p.add_argument("--max-iter", type=int, default=1000)
+    p.set_defaults(func=_cmd_fit_head)
+
+    p = sub.add_parser("sweep", help="Accuracy vs latency across thresholds on saved test features")
+    p.add_argument("--stack", required=True, help="Stacking model .pkl")
+    p.add_argument("--cnn-model", help="Fine-tuned CNN .h5 (first stage = its softmax head)")
+    p.add_argument("--head", help="Linear head .pkl (first stage = logistic regression)")
+    p.add_argument("--test-features", required=True)
+    p.add_argument("--test-labels", required=True)
+    p.add_argument("--val-features", help="Validation features for temperature calibration")
+    p.add_argument("--val-labels")
+    p.add_argument("--temperature", type=float, help="Skip calibration and use this temperature")
+    p.add_argument("--start", type=float, default=0.5)
+    p.add_argument("--stop", type=float, default=0.99)
+    p.add_argument("--step", type=float, default=0.01)
+    p.add_argument("--output", help="Write the sweep as JSON")
+    p.set_defaults(func=_cmd_sweep)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
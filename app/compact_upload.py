@@ -0,0 +1,64 @@
+"""Compact /predict uploads: a small raw pixel tensor resized in the browser.
+
+Instead of the original file (up to 16 MB), the chatbot page draws the
+X-ray on a canvas at ``COMPACT_UPLOAD_SIZE`` and posts the raw pixels:
+
+* ``tensor``   - ``width * height`` bytes (``gray8``) or ``width * height * 3``
+  bytes in RGB order (``rgb8``), optionally gzip-compressed (``encoding=gzip``)
+* ``format``, ``width``, ``height``, ``encoding`` - form fields describing it
+* ``report``   - optional downscaled JPEG kept for the PDF report
+
+The server validates the shape and wraps the bytes as an image array, so no
+full-resolution decode happens on the request path.
+"""
+import zlib
+
+import numpy as np
+
+FORMATS = {"gray8": 1, "rgb8": 3}
+ENCODINGS = ("identity", "gzip")
+MIN_SIDE = 16
+MAX_SIDE = 1024
+
+
+class CompactUploadError(ValueError):
+    """The compact upload is malformed"""
+
+
+def _gunzip(data, limit):
+    """Decompress gzip data, refusing anything that inflates past `limit` bytes"""
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        out = inflater.decompress(data, limit + 1)
+    except zlib.error as e:
+        raise CompactUploadError(f"Invalid gzip data: {e}")
+    if len(out) > limit or inflater.unconsumed_tail:
+        raise CompactUploadError("Tensor is larger than its declared shape")
+    return out
+
+
+def decode(data, fmt, width, height, encoding="identity"):
+    """Validate a compact tensor and return it as a BGR uint8 image (height, width, 3)"""
+    if fmt not in FORMATS:
+        raise CompactUploadError(f"Unknown tensor format {fmt!r}; expected one of {sorted(FORMATS)}")
+    if encoding not in ENCODINGS:
+        raise CompactUploadError(f"Unknown tensor encoding {encoding!r}")
+    try:
+        width, height = int(width), int(height)
+    except (TypeError, ValueError):
+        raise CompactUploadError("Tensor width and height must be integers")
+    if not (MIN_SIDE <= width <= MAX_SIDE and MIN_SIDE <= height <= MAX_SIDE):
+        raise CompactUploadError(f"Tensor sides must be between {MIN_SIDE} and {MAX_SIDE} pixels")
+
+    channels = FORMATS[fmt]
+    expected = width * height * channels
+    if encoding == "gzip":
+        data = _gunzip(data, expected)
+    if len(data) != expected:
+        raise CompactUploadError(f"Tensor has {len(data)} bytes, expected {expected} for {width}x{height} {fmt}")
+
+    pixels = np.frombuffer(data, dtype=np.uint8)
+    if channels == 1:
+        return np.repeat(pixels.reshape(height, width, 1), 3, axis=2)
+    # RGB from the canvas -> BGR, the channel order cv2.imread gives the model
+    return np.ascontiguousarray(pixels.reshape(height, width, 3)[:, :, ::-1])
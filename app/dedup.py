@@ -0,0 +1,133 @@
+"""Near-duplicate X-ray detection with perceptual hashes.
+
+A re-exported, re-compressed or re-scanned X-ray has different bytes but
+almost the same picture. Each upload gets a 64-bit DCT perceptual hash of
+its 224x224 RGB model input (a 32x32 DCT, low 8x8 frequencies compared
+with their median). Copies of one image land within a few bits of each
+other.
+
+``HashIndex`` finds earlier hashes within ``max_distance`` bits using
+multi-index hashing. The 64 bits are split into 4 bands of 16 bits. By the
+pigeonhole principle, any match is within ``max_distance // 4`` bits of
+the query on at least one band. A lookup therefore probes each band's
+table with the few keys in that radius and popcounts the candidates it
+finds, instead of scanning the whole index.
+"""
+import itertools
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from lazy_imports import lazy_import
+
+cv2 = lazy_import("cv2")
+
+HASH_BITS = 64
+BANDS = 4
+DCT_SIZE = 32
+LOW_FREQ = 8
+
+
+def phash(image):
+    """64-bit DCT perceptual hash of a uint8 image (grayscale or RGB)"""
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(image, (DCT_SIZE, DCT_SIZE), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(small.astype(np.float32))[:LOW_FREQ, :LOW_FREQ].ravel()
+    # The DC term only tracks overall brightness, so keep it out of the median
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def _flip_masks(width, radius):
+    """Every mask of at most `radius` set bits within `width` bits"""
+    return [sum(1 << bit for bit in bits)
+            for r in range(radius + 1) for bits in itertools.combinations(range(width), r)]
+
+
+class HashIndex:
+    """Bounded in-memory multi-index over 64-bit hashes; the oldest entries are evicted first"""
+
+    def __init__(self, max_distance=4, capacity=10000):
+        # Beyond a quarter of a band per band, probing costs more than it saves
+        if not 0 <= max_distance < HASH_BITS // BANDS:
+            raise ValueError(f"max_distance must be between 0 and {HASH_BITS // BANDS - 1}")
+        self.max_distance = max_distance
+        self.capacity = capacity
+        width = HASH_BITS // BANDS
+        self._bands = [(HASH_BITS - width * (i + 1), (1 << width) - 1) for i in range(BANDS)]
+        self._probes = _flip_masks(width, max_distance // BANDS)
+        self._tables = [{} for _ in self._bands]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+
+    def _keys(self, value):
+        return [(value >> shift) & mask for shift, mask in self._bands]
+
+    def add(self, value, payload):
+        """Index `payload` under `value`, replacing an earlier payload with the same hash"""
+        with self._lock:
+            if value in self._entries:
+                self._entries[value] = payload
+                self._entries.move_to_end(value)
+                return
+            self._entries[value] = payload
+            for table, key in zip(self._tables, self._keys(value)):
+                table.setdefault(key, []).append(value)
+            while len(self._entries) > self.capacity:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, value):
+        del self._entries[value]
+        for table, key in zip(self._tables, self._keys(value)):
+            bucket = table[key]
+            bucket.remove(value)
+            if not bucket:
+                del table[key]
+
+    def discard(self, value):
+        with self._lock:
+            if value in self._entries:
+                self._remove(value)
+
+    def lookup(self, value, max_distance=None):
+        """`(distance, payload)` of the closest indexed hash within `max_distance` bits, or None"""
+        limit = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        with self._lock:
+            self.lookups += 1
+            best = None
+            seen = set()
+            for table, key in zip(self._tables, self._keys(value)):
+                for probe in self._probes:
+                    for candidate in table.get(key ^ probe, ()):
+                        if candidate in seen:
+                            continue
+                        seen.add(candidate)
+                        distance = hamming(value, candidate)
+                        if distance <= limit and (best is None or distance < best[0]):
+                            best = (distance, candidate)
+            if best is None:
+                return None
+            self.hits += 1
+            return best[0], self._entries[best[1]]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "capacity": self.capacity,
+                "max_distance": self.max_distance,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else None,
+            }
@@ -0,0 +1,344 @@
+"""DICOM ingestion without loading whole studies into memory.
+
+PACS exports arrive as DICOM, often 16-bit and sometimes multi-frame. A
+file is read in two steps:
+
+* the header is parsed with ``pydicom`` and ``stop_before_pixels``, so no
+  pixel data is read
+* native (uncompressed) pixel data is memory-mapped at its file offset;
+  encapsulated (JPEG / JPEG 2000) data is indexed fragment by fragment and
+  only the requested frame is read and decoded
+
+A frame is resized in its stored integer type. Rescale slope/intercept,
+window/level and MONOCHROME1 inversion are then applied vectorized to the
+small result, so no full-size float copy is ever made. ``pydicom`` is
+optional; without it DICOM uploads are rejected.
+
+    python app/dicom.py info study.dcm
+    python app/dicom.py render study.dcm --frame 3 --output frame3.png
+"""
+import argparse
+import importlib.util
+import json
+import os
+import struct
+import sys
+from functools import lru_cache
+
+import numpy as np
+
+from lazy_imports import lazy_import
+
+cv2 = lazy_import("cv2")
+# Optional; only needed for DICOM uploads, and imported on the first one
+pydicom = lazy_import("pydicom")
+
+EXTENSIONS = {"dcm", "dicom"}
+
+IMPLICIT_LITTLE = "1.2.840.10008.1.2"
+EXPLICIT_LITTLE = "1.2.840.10008.1.2.1"
+EXPLICIT_BIG = "1.2.840.10008.1.2.2"
+DEFLATED = "1.2.840.10008.1.2.1.99"
+NATIVE_SYNTAXES = {IMPLICIT_LITTLE, EXPLICIT_LITTLE, EXPLICIT_BIG}
+
+PIXEL_DATA_TAG = (0x7FE0, 0x0010)
+ITEM_TAG = (0xFFFE, 0xE000)
+SEQUENCE_END_TAG = (0xFFFE, 0xE0DD)
+UNDEFINED_LENGTH = 0xFFFFFFFF
+# VRs whose explicit-VR element header carries 2 reserved bytes and a 4-byte length
+LONG_VRS = {b"OB", b"OW", b"OF", b"OD", b"OL", b"OV", b"SQ", b"UC", b"UN", b"UR", b"UT"}
+
+
+class DicomError(ValueError):
+    """The file is not a DICOM image this service can read"""
+
+
+@lru_cache(maxsize=1)
+def available():
+    """Whether pydicom is installed, checked without importing it"""
+    return importlib.util.find_spec("pydicom") is not None
+
+
+def is_dicom_path(path):
+    """True for .dcm/.dicom names or files with the DICM preamble marker"""
+    if path.rsplit(".", 1)[-1].lower() in EXTENSIONS:
+        return True
+    try:
+        with open(path, "rb") as f:
+            f.seek(128)
+            return f.read(4) == b"DICM"
+    except OSError:
+        return False
+
+
+def _first(value, default=None):
+    """First value of a possibly multi-valued element"""
+    if value is None or value == "":
+        return default
+    if isinstance(value, (list, tuple)) or type(value).__name__ == "MultiValue":
+        return value[0] if len(value) else default
+    return value
+
+
+class DicomImage:
+    """Header of one DICOM file plus lazy access to its frames"""
+
+    def __init__(self, path):
+        if not available():
+            raise DicomError("DICOM support needs the optional 'pydicom' package")
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            try:
+                ds = pydicom.dcmread(self._file, stop_before_pixels=True, force=True)
+            except Exception as e:
+                raise DicomError(f"Not a readable DICOM file: {e}")
+            # dcmread leaves the file at the start of the element it stopped before
+            self._pixel_tell = self._file.tell()
+            self._read_header(ds)
+            self._locate_pixels()
+        except Exception:
+            self._file.close()
+            raise
+
+    def _read_header(self, ds):
+        meta = getattr(ds, "file_meta", None)
+        self.transfer_syntax = str(getattr(meta, "TransferSyntaxUID", "") or IMPLICIT_LITTLE)
+        if self.transfer_syntax == DEFLATED:
+            raise DicomError("Deflated DICOM files are not supported")
+        self.native = self.transfer_syntax in NATIVE_SYNTAXES
+        self.big_endian = self.transfer_syntax == EXPLICIT_BIG
+        self.implicit_vr = self.transfer_syntax == IMPLICIT_LITTLE
+
+        try:
+            self.rows = int(ds.Rows)
+            self.columns = int(ds.Columns)
+        except AttributeError:
+            raise DicomError("DICOM file has no image dimensions")
+        self.frames = int(ds.get("NumberOfFrames", 1) or 1)
+        self.samples = int(ds.get("SamplesPerPixel", 1) or 1)
+        self.planar = int(ds.get("PlanarConfiguration", 0) or 0)
+        self.bits_allocated = int(ds.get("BitsAllocated", 16) or 16)
+        self.bits_stored = int(ds.get("BitsStored", self.bits_allocated) or self.bits_allocated)
+        self.signed = int(ds.get("PixelRepresentation", 0) or 0) == 1
+        self.photometric = str(ds.get("PhotometricInterpretation", "MONOCHROME2")).strip()
+        self.slope = float(_first(ds.get("RescaleSlope"), 1.0))
+        self.intercept = float(_first(ds.get("RescaleIntercept"), 0.0))
+        center = _first(ds.get("WindowCenter"))
+        width = _first(ds.get("WindowWidth"))
+        self.window = (float(center), float(width)) if center is not None and width is not None else None
+        if self.window is not None and self.window[1] <= 1:
+            self.window = None
+
+        if self.bits_allocated not in (8, 16, 32):
+            raise DicomError(f"Unsupported bits allocated: {self.bits_allocated}")
+        if self.samples not in (1, 3):
+            raise DicomError(f"Unsupported samples per pixel: {self.samples}")
+        kind = "i" if self.signed else "u"
+        self.dtype = np.dtype(f"{'>' if self.big_endian else '<'}{kind}{self.bits_allocated // 8}")
+
+    def _read_element_header(self):
+        """`(tag, length)` of the data element at the current file position"""
+        order = ">" if self.big_endian else "<"
+        raw = self._file.read(8)
+        if len(raw) < 8:
+            raise DicomError("DICOM file has no pixel data")
+        group, element = struct.unpack(order + "HH", raw[:4])
+        if self.implicit_vr or (group, element) in (ITEM_TAG, SEQUENCE_END_TAG):
+            return (group, element), struct.unpack(order + "I", raw[4:])[0]
+        if raw[4:6] in LONG_VRS:
+            return (group, element), struct.unpack(order + "I", self._file.read(4))[0]
+        return (group, element), struct.unpack(order + "H", raw[6:])[0]
+
+    def _locate_pixels(self):
+        self._file.seek(self._pixel_tell)
+        tag, length = self._read_element_header()
+        if tag != PIXEL_DATA_TAG:
+            raise DicomError("DICOM file has no pixel data")
+        self._pixel_offset = self._file.tell()
+        self._pixels = None
+
+        if self.native:
+            if length == UNDEFINED_LENGTH:
+                raise DicomError("Native pixel data with undefined length")
+            frame_shape = (self.rows, self.columns)
+            if self.samples == 3:
+                frame_shape = (3,) + frame_shape if self.planar else frame_shape + (3,)
+            needed = self.frames * int(np.prod(frame_shape)) * self.dtype.itemsize
+            if needed > length or self._pixel_offset + needed > os.path.getsize(self.path):
+                raise DicomError("Pixel data is shorter than the image dimensions")
+            self._pixels = np.memmap(self.path, dtype=self.dtype, mode="r", offset=self._pixel_offset,
+                                     shape=(self.frames,) + frame_shape)
+            self.fragments = None
+            return
+
+        # Encapsulated: index the Basic Offset Table and fragment positions, skipping their contents
+        if length != UNDEFINED_LENGTH:
+            raise DicomError("Encapsulated pixel data must have undefined length")
+        tag, table_length = self._read_element_header()
+        if tag != ITEM_TAG:
+            raise DicomError("Encapsulated pixel data has no offset table")
+        table = self._file.read(table_length)
+        offsets = list(struct.unpack(f"<{table_length // 4}I", table)) if table_length else []
+        first_fragment = self._file.tell()
+        fragments = []
+        while True:
+            position = self._file.tell()
+            tag, item_length = self._read_element_header()
+            if tag == SEQUENCE_END_TAG:
+                break
+            if tag != ITEM_TAG:
+                raise DicomError("Malformed encapsulated pixel data")
+            fragments.append((position - first_fragment, self._file.tell(), item_length))
+            self._file.seek(item_length, os.SEEK_CUR)
+        if not fragments:
+            raise DicomError("Encapsulated pixel data has no fragments")
+
+        if len(offsets) == self.frames:
+            starts = offsets + [float("inf")]
+            self.fragments = [[(pos, size) for rel, pos, size in fragments if starts[i] <= rel < starts[i + 1]]
+                              for i in range(self.frames)]
+        elif self.frames == 1:
+            self.fragments = [[(pos, size) for _, pos, size in fragments]]
+        elif len(fragments) == self.frames:
+            self.fragments = [[(pos, size)] for _, pos, size in fragments]
+        else:
+            raise DicomError("Cannot split encapsulated fragments into frames without an offset table")
+
+    def default_frame(self):
+        """Frame scored for a multi-frame study: the middle one"""
+        return self.frames // 2
+
+    def frame(self, index=None):
+        """Stored values of one frame: a memory-mapped view, or the decoded frame for compressed data"""
+        index = self.default_frame() if index is None else int(index)
+        if not 0 <= index < self.frames:
+            raise DicomError(f"Frame {index} out of range (0-{self.frames - 1})")
+        if self._pixels is not None:
+            pixels = self._pixels[index]
+            return np.moveaxis(pixels, 0, -1) if self.samples == 3 and self.planar else pixels
+
+        data = bytearray()
+        for position, size in self.fragments[index]:
+            self._file.seek(position)
+            data += self._file.read(size)
+        decoded = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED | cv2.IMREAD_ANYDEPTH)
+        if decoded is None:
+            raise DicomError(f"Cannot decode pixel data with transfer syntax {self.transfer_syntax}")
+        return decoded
+
+    def render(self, frame, size):
+        """Resize a frame to `size` (width, height) and window it into a BGR uint8 image"""
+        width, height = size
+        if frame.ndim == 3:
+            # Color data is already display-ready
+            small = cv2.resize(np.ascontiguousarray(frame), (width, height), interpolation=cv2.INTER_AREA)
+            if small.dtype != np.uint8:
+                small = cv2.normalize(small, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+            return small if self._pixels is None else np.ascontiguousarray(small[:, :, ::-1])
+
+        if frame.dtype.itemsize == 4:
+            # OpenCV resizes 8/16-bit integers natively; 32-bit data is converted first
+            frame = frame.astype(np.float32)
+        elif frame.dtype.byteorder == ">":
+            frame = frame.astype(frame.dtype.newbyteorder("="))
+        small = cv2.resize(np.ascontiguousarray(frame), (width, height), interpolation=cv2.INTER_AREA)
+
+        values = small.astype(np.float32)
+        if self.slope != 1.0 or self.intercept != 0.0:
+            values *= self.slope
+            values += self.intercept
+        if self.window is not None:
+            center, window_width = self.window
+            low = center - 0.5 - (window_width - 1) / 2
+            scale = 1.0 / (window_width - 1)
+        else:
+            low, high = float(values.min()), float(values.max())
+            scale = 1.0 / (high - low) if high > low else 0.0
+        values -= low
+        values *= scale
+        np.clip(values, 0.0, 1.0, out=values)
+        if self.photometric == "MONOCHROME1":
+            np.subtract(1.0, values, out=values)
+
+        gray = np.empty((height, width, 3), dtype=np.uint8)
+        np.multiply(values, 255.0, out=values)
+        np.rint(values, out=values)
+        gray[...] = values.astype(np.uint8)[:, :, None]
+        return gray
+
+    def fit(self, max_side):
+        """(width, height) scaled so the longer side is at most `max_side`"""
+        scale = min(1.0, max_side / max(self.rows, self.columns))
+        return max(1, round(self.columns * scale)), max(1, round(self.rows * scale))
+
+    def describe(self):
+        return {
+            "transfer_syntax": self.transfer_syntax,
+            "encapsulated": not self.native,
+            "rows": self.rows,
+            "columns": self.columns,
+            "frames": self.frames,
+            "samples": self.samples,
+            "bits_allocated": self.bits_allocated,
+            "bits_stored": self.bits_stored,
+            "signed": self.signed,
+            "photometric": self.photometric,
+            "rescale": [self.slope, self.intercept],
+            "window": list(self.window) if self.window else None,
+        }
+
+    def close(self):
+        self._pixels = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _cmd_info(args):
+    with DicomImage(args.path) as image:
+        print(json.dumps(image.describe(), indent=2))
+    return 0
+
+
+def _cmd_render(args):
+    with DicomImage(args.path) as image:
+        frame = image.frame(args.frame)
+        size = (args.size, args.size) if args.size else image.fit(args.max_side)
+        if not cv2.imwrite(args.output, image.render(frame, size)):
+            print(f"Could not write {args.output}", file=sys.stderr)
+            return 1
+    print(f"Wrote {args.output}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and render DICOM files")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("info", help="Print the image header fields used for rendering")
+    p.add_argument("path")
+    p.set_defaults(func=_cmd_info)
+
+    p = sub.add_parser("render", help="Render one frame to PNG/JPEG")
+    p.add_argument("path")
+    p.add_argument("--frame", type=int, default=None, help="Frame index (default: middle frame)")
+    p.add_argument("--size", type=int, default=0, help="Square output side, as fed to the model (e.g. 224)")
+    p.add_argument("--max-side", type=int, default=1024, help="Longest output side when --size is not set")
+    p.add_argument("--output", required=True)
+    p.set_defaults(func=_cmd_render)
+
+    args = parser.parse_args(argv)
+    try:
+        return args.func(args)
+    except DicomError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+"""Streaming drift monitor for embeddings and predictions.
+
+Inputs from a new scanner or site can move away from the training
+distribution long before accuracy visibly drops. Every prediction updates
+fixed-size running statistics, in O(dim) per request with no stored
+features:
+
+* an exponentially weighted per-dimension mean and variance of the pooled
+  embedding (half-life in requests)
+* exponentially weighted frequencies of the predicted classes
+* an exponentially weighted histogram of top-class confidence
+
+The statistics start from the first live observations, not the baseline:
+request n is weighted max(1/n, alpha), a plain running average until the
+exponential weight takes over, so early traffic is not pulled towards the
+baseline. The class and confidence statistics are only fed stack
+probabilities, like the baseline's: callers pass ``probs=None`` for
+cascade early exits, which then update the embedding statistics alone.
+
+``scores()`` compares them with a baseline computed offline from
+``X_train.npy``:
+
+* ``embedding_z``      - mean |live mean - baseline mean| / baseline std over dimensions
+* ``embedding_kl``     - mean per-dimension Gaussian KL(live || baseline)
+* ``shifted_dims``     - fraction of dimensions whose mean moved more than 3 baseline std
+* ``class_psi``        - population stability index of predicted classes
+* ``confidence_psi``   - population stability index of the confidence histogram
+
+    python app/drift.py baseline --features notebooks/X_train.npy --labels notebooks/y_train.npy \\
+        --stack models/fast_rf_xgb_stack2.pkl --eval-features notebooks/X_val.npy --output models/drift_baseline.npz
+    python app/drift.py replay --baseline models/drift_baseline.npz --features notebooks/X_test.npy \\
+        --stack models/fast_rf_xgb_stack2.pkl
+"""
+import argparse
+import json
+import sys
+import threading
+
+import numpy as np
+
+CONFIDENCE_BINS = np.linspace(0.0, 1.0, 11)
+# Common rule of thumb: PSI above 0.2 is a significant shift
+PSI_ALERT = 0.2
+Z_ALERT = 0.25
+MIN_REQUESTS = 50
+EPS = 1e-6
+
+
+def psi(live, base):
+    """Population stability index between two frequency vectors"""
+    live = np.clip(live / max(live.sum(), EPS), EPS, None)
+    base = np.clip(base / max(base.sum(), EPS), EPS, None)
+    return float(np.sum((live - base) * np.log(live / base)))
+
+
+def confidence_histogram(probs):
+    counts, _ = np.histogram(np.max(probs, axis=1), bins=CONFIDENCE_BINS)
+    return counts.astype(np.float64)
+
+
+# -------------------------------
+# BASELINE
+# -------------------------------
+def compute_baseline(features, labels=None, probs=None, block_rows=8192, model_version=""):
+    """Baseline statistics of an (n, dim) matrix (memmaps are read in blocks)"""
+    count, dim = features.shape
+    total = np.zeros(dim, dtype=np.float64)
+    total_sq = np.zeros(dim, dtype=np.float64)
+    for start in range(0, count, block_rows):
+        block = np.asarray(features[start:start + block_rows], dtype=np.float64)
+        total += block.sum(axis=0)
+        total_sq += np.square(block).sum(axis=0)
+    mean = total / count
+    var = np.maximum(total_sq / count - np.square(mean), 0.0)
+
+    baseline = {"mean": mean, "var": var, "count": np.int64(count), "model_version": np.str_(model_version)}
+    if probs is not None:
+        baseline["class_freq"] = np.bincount(np.argmax(probs, axis=1), minlength=probs.shape[1]).astype(np.float64)
+        baseline["confidence_hist"] = confidence_histogram(probs)
+    elif labels is not None:
+        # Without model outputs, the label prior is the closest stand-in for predicted classes
+        baseline["class_freq"] = np.bincount(np.asarray(labels, dtype=int)).astype(np.float64)
+    return baseline
+
+
+def save_baseline(path, baseline):
+    np.savez(path, **baseline)
+
+
+def load_baseline(path):
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+# -------------------------------
+# STREAMING MONITOR
+# -------------------------------
+class DriftMonitor:
+    """Exponentially weighted live statistics compared with a fixed baseline"""
+
+    def __init__(self, baseline, half_life=500, min_requests=MIN_REQUESTS):
+        self.baseline = baseline
+        self.model_version = str(baseline.get("model_version", ""))
+        self.dim = len(baseline["mean"])
+        self.half_life = half_life
+        self.min_requests = min_requests
+        self.alpha = 1.0 - 0.5 ** (1.0 / half_life)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.scored = 0
+        self.mean = np.zeros(self.dim, dtype=np.float64)
+        self.var = np.zeros(self.dim, dtype=np.float64)
+        self._diff = np.empty(self.dim, dtype=np.float64)
+        self._base_std = np.sqrt(np.maximum(np.asarray(baseline["var"], dtype=np.float64), EPS))
+        classes = len(baseline["class_freq"]) if "class_freq" in baseline else 0
+        self.class_freq = np.zeros(classes, dtype=np.float64)
+        self.confidence_hist = np.zeros(len(CONFIDENCE_BINS) - 1, dtype=np.float64)
+
+    def update(self, features, probs=None):
+        """Fold one prediction into the live statistics; without `probs` only the embedding is tracked"""
+        features = np.ravel(features)
+        if features.shape[0] != self.dim:
+            raise ValueError(f"Expected {self.dim}-d features, got {features.shape[0]}-d")
+        with self._lock:
+            self.requests += 1
+            a = max(self.alpha, 1.0 / self.requests)
+            # West's incremental update of an exponentially weighted mean and variance
+            diff = np.subtract(features, self.mean, out=self._diff)
+            self.var += a * diff * diff
+            self.var *= 1.0 - a
+            self.mean += a * diff
+        if probs is None:
+            return
+        probs = np.ravel(probs)
+        top = int(np.argmax(probs))
+        bucket = min(int(probs[top] * (len(CONFIDENCE_BINS) - 1)), len(CONFIDENCE_BINS) - 2)
+        with self._lock:
+            self.scored += 1
+            a = max(self.alpha, 1.0 / self.scored)
+            if len(self.class_freq):
+                self.class_freq *= 1.0 - a
+                if top < len(self.class_freq):
+                    self.class_freq[top] += a
+            self.confidence_hist *= 1.0 - a
+            self.confidence_hist[bucket] += a
+
+    def scores(self):
+        """Drift scores against the baseline; only the status until `min_requests` have been seen"""
+        with self._lock:
+            requests, scored = self.requests, self.scored
+            mean, var = self.mean.copy(), self.var.copy()
+            class_freq, confidence_hist = self.class_freq.copy(), self.confidence_hist.copy()
+        result = {"requests": requests, "scored": scored, "half_life": self.half_life,
+                  "model_version": self.model_version}
+        if requests < self.min_requests:
+            result["status"] = "warming_up"
+            return result
+
+        base_mean, base_var = self.baseline["mean"], np.maximum(self.baseline["var"], EPS)
+        z = np.abs(mean - base_mean) / self._base_std
+        live_var = np.maximum(var, EPS)
+        kl = 0.5 * (np.log(base_var / live_var) + (live_var + np.square(mean - base_mean)) / base_var - 1.0)
+        result.update({
+            "embedding_z": round(float(z.mean()), 4),
+            "embedding_kl": round(float(kl.mean()), 4),
+            "shifted_dims": round(float((z > 3.0).mean()), 4),
+        })
+        if len(class_freq) and scored >= self.min_requests:
+            result["class_psi"] = round(psi(class_freq, self.baseline["class_freq"]), 4)
+        if "confidence_hist" in self.baseline and scored >= self.min_requests:
+            result["confidence_psi"] = round(psi(confidence_hist, self.baseline["confidence_hist"]), 4)
+
+        alerts = [name for name in ("class_psi", "confidence_psi") if result.get(name, 0.0) > PSI_ALERT]
+        if result["embedding_z"] > Z_ALERT:
+            alerts.append("embedding_z")
+        result["alerts"] = alerts
+        result["status"] = "drift" if alerts else "ok"
+        return result
+
+
+# -------------------------------
+# COMMAND LINE
+# -------------------------------
+def _stack_probs(stack_path, features):
+    import joblib
+
+    return joblib.load(stack_path).predict_proba(np.asarray(features))
+
+
+def _cmd_baseline(args):
+    features = np.load(args.features, mmap_mode="r")
+    labels = np.load(args.labels) if args.labels else None
+    probs = None
+    if args.stack:
+        # Held-out rows give the confidence profile the live service should reproduce
+        probs = _stack_probs(args.stack, np.load(args.eval_features or args.features, mmap_mode="r"))
+    from preprocessing import embedding_version
+
+    baseline = compute_baseline(features, labels, probs, model_version=embedding_version(args.model_version))
+    save_baseline(args.output, baseline)
+    print(f"Wrote baseline of {int(baseline['count'])} x {len(baseline['mean'])} to {args.output}")
+    return 0
+
+
+def _cmd_replay(args):
+    monitor = DriftMonitor(load_baseline(args.baseline), half_life=args.half_life)
+    features = np.load(args.features, mmap_mode="r")
+    probs = _stack_probs(args.stack, features) if args.stack else np.full((len(features), 1), 1.0)
+    for row, p in zip(features, probs):
+        monitor.update(row, p)
+    print(json.dumps(monitor.scores(), indent=2))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("baseline", help="Compute the training baseline")
+    p.add_argument("--features", required=True, help="Training embeddings (X_train.npy)")
+    p.add_argument("--labels", help="Training labels, used when no --stack is given")
+    p.add_argument("--stack", help="Stacking model for predicted-class and confidence baselines")
+    p.add_argument("--eval-features", help="Held-out embeddings scored by --stack (default: --features)")
+    p.add_argument("--model-version", default="",
+                   help="CNN version of the embeddings; the preprocessing version is appended (empty matches any)")
+    p.add_argument("--output", required=True)
+    p.set_defaults(func=_cmd_baseline)
+
+    p = sub.add_parser("replay", help="Stream a feature matrix through the monitor and print its scores")
+    p.add_argument("--baseline", required=True)
+    p.add_argument("--features", required=True)
+    p.add_argument("--stack")
+    p.add_argument("--half-life", type=int, default=500)
+    p.set_defaults(func=_cmd_replay)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""Grad-CAM explanation overlays from the inference forward pass.
+
+A separate explanation pass (or SHAP) would double or triple the cost of a
+prediction. Instead, the explain model returns the last DenseNet conv block
+activations next to the pooled embedding and class probabilities, and the
+serving forward pass runs under a ``GradientTape``. Once the stack (or the
+cascade) has decided the class, the gradient of that class's CNN score with
+respect to those activations flows back only through the pooling and dense
+head, so an explanation costs one short backward step plus rendering:
+
+* the heatmap is the ReLU of the activations weighted by their spatially
+  averaged gradients, scaled to [0, 1]
+* the overlay is a small JPEG of the 224x224 model input with a colormap
+  blended on top
+* overlays are cached on disk by model version and input hash, so a
+  re-uploaded image is scored without the tape and never re-rendered
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from lazy_imports import lazy_import
+
+tf = lazy_import("tensorflow")
+cv2 = lazy_import("cv2")
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "on")
+
+# Last activation of the final DenseNet conv block, just before global pooling
+CONV_LAYER = "relu"
+OVERLAY_ALPHA = 0.4
+OVERLAY_JPEG_QUALITY = 85
+
+
+def build_explain_model(model, extractor, conv_layer=CONV_LAYER):
+    """One graph returning [conv activations, pooled embedding, CNN class probabilities]"""
+    return tf.keras.Model(inputs=model.input,
+                          outputs=[model.get_layer(conv_layer).output, extractor.output, model.output])
+
+
+def forward(explain_model, img):
+    """Forward pass recorded on a tape; returns `(tape, conv, pooled, probs)` for `heatmap`"""
+    with tf.GradientTape() as tape:
+        conv, pooled, probs = explain_model(img, training=False)
+    return tape, conv, pooled, probs
+
+
+def heatmap(tape, conv, probs, class_index):
+    """Grad-CAM heatmap of `class_index` (the reported class); returns `(heatmap, explain_seconds)`.
+
+    The class is usually decided by the stack after the forward pass, so the
+    gradient is taken afterwards through a one-hot output gradient, which
+    equals the gradient of `probs[:, class_index]`. `explain_seconds` covers
+    only this extra work, so callers can report it apart from inference.
+    """
+    start = time.perf_counter()
+    target = tf.one_hot([class_index], int(probs.shape[-1]), dtype=probs.dtype)
+    grads = tape.gradient(probs, conv, output_gradients=target)
+    weights = tf.reduce_mean(grads[0], axis=(0, 1))
+    heatmap = tf.nn.relu(tf.tensordot(conv[0], weights, axes=1)).numpy()
+    peak = heatmap.max()
+    if peak > 0:
+        heatmap /= peak
+    return heatmap.astype(np.float32), time.perf_counter() - start
+
+
+def render_overlay(image, heatmap, alpha=OVERLAY_ALPHA, quality=OVERLAY_JPEG_QUALITY):
+    """JPEG bytes of a BGR uint8 image with the heatmap blended over it"""
+    height, width = image.shape[:2]
+    heat = cv2.resize(heatmap, (width, height), interpolation=cv2.INTER_LINEAR)
+    colored = cv2.applyColorMap(np.uint8(np.clip(heat, 0.0, 1.0) * 255), cv2.COLORMAP_JET)
+    blended = cv2.addWeighted(colored, alpha, image, 1.0 - alpha, 0)
+    ok, encoded = cv2.imencode(".jpg", blended, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode explanation overlay")
+    return encoded.tobytes()
+
+
+def input_digest(img):
+    """Hash of a preprocessed model input; identical inputs get identical explanations"""
+    return hashlib.sha256(np.ascontiguousarray(img)).hexdigest()
+
+
+class ExplanationCache:
+    """Overlay JPEGs on disk, keyed by model version and input hash, least recently used evicted"""
+
+    def __init__(self, root, max_entries=512):
+        self.root = root
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        os.makedirs(root, exist_ok=True)
+        # Adopt overlays left by earlier runs, oldest first
+        existing = [name for name in os.listdir(root) if name.endswith(".jpg")]
+        existing.sort(key=lambda name: os.path.getmtime(os.path.join(root, name)))
+        for name in existing:
+            self._entries[name[:-4]] = os.path.join(root, name)
+        self._evict()
+
+    @staticmethod
+    def key(digest, version):
+        return hashlib.sha256(f"{version}\0{digest}".encode()).hexdigest()[:40]
+
+    def get(self, digest, version):
+        """Path of the cached overlay, or None"""
+        key = self.key(digest, version)
+        with self._lock:
+            path = self._entries.get(key)
+            if path is not None and os.path.exists(path):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return path
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+    def put(self, digest, version, jpeg):
+        """Store overlay bytes and return their path"""
+        key = self.key(digest, version)
+        path = os.path.join(self.root, f"{key}.jpg")
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(jpeg)
+        os.replace(tmp, path)
+        with self._lock:
+            self._entries[key] = path
+            self._entries.move_to_end(key)
+            self._evict()
+        return path
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            _, path = self._entries.popitem(last=False)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
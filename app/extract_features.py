@@ -0,0 +1,185 @@
+"""Parallel, resumable DenseNet feature extraction for the training notebooks.
+
+Replaces the notebooks' serial `extract_features_batch` passes. The dataset
+root is laid out the way `flow_from_directory` expects (one folder per split,
+one sub-folder per class). Every split is:
+
+1. listed and content-hashed on a thread pool,
+2. filtered against the feature store, so images already extracted with this
+   CNN and preprocessing version are skipped,
+3. split across worker processes, each with its own model copy, a threaded
+   decode/prefetch pipeline and its own writer into the sharded store,
+4. exported as dense `X_<split>.npy` / `y_<split>.npy` memmaps in
+   `flow_from_directory` order (classes sorted, then file names).
+
+    python app/extract_features.py --model models/densenet_new_finetuned_v3.h5 \\
+        --dataset /data/dataset --store feature_store --out notebooks
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import preprocessing
+from feature_store import FeatureStore
+from model_utils import allowed_file, build_feature_extractor, hash_file
+from pipeline import prefetch_batches
+
+logger = logging.getLogger("extract_features")
+
+# Split folder -> array suffix used by the notebooks (X_train.npy, X_val.npy, X_test.npy)
+SPLIT_ARRAYS = {"train": "train", "validation": "val", "test": "test"}
+
+
+def list_split(split_dir, allowed):
+    """Return `(paths, labels, class_names)` in flow_from_directory order"""
+    class_names = sorted(d for d in os.listdir(split_dir) if os.path.isdir(os.path.join(split_dir, d)))
+    paths, labels = [], []
+    for label, name in enumerate(class_names):
+        class_dir = os.path.join(split_dir, name)
+        for root, dirs, files in os.walk(class_dir):
+            dirs.sort()
+            for filename in sorted(files):
+                if allowed(filename):
+                    paths.append(os.path.join(root, filename))
+                    labels.append(label)
+    return paths, labels, class_names
+
+
+def _extract_worker(task):
+    """Worker process: extract embeddings for one partition into its own store writer"""
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(task["tf_threads"])
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    model = tf.keras.models.load_model(task["model_path"], compile=False)
+    extractor = build_feature_extractor(model)
+    if extractor is None:
+        raise RuntimeError(f"No pooling layer in {task['model_path']}")
+
+    store = FeatureStore(task["store"], dim=int(extractor.output_shape[-1]), writer=task["writer"])
+    meta = {path: (image_id, label) for path, image_id, label in task["items"]}
+    added, failed = 0, []
+    with ThreadPoolExecutor(max_workers=task["decode_threads"]) as decoder:
+        batches = prefetch_batches(list(meta), decoder, batch_size=task["batch_size"], prefetch=task["prefetch"])
+        for batch in batches:
+            good = [(path, img) for path, img, err in batch if err is None]
+            failed.extend(path for path, _, err in batch if err is not None)
+            if not good:
+                continue
+            tensor = preprocessing.normalize_batch(np.stack([img for _, img in good]))
+            features = np.asarray(extractor.predict_on_batch(tensor))
+            ids = [meta[path][0] for path, _ in good]
+            labels = [meta[path][1] for path, _ in good]
+            added += store.extend(ids, features.reshape(len(good), -1), task["model_version"], labels,
+                                  source=task["source"])
+    store.close()
+    return added, failed
+
+
+def extract_split(model_path, split_dir, store_dir, split, procs=None, tf_threads=None,
+                  decode_threads=4, batch_size=32, prefetch=4):
+    """Extract one split into the store; returns `(ids, labels, class_names, model_version)`"""
+    # Embeddings from an older preprocessing (e.g. BGR input) are stale even for the same CNN
+    model_version = preprocessing.embedding_version(os.path.splitext(os.path.basename(model_path))[0])
+    paths, labels, class_names = list_split(split_dir, allowed_file)
+    with ThreadPoolExecutor(max_workers=decode_threads * 2) as hasher:
+        digests = list(hasher.map(hash_file, paths))
+    ids = [f"{split}/{digest}" for digest in digests]
+
+    store = FeatureStore(store_dir) if os.path.exists(os.path.join(store_dir, "meta.json")) else None
+    todo, seen = [], set()
+    for path, image_id, label in zip(paths, ids, labels):
+        if image_id in seen or (store is not None and (image_id, model_version) in store):
+            continue
+        seen.add(image_id)
+        todo.append((path, image_id, label))
+    logger.info(f"📂 {split}: {len(paths)} images, {len(todo)} to extract, {len(paths) - len(todo)} cached")
+
+    if todo:
+        cores = os.cpu_count() or 1
+        procs = max(1, min(procs or max(1, cores // 4), len(todo)))
+        tf_threads = tf_threads or max(1, cores // procs)
+        tasks = [{
+            "model_path": model_path, "store": store_dir, "writer": f"extract-{split}-{k}",
+            "items": todo[k::procs], "model_version": model_version, "source": split,
+            "tf_threads": tf_threads, "decode_threads": decode_threads,
+            "batch_size": batch_size, "prefetch": prefetch,
+        } for k in range(procs)]
+
+        start = time.perf_counter()
+        # Spawn so each worker gets a fresh TensorFlow runtime
+        with multiprocessing.get_context("spawn").Pool(procs) as pool:
+            results = pool.map(_extract_worker, tasks)
+        added = sum(r[0] for r in results)
+        failed = [path for r in results for path in r[1]]
+        elapsed = time.perf_counter() - start
+        logger.info(f"✅ {split}: {added} embeddings in {elapsed:.1f}s ({added / max(elapsed, 1e-9):.1f} img/s)")
+        if failed:
+            logger.warning(f"⚠️ {split}: {len(failed)} images could not be decoded, e.g. {failed[0]}")
+
+    return ids, labels, class_names, model_version
+
+
+def export_split(store_dir, ids, labels, model_version, out_dir, suffix):
+    """Write dense X_<suffix>.npy / y_<suffix>.npy memmaps for one split"""
+    store = FeatureStore(store_dir)
+    rows = [(image_id, label) for image_id, label in zip(ids, labels) if (image_id, model_version) in store]
+    X = np.lib.format.open_memmap(os.path.join(out_dir, f"X_{suffix}.npy"), mode="w+",
+                                  dtype=store.dtype, shape=(len(rows), store.dim))
+    for i, (image_id, _) in enumerate(rows):
+        X[i] = store.get(image_id, model_version)
+    X.flush()
+    y = np.asarray([label for _, label in rows], dtype=np.int64)
+    np.save(os.path.join(out_dir, f"y_{suffix}.npy"), y)
+    return X, y
+
+
+def extract_splits(model_path, dataset_dir, splits=("train", "validation", "test"), store_dir="feature_store",
+                   out_dir=".", **options):
+    """Extract and export every split; returns `{split: (X, y)}` and writes class_indices.json"""
+    os.makedirs(out_dir, exist_ok=True)
+    arrays = {}
+    class_indices = None
+    for split in splits:
+        ids, labels, class_names, model_version = extract_split(
+            model_path, os.path.join(dataset_dir, split), store_dir, split, **options)
+        arrays[split] = export_split(store_dir, ids, labels, model_version, out_dir, SPLIT_ARRAYS.get(split, split))
+        class_indices = class_indices or {name: i for i, name in enumerate(class_names)}
+    with open(os.path.join(out_dir, "class_indices.json"), "w") as f:
+        json.dump(class_indices, f)
+    return arrays
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", required=True, help="Fine-tuned DenseNet .h5")
+    parser.add_argument("--dataset", required=True, help="Root with train/validation/test class folders")
+    parser.add_argument("--splits", default="train,validation,test")
+    parser.add_argument("--store", default="feature_store", help="Sharded embedding store directory")
+    parser.add_argument("--out", default=".", help="Where to write X_*.npy / y_*.npy")
+    parser.add_argument("--procs", type=int, help="Extraction processes (default: one per 4 cores)")
+    parser.add_argument("--tf-threads", type=int, help="TensorFlow threads per process")
+    parser.add_argument("--decode-threads", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--prefetch", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    arrays = extract_splits(
+        args.model, args.dataset, [s for s in args.splits.split(",") if s], args.store, args.out,
+        procs=args.procs, tf_threads=args.tf_threads, decode_threads=args.decode_threads,
+        batch_size=args.batch_size, prefetch=args.prefetch)
+    for split, (X, y) in arrays.items():
+        logger.info(f"💾 {split}: X{X.shape} y{y.shape}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,371 @@
+"""Sharded, memory-mapped store of pooled DenseNet embeddings.
+
+Layout of a store directory::
+
+    meta.json                     feature width, dtype and shard size
+    shards/<writer>-00000.npy     preallocated (shard_size, dim) .npy memmaps
+    index-<writer>.tsv            id, shard, row, model_version, label, source, timestamp, prediction
+
+``label`` is the ground-truth class index (empty when unknown, as for
+served images); ``prediction`` is the class index the service returned
+(empty for imported training data).
+
+Each process appends through its own writer name, so several web workers
+and offline jobs can fill one store without locking each other. Web workers
+claim a stable name with ``claim_writer`` (``web-<host>-<slot>`` under an
+exclusive lock), so a restarted worker resumes its last shard instead of
+preallocating a new one. Readers
+merge every index file and get zero-copy views into the shards, which lets
+a retrained or swapped tree classifier re-score the whole history without
+another CNN pass.
+
+    python app/feature_store.py import STORE --features notebooks/X_train.npy --labels notebooks/y_train.npy --source train
+    python app/feature_store.py rescore STORE --model models/fast_rf_xgb_stack2.pkl --output rescored.csv
+    python app/feature_store.py stats STORE
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+DEFAULT_SHARD_SIZE = 16384
+MAX_WRITER_SLOTS = 256
+
+# Lock files held for the life of the process, one per claimed writer name
+_claimed = {}
+INDEX_COLUMNS = ("id", "shard", "row", "model_version", "label", "source", "timestamp", "prediction")
+
+Entry = namedtuple("Entry", INDEX_COLUMNS)
+
+
+def claim_writer(root, prefix):
+    """Lowest free `<prefix>-<slot>` writer name, held under an exclusive lock until the process exits"""
+    try:
+        import fcntl
+    except ImportError:
+        return f"{prefix}-{os.getpid()}"
+    lock_dir = os.path.join(root, "locks")
+    os.makedirs(lock_dir, exist_ok=True)
+    for slot in range(MAX_WRITER_SLOTS):
+        name = f"{prefix}-{slot}"
+        if name in _claimed:
+            continue
+        f = open(os.path.join(lock_dir, f"{name}.lock"), "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            continue
+        _claimed[name] = f
+        return name
+    raise RuntimeError(f"All {MAX_WRITER_SLOTS} writer slots for {prefix} in {root} are in use")
+
+
+class FeatureStore:
+    """Append-only embedding store backed by sharded .npy memmaps"""
+
+    def __init__(self, root, dim=None, shard_size=DEFAULT_SHARD_SIZE, dtype="float32", writer="main"):
+        self.root = root
+        self.writer = writer
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, "shards"), exist_ok=True)
+
+        meta_path = os.path.join(root, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if dim is not None and dim != meta["dim"]:
+                raise ValueError(f"Store {root} holds {meta['dim']}-d features, not {dim}-d")
+        elif dim is None:
+            raise ValueError(f"Store {root} does not exist yet; pass dim to create it")
+        else:
+            meta = {"dim": int(dim), "dtype": dtype, "shard_size": int(shard_size)}
+            tmp = meta_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(meta, f)
+            os.replace(tmp, meta_path)
+
+        self.dim = meta["dim"]
+        self.dtype = np.dtype(meta["dtype"])
+        self.shard_size = meta["shard_size"]
+
+        self.entries = []
+        self._by_key = {}
+        self._shard_rows = {}
+        self._shards = {}
+        self.refresh()
+
+        self._index_file = None
+        self._shard = None
+        self._next_row = 0
+        own = [s for s in self._shard_rows if s.startswith(f"{writer}-")]
+        if own:
+            last = max(own)
+            self._shard, self._next_row = last, self._shard_rows[last]
+
+    # -------------------------------
+    # READING
+    # -------------------------------
+    def refresh(self):
+        """Reload every writer's index (picks up rows appended by other processes)"""
+        entries = []
+        for path in sorted(glob.glob(os.path.join(self.root, "index-*.tsv"))):
+            with open(path) as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        continue  # partially written final line
+                    parts = line[:-1].split("\t")
+                    if len(parts) == len(INDEX_COLUMNS) - 1:
+                        # Older indexes had no prediction column and kept served predictions (class names) in label
+                        label = parts[4]
+                        parts[4], parts[7:] = (label, [""]) if label.isdigit() else ("", [label])
+                    elif len(parts) != len(INDEX_COLUMNS):
+                        continue
+                    entries.append(Entry(parts[0], parts[1], int(parts[2]), parts[3],
+                                         parts[4], parts[5], float(parts[6]), parts[7]))
+        with self._lock:
+            self.entries = entries
+            self._by_key = {(e.id, e.model_version): e for e in entries}
+            self._shard_rows = {}
+            for e in entries:
+                self._shard_rows[e.shard] = max(self._shard_rows.get(e.shard, 0), e.row + 1)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        """`(id, model_version)` in store"""
+        return key in self._by_key
+
+    def model_versions(self):
+        return sorted({e.model_version for e in self.entries})
+
+    def shard(self, name):
+        """Read-only memmap of a whole shard, trimmed to its filled rows"""
+        mm = self._shards.get(name)
+        if mm is None:
+            mm = np.load(self._shard_path(name), mmap_mode="r")
+            self._shards[name] = mm
+        return mm[:self._shard_rows.get(name, 0)]
+
+    def get(self, image_id, model_version):
+        """Zero-copy view of one embedding, or None"""
+        entry = self._by_key.get((image_id, model_version))
+        if entry is None:
+            return None
+        return self.shard(entry.shard)[entry.row]
+
+    def iter_batches(self, model_version=None, source=None):
+        """Yield `(entries, features)` per shard.
+
+        Without filters `features` is a zero-copy view of the shard; with a
+        filter only the matching rows are gathered.
+        """
+        by_shard = {}
+        for e in self.entries:
+            by_shard.setdefault(e.shard, []).append(e)
+        for name in sorted(by_shard):
+            rows = by_shard[name]
+            view = self.shard(name)
+            if model_version is None and source is None and len(rows) == len(view):
+                rows.sort(key=lambda e: e.row)
+                yield rows, view
+                continue
+            rows = [e for e in rows
+                    if (model_version is None or e.model_version == model_version)
+                    and (source is None or e.source == source)]
+            if rows:
+                yield rows, view[np.fromiter((e.row for e in rows), dtype=np.int64, count=len(rows))]
+
+    def rescore(self, classifier, model_version=None, source=None):
+        """Yield `(entries, probabilities)` for every stored embedding"""
+        for rows, features in self.iter_batches(model_version, source):
+            if hasattr(classifier, "predict_proba"):
+                yield rows, classifier.predict_proba(features)
+            else:
+                yield rows, classifier.predict(features)
+
+    # -------------------------------
+    # WRITING
+    # -------------------------------
+    def append(self, image_id, features, model_version, label="", source="served", prediction=""):
+        """Store one embedding; repeated (id, model_version) pairs are skipped"""
+        return self.extend([image_id], np.reshape(features, (1, -1)), model_version, [label], source,
+                           [prediction])
+
+    def extend(self, ids, features, model_version, labels=None, source="served", predictions=None):
+        """Store a batch of embeddings, returning how many were new.
+
+        `labels` are ground-truth and `predictions` served class indices; either may be omitted.
+        """
+        features = np.asarray(features).reshape(len(ids), -1)
+        if features.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-d features, got {features.shape[1]}-d")
+        labels = labels if labels is not None else [""] * len(ids)
+        predictions = predictions if predictions is not None else [""] * len(ids)
+
+        added = 0
+        lines = []
+        with self._lock:
+            for image_id, vector, label, prediction in zip(ids, features, labels, predictions):
+                image_id = str(image_id)
+                if (image_id, model_version) in self._by_key:
+                    continue
+                shard = self._writable_shard()
+                row = self._next_row
+                self._shards[shard][row] = vector
+                self._next_row += 1
+                self._shard_rows[shard] = self._next_row
+
+                entry = Entry(image_id, shard, row, model_version, str(label), source, time.time(), str(prediction))
+                self.entries.append(entry)
+                self._by_key[(image_id, model_version)] = entry
+                lines.append("\t".join(str(v) for v in entry[:6]) + f"\t{entry.timestamp:.3f}\t{entry.prediction}\n")
+                added += 1
+
+            if lines:
+                index = self._open_index()
+                index.write("".join(lines))
+                index.flush()
+        return added
+
+    def flush(self):
+        """Push shard pages and the index to disk"""
+        with self._lock:
+            for name, mm in self._shards.items():
+                if isinstance(mm, np.memmap) and mm.mode != "r":
+                    mm.flush()
+            if self._index_file is not None:
+                self._index_file.flush()
+                os.fsync(self._index_file.fileno())
+
+    def close(self):
+        self.flush()
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+
+    def _open_index(self):
+        if self._index_file is None:
+            self._index_file = open(os.path.join(self.root, f"index-{self.writer}.tsv"), "a")
+        return self._index_file
+
+    def _shard_path(self, name):
+        return os.path.join(self.root, "shards", f"{name}.npy")
+
+    def _writable_shard(self):
+        """Return the current shard name, opening or creating it as needed (lock held)"""
+        if self._shard is None or self._next_row >= self.shard_size:
+            used = [s for s in self._shard_rows if s.startswith(f"{self.writer}-")]
+            number = int(max(used).rsplit("-", 1)[1]) + 1 if used else 0
+            self._shard = f"{self.writer}-{number:05d}"
+            self._next_row = 0
+            self._shards[self._shard] = np.lib.format.open_memmap(
+                self._shard_path(self._shard), mode="w+", dtype=self.dtype, shape=(self.shard_size, self.dim))
+        elif getattr(self._shards.get(self._shard), "mode", "r") == "r":
+            # Reopened after a restart (or only mapped for reading so far)
+            self._shards[self._shard] = np.load(self._shard_path(self._shard), mmap_mode="r+")
+        return self._shard
+
+
+# -------------------------------
+# COMMAND LINE
+# -------------------------------
+def _cmd_import(args):
+    from preprocessing import embedding_version
+
+    features = np.load(args.features, mmap_mode="r")
+    labels = np.load(args.labels) if args.labels else None
+    store = FeatureStore(args.store, dim=features.shape[1], writer=args.writer)
+    added = 0
+    for start in range(0, len(features), args.batch_size):
+        stop = min(start + args.batch_size, len(features))
+        ids = [f"{args.source}:{i}" for i in range(start, stop)]
+        batch_labels = [str(int(v)) for v in labels[start:stop]] if labels is not None else None
+        added += store.extend(ids, features[start:stop], embedding_version(args.model_version), batch_labels,
+                              source=args.source)
+    store.close()
+    print(f"Imported {added} of {len(features)} embeddings into {args.store}")
+
+
+def _cmd_rescore(args):
+    import csv
+
+    import joblib
+
+    classifier = joblib.load(args.model)
+    store = FeatureStore(args.store)
+    with open(args.output, "w", newline="") as f:
+        writer = csv.writer(f)
+        header_written = False
+        for rows, scores in store.rescore(classifier, args.model_version, args.source):
+            scores = np.asarray(scores)
+            if not header_written:
+                width = scores.shape[1] if scores.ndim == 2 else 1
+                writer.writerow(["id", "model_version", "label", "source", "served_prediction", "prediction"]
+                                + ([f"prob_{i}" for i in range(width)] if scores.ndim == 2 else []))
+                header_written = True
+            for entry, score in zip(rows, scores):
+                if scores.ndim == 2:
+                    writer.writerow([entry.id, entry.model_version, entry.label, entry.source, entry.prediction,
+                                     int(np.argmax(score))] + [f"{p:.6f}" for p in score])
+                else:
+                    writer.writerow([entry.id, entry.model_version, entry.label, entry.source, entry.prediction,
+                                     score])
+    print(f"Rescored {len(store)} embeddings into {args.output}")
+
+
+def _cmd_stats(args):
+    store = FeatureStore(args.store)
+    sources = {}
+    for e in store.entries:
+        sources[e.source] = sources.get(e.source, 0) + 1
+    print(json.dumps({
+        "entries": len(store),
+        "dim": store.dim,
+        "shards": len(store._shard_rows),
+        "model_versions": store.model_versions(),
+        "sources": sources,
+    }, indent=2))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("import", help="Load an existing X_*.npy feature matrix")
+    p.add_argument("store")
+    p.add_argument("--features", required=True)
+    p.add_argument("--labels")
+    p.add_argument("--source", default="train")
+    p.add_argument("--model-version", default="densenet_new_finetuned_v3",
+                   help="CNN version of the embeddings (the preprocessing version is appended)")
+    p.add_argument("--writer", default="import")
+    p.add_argument("--batch-size", type=int, default=4096)
+    p.set_defaults(func=_cmd_import)
+
+    p = sub.add_parser("rescore", help="Score stored embeddings with a (new) classifier")
+    p.add_argument("store")
+    p.add_argument("--model", required=True, help="joblib-pickled classifier")
+    p.add_argument("--output", required=True)
+    p.add_argument("--model-version", help="Only embeddings from this CNN version")
+    p.add_argument("--source", help="Only embeddings from this source (served, train, ...)")
+    p.set_defaults(func=_cmd_rescore)
+
+    p = sub.add_parser("stats", help="Summarize a store")
+    p.add_argument("store")
+    p.set_defaults(func=_cmd_stats)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
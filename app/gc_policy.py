@@ -0,0 +1,100 @@
+"""Garbage collection policy for serving workers.
+
+Forcing `gc.collect()` inside a request stalls every thread in the process
+for a full collection. Instead the process picks one policy at startup:
+
+* ``default``    - leave the interpreter's thresholds untouched
+* ``thresholds`` - raise the generation thresholds so young collections
+                   run less often and full collections become rare
+* ``periodic``   - disable automatic collection and run it from a
+                   background thread every few seconds, off the request path
+"""
+import gc
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ("default", "thresholds", "periodic")
+
+_state = {"policy": "default", "collections": 0, "last_pause_ms": 0.0}
+
+
+def parse_thresholds(value):
+    """Parse "g0,g1,g2" into a tuple of three ints"""
+    parts = [int(p) for p in value.split(",") if p.strip()]
+    if len(parts) != 3:
+        raise ValueError(f"GC thresholds need three values, got {value!r}")
+    return tuple(parts)
+
+
+def configure(policy="thresholds", thresholds=(50000, 20, 100), interval=30.0):
+    """Apply a GC policy to the current process"""
+    if policy not in POLICIES:
+        logger.warning(f"⚠️ Unknown GC policy '{policy}', using 'default'")
+        policy = "default"
+
+    _state["policy"] = policy
+    if policy == "thresholds":
+        gc.set_threshold(*thresholds)
+    elif policy == "periodic":
+        gc.disable()
+        threading.Thread(target=_periodic_collect, args=(interval,), daemon=True).start()
+
+    logger.info(f"🧹 GC policy: {policy} (thresholds={gc.get_threshold()})")
+
+
+def _periodic_collect(interval):
+    while True:
+        time.sleep(interval)
+        collect()
+
+
+def collect(generation=2):
+    """Run a collection off the request path; returns its pause in ms"""
+    start = time.perf_counter()
+    gc.collect(generation)
+    _state["last_pause_ms"] = (time.perf_counter() - start) * 1000
+    _state["collections"] += 1
+    return _state["last_pause_ms"]
+
+
+def freeze():
+    """Move everything allocated so far (models, graphs) out of GC tracking.
+
+    Called once the models are loaded so later full collections only scan
+    objects created while serving.
+    """
+    gc.collect()
+    gc.freeze()
+
+
+def refreeze():
+    """Unfreeze, collect and freeze again; returns the pause in ms.
+
+    Frozen objects are never collected, and CPython cannot thaw only part of
+    the frozen set, so a released model's reference cycles (Keras graphs are
+    full of them) are only reclaimed by a full collection over the thawed
+    heap. That collection holds the GIL and pauses every request thread for
+    about as long as the one in ``freeze()`` at startup, typically a few
+    hundred ms with TensorFlow loaded. It runs once per retired model
+    version, on the retiring thread.
+    """
+    gc.unfreeze()
+    try:
+        return collect()
+    finally:
+        gc.freeze()
+
+
+def stats():
+    """Return a small dict describing the active policy"""
+    return {
+        "policy": _state["policy"],
+        "thresholds": gc.get_threshold(),
+        "counts": gc.get_count(),
+        "frozen": gc.get_freeze_count(),
+        "off_path_collections": _state["collections"],
+        "last_pause_ms": round(_state["last_pause_ms"], 3),
+    }
@@ -0,0 +1,75 @@
+"""Heavy dependencies imported on first use instead of at startup.
+
+Importing TensorFlow, OpenCV, fpdf, requests and joblib up front costs
+seconds and hundreds of MB, even in processes that only render the page,
+answer health checks or look up doctors. A ``LazyModule`` stands in for
+the module and imports it the first time one of its attributes is read:
+
+    tf = lazy_import("tensorflow")
+    ...
+    tf.keras.models.load_model(path)   # tensorflow is imported here
+"""
+import importlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.RLock()
+_registry = {}
+
+
+class LazyModule:
+    """Proxy that imports `name` on first attribute access"""
+
+    def __init__(self, name, on_load=None):
+        self._name = name
+        self._on_load = on_load
+        self._module = None
+        self._load_seconds = None
+
+    def _load(self):
+        module = self._module
+        if module is not None:
+            return module
+        with _lock:
+            if self._module is None:
+                start = time.perf_counter()
+                module = importlib.import_module(self._name)
+                if self._on_load is not None:
+                    self._on_load(module)
+                self._load_seconds = time.perf_counter() - start
+                self._module = module
+                logger.info(f"📦 Imported {self._name} in {self._load_seconds * 1000:.0f}ms")
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy_import(name, on_load=None):
+    """Return a shared LazyModule for `name`; `on_load(module)` runs once after the import"""
+    with _lock:
+        proxy = _registry.get(name)
+        if proxy is None:
+            proxy = _registry[name] = LazyModule(name, on_load)
+        return proxy
+
+
+def preload(*names):
+    """Import the given lazy modules now (all registered ones by default)"""
+    for name in names or list(_registry):
+        lazy_import(name)._load()
+
+
+def stats():
+    """Which lazy modules have been imported and how long each took"""
+    return {
+        name: round(proxy._load_seconds * 1000, 1) if proxy._module is not None else None
+        for name, proxy in _registry.items()
+    }
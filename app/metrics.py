@@ -0,0 +1,80 @@
+"""In-process counters, timers and gauges served on /metrics.
+
+Each worker process keeps its own registry; values are cheap to update
+from request threads and only summarized when /metrics is read.
+"""
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+WINDOW = 1024
+
+
+class Metrics:
+    def __init__(self, window=WINDOW):
+        self._lock = threading.Lock()
+        self._window = window
+        self.started = time.time()
+        self.counters = defaultdict(int)
+        self._timers = {}
+        self._gauges = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name, seconds):
+        """Record one duration; the last `window` samples feed the percentiles"""
+        with self._lock:
+            timer = self._timers.get(name)
+            if timer is None:
+                timer = self._timers[name] = {"count": 0, "total": 0.0, "max": 0.0,
+                                              "recent": deque(maxlen=self._window)}
+            timer["count"] += 1
+            timer["total"] += seconds
+            timer["max"] = max(timer["max"], seconds)
+            timer["recent"].append(seconds)
+
+    def gauge(self, name, fn):
+        """Register a callable evaluated on every snapshot"""
+        self._gauges[name] = fn
+
+    def ratio(self, numerator, denominator):
+        total = self.counters.get(denominator, 0)
+        return round(self.counters.get(numerator, 0) / total, 4) if total else 0.0
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+            timers = {name: dict(t, recent=list(t["recent"])) for name, t in self._timers.items()}
+
+        summary = {}
+        for name, t in timers.items():
+            recent = np.asarray(t["recent"]) * 1000
+            summary[name] = {
+                "count": t["count"],
+                "mean_ms": round(t["total"] / t["count"] * 1000, 3),
+                "max_ms": round(t["max"] * 1000, 3),
+                "p50_ms": round(float(np.percentile(recent, 50)), 3),
+                "p95_ms": round(float(np.percentile(recent, 95)), 3),
+                "p99_ms": round(float(np.percentile(recent, 99)), 3),
+            }
+
+        gauges = {}
+        for name, fn in list(self._gauges.items()):
+            try:
+                gauges[name] = fn()
+            except Exception as e:
+                gauges[name] = {"error": str(e)}
+
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "counters": counters,
+            "timers": summary,
+            "gauges": gauges,
+        }
+
+
+metrics = Metrics()
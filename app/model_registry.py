@@ -0,0 +1,157 @@
+"""Versioned model artifacts and the bundle of models serving one version.
+
+Registry layout (``MODEL_REGISTRY_DIR``, default ``models/registry``)::
+
+    <version>/*.h5                 fine-tuned DenseNet
+    <version>/*.pkl                stacking classifier (any .pkl except cascade_head.pkl)
+    <version>/cascade_head.pkl     optional linear first stage for the cascade
+    <version>/manifest.json        optional {"cnn": ..., "stack": ..., "cnn_version": ...}
+    CURRENT                        name of the version to serve
+
+Without a registry the flat ``models/`` directory is served as a single
+version named after its CNN file, exactly as before.
+"""
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+
+from preprocessing import embedding_version
+
+LEGACY_CNN = "densenet_new_finetuned_v3.h5"
+LEGACY_STACK = "fast_rf_xgb_stack2.pkl"
+HEAD_FILENAME = "cascade_head.pkl"
+
+ModelArtifacts = namedtuple("ModelArtifacts", "version cnn_path stack_path head_path cnn_version")
+
+
+def list_versions(root):
+    if not os.path.isdir(root):
+        return []
+    return sorted(d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d)))
+
+
+def current_version(root):
+    """Version named in CURRENT, falling back to the newest directory"""
+    pointer = os.path.join(root, "CURRENT")
+    if os.path.exists(pointer):
+        with open(pointer) as f:
+            version = f.read().strip()
+        if version:
+            return version
+    versions = list_versions(root)
+    return versions[-1] if versions else None
+
+
+def promote(root, version):
+    """Atomically point CURRENT at `version`"""
+    if version not in list_versions(root):
+        raise ValueError(f"Unknown model version {version!r}")
+    tmp = os.path.join(root, "CURRENT.tmp")
+    with open(tmp, "w") as f:
+        f.write(version + "\n")
+    os.replace(tmp, os.path.join(root, "CURRENT"))
+
+
+def resolve(root, version=None, legacy_dir=None, legacy_head=None):
+    """Artifact paths for `version` (default: current), or the legacy flat layout"""
+    version = version or current_version(root)
+    if version is None:
+        if legacy_dir is None:
+            raise FileNotFoundError(f"No model versions under {root}")
+        cnn_path = os.path.join(legacy_dir, LEGACY_CNN)
+        stem = os.path.splitext(LEGACY_CNN)[0]
+        return ModelArtifacts(stem, cnn_path, os.path.join(legacy_dir, LEGACY_STACK), legacy_head,
+                              embedding_version(stem))
+
+    directory = os.path.join(root, version)
+    if not os.path.isdir(directory):
+        raise FileNotFoundError(f"Model version {version!r} not found in {root}")
+
+    manifest = {}
+    manifest_path = os.path.join(directory, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    files = sorted(os.listdir(directory))
+    cnn = manifest.get("cnn") or next((n for n in files if n.endswith(".h5")), None)
+    stack = manifest.get("stack") or next((n for n in files if n.endswith(".pkl") and n != HEAD_FILENAME), None)
+    if cnn is None or stack is None:
+        raise FileNotFoundError(f"Model version {version!r} needs an .h5 CNN and a .pkl stack")
+    head = os.path.join(directory, HEAD_FILENAME)
+    return ModelArtifacts(
+        version,
+        os.path.join(directory, cnn),
+        os.path.join(directory, stack),
+        head if os.path.exists(head) else legacy_head,
+        embedding_version(manifest.get("cnn_version") or f"{version}/{os.path.splitext(cnn)[0]}"),
+    )
+
+
+def artifacts_mtime(artifacts):
+    """Latest modification time of a version's files, for change detection"""
+    paths = [artifacts.cnn_path, artifacts.stack_path] + ([artifacts.head_path] if artifacts.head_path else [])
+    return max((os.path.getmtime(p) for p in paths if os.path.exists(p)), default=0.0)
+
+
+class ModelBundle:
+    """Every model object serving one version, plus an in-flight request count.
+
+    Requests take a reference to the active bundle when they start, so a swap
+    never changes models under a running request; the old bundle is freed
+    once its last request releases it.
+    """
+
+    def __init__(self, artifacts, cnn_model, rf_model, feature_extractor, serving_model, cascade,
+                 explain_model=None):
+        self.artifacts = artifacts
+        self.version = artifacts.version
+        self.cnn_version = artifacts.cnn_version
+        self.cnn_model = cnn_model
+        self.rf_model = rf_model
+        self.feature_extractor = feature_extractor
+        self.serving_model = serving_model
+        self.cascade = cascade
+        self.explain_model = explain_model
+        self.loaded_at = time.time()
+        self.inflight = 0
+        self._idle = threading.Condition()
+
+    def acquire(self):
+        with self._idle:
+            self.inflight += 1
+        return self
+
+    def release(self):
+        with self._idle:
+            self.inflight -= 1
+            if self.inflight == 0:
+                self._idle.notify_all()
+
+    @contextmanager
+    def use(self):
+        self.acquire()
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def wait_idle(self, timeout=None):
+        """Block until no request holds this bundle; returns False on timeout"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self.inflight == 0, timeout)
+
+    def describe(self):
+        return {
+            "version": self.version,
+            "cnn_version": self.cnn_version,
+            "cnn_path": self.artifacts.cnn_path,
+            "stack_path": self.artifacts.stack_path,
+            "loaded_at": datetime.fromtimestamp(self.loaded_at).isoformat(),
+            "inflight": self.inflight,
+        }
+
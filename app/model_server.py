@@ -0,0 +1,361 @@
+"""Dedicated inference process fed through shared memory.
+
+One model server per host owns the CNN, the stacking ensemble and the
+cascade, and batches requests from every web worker. Web workers started
+with ``INFERENCE_BACKEND=server`` load no models. They preprocess uploads
+as usual and hand the tensors over a local Unix socket.
+
+Each connection gets its own ring of shared-memory slots, created by the
+server. A slot holds one input tensor followed by that request's outputs.
+The socket carries only small fixed-size ``struct`` headers that name a
+slot, so no array is ever pickled or copied through the socket.
+
+    python app/model_server.py --socket /tmp/xray-model-server.sock --max-batch 16 --max-wait-ms 5
+    INFERENCE_BACKEND=server MODEL_SERVER_SOCKET=/tmp/xray-model-server.sock python app/app.py
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import namedtuple
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+logger = logging.getLogger("model_server")
+
+INPUT_SHAPE = (224, 224, 3)
+STAGES = ("stack", "cnn", "linear")
+MAX_SLOTS = 16
+
+OP_INFER = 0
+OP_STATS = 1
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+HELLO = struct.Struct("<I")            # slots wanted
+WELCOME = struct.Struct("<IIIIH")      # slots, slot bytes, feature dim, classes, shm name length (+ name)
+REQUEST = struct.Struct("<IIB")        # request id, slot, op
+RESPONSE = struct.Struct("<IBBI")      # request id, status, stage, trailing text length (+ text)
+
+Inference = namedtuple("Inference", "features cnn_probs final_probs stack_probs stage version cnn_version")
+
+
+class ModelServerError(RuntimeError):
+    """The server received the request but could not score it"""
+
+
+def _recv_exact(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    while view:
+        n = sock.recv_into(view)
+        if n == 0:
+            raise ConnectionError("Model server connection closed")
+        view = view[n:]
+    return bytes(buf)
+
+
+class SlotLayout:
+    """Offsets of the input tensor and the outputs inside one slot"""
+
+    def __init__(self, dim, classes):
+        self.dim = dim
+        self.classes = classes
+        self.input_size = int(np.prod(INPUT_SHAPE))
+        # input | features | cnn probs | final probs | stack probs, all float32
+        self.floats = self.input_size + dim + 3 * classes
+        self.nbytes = self.floats * 4
+
+    def views(self, buf, slot):
+        """Numpy views `(input, features, cnn, final, stack)` of one slot"""
+        flat = np.ndarray((self.floats,), dtype=np.float32, buffer=buf, offset=slot * self.nbytes)
+        i, d, c = self.input_size, self.dim, self.classes
+        return (flat[:i].reshape(INPUT_SHAPE), flat[i:i + d], flat[i + d:i + d + c],
+                flat[i + d + c:i + d + 2 * c], flat[i + d + 2 * c:])
+
+
+def _attach(name):
+    """Open a server-owned segment without letting this process's tracker unlink it"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 always registers the segment with the resource tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+# -------------------------------
+# CLIENT (WEB WORKERS)
+# -------------------------------
+class ModelClient:
+    """One connection and slot ring; use one client per thread"""
+
+    def __init__(self, path, slots=2, timeout=60.0):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.sock.sendall(HELLO.pack(slots))
+        self.slots, slot_bytes, dim, classes, name_len = WELCOME.unpack(_recv_exact(self.sock, WELCOME.size))
+        self.shm = _attach(_recv_exact(self.sock, name_len).decode())
+        self.layout = SlotLayout(dim, classes)
+        assert self.layout.nbytes == slot_bytes, "Model server slot layout mismatch"
+        self.views = [self.layout.views(self.shm.buf, k) for k in range(self.slots)]
+        self._next_id = 0
+        self._pending = []
+
+    @property
+    def feature_dim(self):
+        return self.layout.dim
+
+    def submit(self, tensor):
+        """Copy one (1, 224, 224, 3) or (224, 224, 3) tensor into a free slot and queue it"""
+        if len(self._pending) >= self.slots:
+            raise RuntimeError("All model server slots are in flight; call result() first")
+        slot = self._next_id % self.slots
+        np.copyto(self.views[slot][0], np.reshape(tensor, INPUT_SHAPE))
+        request_id = self._next_id
+        self._next_id += 1
+        self.sock.sendall(REQUEST.pack(request_id, slot, OP_INFER))
+        self._pending.append((request_id, slot))
+        return request_id
+
+    def result(self):
+        """Wait for the oldest submitted request; responses arrive in order"""
+        request_id, slot = self._pending.pop(0)
+        rid, status, stage, text_len = RESPONSE.unpack(_recv_exact(self.sock, RESPONSE.size))
+        text = _recv_exact(self.sock, text_len).decode() if text_len else ""
+        if rid != request_id:
+            raise ConnectionError(f"Model server answered request {rid}, expected {request_id}")
+        if status != STATUS_OK:
+            raise ModelServerError(text)
+        _, features, cnn, final, stack = self.views[slot]
+        version, _, cnn_version = text.partition("\t")
+        has_stack = STAGES[stage] == "stack"
+        return Inference(features.copy()[None, :], cnn.copy(), final.copy(), stack.copy() if has_stack else None,
+                         STAGES[stage], version, cnn_version)
+
+    def infer(self, tensor):
+        self.submit(tensor)
+        return self.result()
+
+    def stats(self):
+        """The server's metrics snapshot"""
+        if self._pending:
+            raise RuntimeError("stats() needs an idle connection")
+        self.sock.sendall(REQUEST.pack(self._next_id, 0, OP_STATS))
+        self._next_id += 1
+        _, _, _, text_len = RESPONSE.unpack(_recv_exact(self.sock, RESPONSE.size))
+        return json.loads(_recv_exact(self.sock, text_len))
+
+    def close(self):
+        self.views = []
+        try:
+            self.shm.close()
+        except BufferError:
+            pass
+        self.sock.close()
+
+
+# -------------------------------
+# SERVER
+# -------------------------------
+class _Connection:
+    def __init__(self, sock, slots, layout):
+        self.sock = sock
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * layout.nbytes)
+        self.views = [layout.views(self.shm.buf, k) for k in range(slots)]
+        self.open = True
+
+    def send(self, request_id, status, stage=0, text=""):
+        data = text.encode()
+        try:
+            self.sock.sendall(RESPONSE.pack(request_id, status, stage, len(data)) + data)
+        except OSError:
+            self.open = False
+
+    def close(self):
+        self.open = False
+        self.views = []
+        self.sock.close()
+        try:
+            self.shm.close()
+        except BufferError:
+            pass
+        self.shm.unlink()
+
+
+class ModelServer:
+    """Accepts web workers and batches their requests through the active model bundle"""
+
+    def __init__(self, service, path, max_batch=16, max_wait=0.005):
+        self.service = service
+        self.path = path
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.layout = SlotLayout(int(service.feature_extractor.output_shape[-1]), len(service.DISEASE_CLASSES))
+        self.batch = np.empty((max_batch,) + INPUT_SHAPE, dtype=np.float32)
+
+    def serve_forever(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        os.chmod(self.path, 0o660)
+        listener.listen(128)
+        threading.Thread(target=self._batch_loop, daemon=True).start()
+        logger.info(f"🧠 Model server listening on {self.path} (batch ≤ {self.max_batch}, "
+                    f"wait ≤ {self.max_wait * 1000:.1f}ms)")
+        try:
+            while True:
+                sock, _ = listener.accept()
+                threading.Thread(target=self._handle, args=(sock,), daemon=True).start()
+        finally:
+            listener.close()
+            os.unlink(self.path)
+
+    def _handle(self, sock):
+        """Per-connection reader: handshake, then queue every request header"""
+        conn = None
+        try:
+            (slots,) = HELLO.unpack(_recv_exact(sock, HELLO.size))
+            slots = max(1, min(slots, MAX_SLOTS))
+            conn = _Connection(sock, slots, self.layout)
+            name = conn.shm.name.encode()
+            sock.sendall(WELCOME.pack(slots, self.layout.nbytes, self.layout.dim, self.layout.classes,
+                                      len(name)) + name)
+            self.service.metrics.incr("server_connections")
+            while True:
+                request_id, slot, op = REQUEST.unpack(_recv_exact(sock, REQUEST.size))
+                if op == OP_STATS:
+                    conn.send(request_id, STATUS_OK, text=json.dumps(self.service.metrics.snapshot()))
+                elif slot >= slots:
+                    conn.send(request_id, STATUS_ERROR, text=f"Slot {slot} out of range")
+                else:
+                    self.requests.put((conn, request_id, slot, time.perf_counter()))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if conn is not None:
+                # The batcher may still hold queued requests for this connection; it skips closed ones
+                conn.open = False
+                self.requests.put((conn, None, None, None))
+
+    def _gather(self):
+        """Block for one request, then take more until the batch is full or max_wait passes"""
+        items = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(items) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _batch_loop(self):
+        while True:
+            items = self._gather()
+            live = []
+            for conn, request_id, slot, queued in items:
+                if request_id is None:
+                    conn.close()
+                elif conn.open:
+                    live.append((conn, request_id, slot, queued))
+            if live:
+                self._run(live)
+
+    def _run(self, items):
+        service, metrics = self.service, self.service.metrics
+        n = len(items)
+        start = time.perf_counter()
+        for i, (conn, _, slot, queued) in enumerate(items):
+            np.copyto(self.batch[i], conn.views[slot][0])
+            metrics.observe("server_queue_wait", start - queued)
+        try:
+            with service.active_bundle.use() as bundle:
+                features, cnn_probs, probs, stack, stages = classify_batch(service, bundle, self.batch[:n])
+        except Exception as e:
+            logger.error(f"❌ Batch of {n} failed: {e}")
+            for conn, request_id, _, _ in items:
+                conn.send(request_id, STATUS_ERROR, text=str(e))
+            return
+        text = f"{bundle.version}\t{bundle.cnn_version}"
+        for i, (conn, request_id, slot, _) in enumerate(items):
+            _, out_features, out_cnn, out_final, out_stack = conn.views[slot]
+            out_features[:] = features[i]
+            out_cnn[:] = cnn_probs[i]
+            out_final[:] = probs[i]
+            if stack is not None:
+                out_stack[:] = stack[i]
+            conn.send(request_id, STATUS_OK, STAGES.index(stages[i]), text)
+        metrics.observe("server_batch", time.perf_counter() - start)
+        metrics.incr("server_batches")
+        metrics.incr("server_requests", n)
+        metrics.incr("predictions", n)
+        for stage in stages:
+            metrics.incr(f"predictions_stage_{stage}")
+
+
+def classify_batch(service, bundle, batch):
+    """Batched forward pass plus cascade; only rows the first stage rejects reach the stack.
+
+    Returns `(features, cnn_probs, final_probs, stack_probs or None, stages)`.
+    """
+    import tensorflow as tf
+
+    with tf.device('/CPU:0'):
+        pooled, cnn_output = bundle.serving_model(batch, training=False)
+    features = np.reshape(pooled, (len(batch), -1))
+    cnn_probs = np.asarray(cnn_output)
+    probs = np.empty_like(cnn_probs)
+    stages = ["stack"] * len(batch)
+    escalate = np.ones(len(batch), dtype=bool)
+    if bundle.cascade.enabled:
+        first = bundle.cascade.first_stage(features, cnn_probs)
+        accepted = bundle.cascade.accepts(first)
+        probs[accepted] = first[accepted]
+        escalate = ~accepted
+        for i in np.flatnonzero(accepted):
+            stages[i] = bundle.cascade.mode
+    stack = None
+    if escalate.any():
+        stack_start = time.perf_counter()
+        stack = np.zeros_like(cnn_probs)
+        stack[escalate] = service.stack_probabilities(features[escalate], bundle.rf_model)
+        probs[escalate] = stack[escalate]
+        service.metrics.observe("stack_predict", time.perf_counter() - stack_start)
+    return features, cnn_probs, probs, stack, stages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=os.environ.get("MODEL_SERVER_SOCKET", "/tmp/xray-model-server.sock"))
+    parser.add_argument("--max-batch", type=int, default=int(os.environ.get("MODEL_SERVER_MAX_BATCH", "16")))
+    parser.add_argument("--max-wait-ms", type=float, default=float(os.environ.get("MODEL_SERVER_MAX_WAIT_MS", "5")))
+    parser.add_argument("--tf-threads", type=int, default=0, help="TensorFlow op threads (0 = all cores)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    import app as service
+
+    if not service.load_models(intra_op_threads=args.tf_threads, inter_op_threads=args.tf_threads):
+        return 1
+    if service.MODEL_WATCH_INTERVAL > 0:
+        threading.Thread(target=service.watch_registry, args=(service.MODEL_WATCH_INTERVAL,), daemon=True).start()
+    ModelServer(service, args.socket, args.max_batch, args.max_wait_ms / 1000).serve_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""Model and input helpers shared by the web app and the offline tools.
+
+Importing this module is cheap (no Flask app, TensorFlow is loaded on first
+use), so the batch tools can list, hash and embed images without pulling in
+the whole service.
+"""
+import hashlib
+import logging
+
+import dicom
+from lazy_imports import lazy_import
+
+tf = lazy_import("tensorflow")
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'} | dicom.EXTENSIONS
+
+
+def allowed_file(filename):
+    """Check if file has allowed extension"""
+    return '.' in filename and \
+           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def hash_file(path):
+    """SHA-256 of a file's contents, used as the image id"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_feature_extractor(model):
+    """Return a Model mapping the CNN input to its pooled embedding, or None"""
+    try:
+        extractor = tf.keras.Model(
+            inputs=model.input,
+            outputs=model.get_layer("global_average_pooling2d").output
+        )
+        logger.info("✅ Feature extractor created successfully")
+        return extractor
+    except Exception as e:
+        logger.warning(f"⚠️ Could not find 'global_average_pooling2d' layer, trying alternatives...")
+        # Try to find a suitable layer for feature extraction
+        for layer in reversed(model.layers):
+            if 'pool' in layer.name.lower() or 'flatten' in layer.name.lower():
+                logger.info(f"✅ Using layer '{layer.name}' for feature extraction")
+                return tf.keras.Model(inputs=model.input, outputs=layer.output)
+        logger.error("❌ Could not create feature extractor")
+        return None
@@ -0,0 +1,128 @@
+"""Precompiled, precompressed chatbot page and static assets.
+
+The page template has no per-request variables, so it is rendered once at
+startup with content-hashed asset URLs. The page and every asset are
+compressed once with gzip, and with brotli when the optional `brotli`
+package is installed. Each is then served from memory:
+
+* assets live at ``/assets/<name>.<hash>.<ext>`` with a one-year
+  ``immutable`` Cache-Control, so a repeat visit fetches nothing until a
+  deploy changes their content (and therefore their URL)
+* the page is ``no-cache`` but carries a strong ETag, so revalidation
+  costs a 304 with no body
+"""
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+PAGE_CACHE_CONTROL = "no-cache"
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 256
+
+
+class CachedBody:
+    """One response body, its compressed variants and strong ETags"""
+
+    def __init__(self, body, content_type, cache_control):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        self.variants = {"identity": body}
+        if len(body) >= MIN_COMPRESS_BYTES:
+            gz = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(gz) < len(body):
+                self.variants["gzip"] = gz
+            if brotli is not None:
+                br = brotli.compress(body, quality=11)
+                if len(br) < len(body):
+                    self.variants["br"] = br
+
+    def etag(self, encoding):
+        """Strong ETag; each encoding is a different representation, so it gets its own tag"""
+        return f'"{self.digest}"' if encoding == "identity" else f'"{self.digest}-{encoding}"'
+
+    def sizes(self):
+        return {encoding: len(body) for encoding, body in self.variants.items()}
+
+
+def choose_encoding(accept_encoding, available):
+    """Best encoding the client accepts: br, then gzip, then identity"""
+    accepted = {}
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name] = q
+    for encoding in ("br", "gzip"):
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return "identity"
+
+
+def etag_matches(if_none_match, cached):
+    """True when If-None-Match names any representation of `cached`"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return any(cached.etag(encoding) in tags for encoding in cached.variants)
+
+
+class PageCache:
+    """Rendered page plus hashed static assets, ready to serve"""
+
+    def __init__(self, template_path, static_dir, render, context=None, url_prefix="/assets/"):
+        self.assets = {}
+        urls = {}
+        for filename in sorted(os.listdir(static_dir)):
+            path = os.path.join(static_dir, filename)
+            if not os.path.isfile(path):
+                continue
+            with open(path, "rb") as f:
+                body = f.read()
+            content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            if content_type.startswith("text/") or content_type.endswith("javascript"):
+                content_type += "; charset=utf-8"
+            asset = CachedBody(body, content_type, ASSET_CACHE_CONTROL)
+            stem, ext = os.path.splitext(filename)
+            hashed = f"{stem}.{asset.digest}{ext}"
+            self.assets[hashed] = asset
+            urls[stem.replace("-", "_") + "_" + ext.lstrip(".") + "_url"] = url_prefix + hashed
+
+        with open(template_path, encoding="utf-8") as f:
+            html = render(f.read(), **dict(context or {}, **urls))
+        self.page = CachedBody(html.encode("utf-8"), "text/html; charset=utf-8", PAGE_CACHE_CONTROL)
+        logger.info(f"✅ Page cache built: page {self.page.sizes()}, "
+                    f"assets {{{', '.join(f'{n}: {a.sizes()}' for n, a in self.assets.items())}}}")
+
+    def respond(self, cached, request, response_class):
+        """Flask response for `cached`, honoring Accept-Encoding and If-None-Match"""
+        encoding = choose_encoding(request.headers.get("Accept-Encoding"), cached.variants)
+        headers = {
+            "ETag": cached.etag(encoding),
+            "Cache-Control": cached.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if etag_matches(request.headers.get("If-None-Match"), cached):
+            return response_class(status=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return response_class(cached.variants[encoding], status=200, headers=headers,
+                              content_type=cached.content_type)
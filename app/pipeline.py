@@ -0,0 +1,86 @@
+"""Decode/prefetch helpers shared by the offline batch tools.
+
+Images are decoded on an executor (a process pool, or threads since OpenCV
+releases the GIL) while the caller runs CNN inference on earlier batches.
+"""
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import preprocessing
+
+_SENTINEL = object()
+
+
+def _ready():
+    return os.getpid()
+
+
+def start_process_pool(workers=None):
+    """Start a decode process pool, forking its workers immediately.
+
+    Call this before TensorFlow creates its thread pools: forking a process
+    that already runs TF threads is unsafe.
+    """
+    workers = workers or os.cpu_count() or 1
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    pool.submit(_ready).result()
+    return pool
+
+
+def decode_image(path):
+    """Executor task: decode one image into a (224, 224, 3) RGB uint8 array.
+
+    Returns `(path, array, None)`, or `(path, None, error)` when the file
+    cannot be decoded. Consumers normalize whole batches with
+    `preprocessing.normalize_batch`; uint8 also keeps the inter-process copy
+    a quarter of the float32 size.
+    """
+    try:
+        return path, preprocessing.load_rgb(path), None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def _produce(items, executor, decode, batch_size, window, out_queue):
+    pending = []
+    batch = []
+    try:
+        for item in items:
+            pending.append(executor.submit(decode, item))
+            if len(pending) < window:
+                continue
+            batch.append(pending.pop(0).result())
+            if len(batch) == batch_size:
+                out_queue.put(batch)
+                batch = []
+        for future in pending:
+            batch.append(future.result())
+            if len(batch) == batch_size:
+                out_queue.put(batch)
+                batch = []
+        if batch:
+            out_queue.put(batch)
+    finally:
+        out_queue.put(_SENTINEL)
+
+
+def prefetch_batches(items, executor, decode=decode_image, batch_size=32, prefetch=4):
+    """Yield lists of decoded results, `batch_size` at a time, in input order.
+
+    Up to `prefetch` batches are decoded ahead of the consumer.
+    """
+    batches = queue.Queue(maxsize=prefetch)
+    window = batch_size * (prefetch + 1)
+    producer = threading.Thread(
+        target=_produce, args=(items, executor, decode, batch_size, window, batches), daemon=True)
+    producer.start()
+    while True:
+        batch = batches.get()
+        if batch is _SENTINEL:
+            return
+        yield batch
@@ -0,0 +1,263 @@
+"""Model-input preprocessing shared by serving, the batch tools and training.
+
+DenseNet was fine-tuned on images loaded by Keras ``load_img``: RGB, resized
+to 224x224 with PIL's nearest-neighbour filter, then scaled by 1/255. This
+module reproduces those steps on images decoded by OpenCV (BGR) so that
+serving and training see the same tensors:
+
+* ``resize_into`` gathers each image with one ``cv2.remap`` over
+  precomputed coordinates. Each output pixel takes the source pixel under
+  its centre, as PIL's nearest filter does (``cv2.INTER_NEAREST`` and
+  ``INTER_NEAREST_EXACT`` pick a neighbour for some pixels). A SIMD
+  ``cvtColor`` then writes RGB straight into the output.
+* ``normalize_into`` scales a whole uint8 batch to float32 in one pass,
+  with the same float32 1/255 factor Keras multiplies by.
+* ``preprocess_batch`` turns N decoded images into one contiguous
+  (N, 224, 224, 3) float32 tensor.
+
+``parity`` compares these tensors with Keras ``load_img`` (or an equivalent
+PIL pipeline when TensorFlow is not installed). Lossless images must match
+bit for bit. JPEG decoders may differ by a few grey levels, which is checked
+against ``--tolerance``. With ``--compact`` each image goes through a
+compact upload first: sampled at the same centre positions the chatbot
+page uses on its canvas, packed as ``gray8``/``rgb8`` and decoded by
+``compact_upload``.
+
+    python app/preprocessing.py parity dataset/test --limit 500
+    python app/preprocessing.py parity --synthetic 200 --compact
+"""
+import argparse
+import json
+import os
+import sys
+from functools import lru_cache
+
+import numpy as np
+
+import compact_upload
+import dicom
+from lazy_imports import lazy_import
+
+cv2 = lazy_import("cv2")
+
+INPUT_SIZE = 224
+# Recorded with stored embeddings and caches; bump whenever the tensors this module produces change
+VERSION = "pil-nearest-rgb"
+CHANNELS = 3
+INV_255 = np.float32(1.0 / 255.0)
+
+
+def embedding_version(cnn_version):
+    """Version tag for embeddings of `cnn_version` computed from this module's tensors, e.g. `v3+pil-nearest-rgb`.
+
+    Served, extracted and imported embeddings, and the indexes and baselines
+    built from them, are all tagged through this one function so they match.
+    """
+    suffix = f"+{VERSION}"
+    return cnn_version if not cnn_version or cnn_version.endswith(suffix) else cnn_version + suffix
+
+
+@lru_cache(maxsize=64)
+def _nearest_index(src, dst):
+    """Source index under the centre of each of `dst` output pixels, as PIL's NEAREST picks it.
+
+    PIL accumulates the centre coordinate in doubles (`xo += scale`) instead
+    of multiplying; a sequential cumsum rounds the same way, so pixels that
+    land exactly on a boundary truncate to the same side.
+    """
+    scale = src / dst
+    steps = np.full(dst, scale, dtype=np.float64)
+    steps[0] = scale * 0.5
+    index = np.cumsum(steps).astype(np.intp)
+    np.minimum(index, src - 1, out=index)
+    return index
+
+
+@lru_cache(maxsize=32)
+def _remap_grid(height, width, out_height, out_width):
+    """cv2.remap coordinates of the nearest source pixel for every output pixel"""
+    rows = _nearest_index(height, out_height).astype(np.float32)
+    cols = _nearest_index(width, out_width).astype(np.float32)
+    map_x = np.ascontiguousarray(np.broadcast_to(cols[None, :], (out_height, out_width)))
+    map_y = np.ascontiguousarray(np.broadcast_to(rows[:, None], (out_height, out_width)))
+    return map_x, map_y
+
+
+_TO_RGB = {(1, True): "COLOR_GRAY2RGB", (1, False): "COLOR_GRAY2RGB",
+           (3, True): "COLOR_BGR2RGB", (4, True): "COLOR_BGRA2RGB", (4, False): "COLOR_RGBA2RGB"}
+
+
+def decode(path):
+    """BGR uint8 image from a file, as `cv2.imread` returns it"""
+    if dicom.is_dicom_path(path):
+        with dicom.DicomImage(path) as image:
+            frame = image.frame()
+            return image.render(frame, image.fit(max(image.rows, image.columns)))
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError(f"Could not read image from {path}")
+    return img
+
+
+def resize_into(img, out, bgr=True):
+    """Nearest-resize a uint8 image (gray, BGR(A) or RGB(A)) into `out`, an (h, w, 3) RGB uint8 array"""
+    height, width = img.shape[:2]
+    out_height, out_width = out.shape[:2]
+    if img.ndim == 3 and img.shape[2] == 1:
+        img = img[:, :, 0]
+    if (height, width) == (out_height, out_width):
+        gathered = img
+    else:
+        map_x, map_y = _remap_grid(height, width, out_height, out_width)
+        gathered = cv2.remap(img, map_x, map_y, cv2.INTER_NEAREST)
+    channels = 1 if gathered.ndim == 2 else gathered.shape[2]
+    code = _TO_RGB.get((channels, bgr))
+    if code is None:
+        out[...] = gathered
+    else:
+        cv2.cvtColor(gathered, getattr(cv2, code), dst=out)
+    return out
+
+
+def normalize_into(images, out):
+    """Scale uint8 pixels to [0, 1] float32, exactly as Keras' `rescale=1./255`"""
+    return np.multiply(images, INV_255, out=out)
+
+
+def resize_batch(images, bgr=True, size=INPUT_SIZE, out=None):
+    """(N, size, size, 3) RGB uint8 batch from N decoded images of any size"""
+    if out is None:
+        out = np.empty((len(images), size, size, CHANNELS), dtype=np.uint8)
+    for i, img in enumerate(images):
+        resize_into(img, out[i], bgr)
+    return out
+
+
+def normalize_batch(images, out=None):
+    """float32 model batch from a uint8 batch"""
+    if out is None:
+        out = np.empty(images.shape, dtype=np.float32)
+    return normalize_into(images, out)
+
+
+def preprocess_batch(images, bgr=True, size=INPUT_SIZE, out=None):
+    """Contiguous (N, size, size, 3) float32 model batch from N decoded images"""
+    return normalize_batch(resize_batch(images, bgr, size), out)
+
+
+def load_rgb(path, size=INPUT_SIZE):
+    """Model-size RGB uint8 image for one file (the decode step of the batch tools)"""
+    out = np.empty((size, size, CHANNELS), dtype=np.uint8)
+    if dicom.is_dicom_path(path):
+        # Windowed straight to model size, as /predict does
+        with dicom.DicomImage(path) as image:
+            return resize_into(image.render(image.frame(), (size, size)), out)
+    return resize_into(decode(path), out)
+
+
+# -------------------------------
+# TRAINING PARITY
+# -------------------------------
+def reference_tensor(path, size=INPUT_SIZE):
+    """What the training notebooks fed DenseNet: Keras load_img + img_to_array + rescale"""
+    try:
+        from tensorflow.keras.utils import img_to_array, load_img
+    except ImportError:
+        # load_img is PIL underneath: convert("RGB"), then resize with NEAREST
+        from PIL import Image
+
+        with Image.open(path) as image:
+            image = image.convert("RGB").resize((size, size), Image.NEAREST)
+            array = np.asarray(image, dtype=np.float32)
+    else:
+        array = img_to_array(load_img(path, target_size=(size, size)), dtype="float32")
+    return array * INV_255
+
+
+def _synthetic_images(directory, count, seed=0):
+    """Lossless PNGs (gray and colour, odd sizes) plus JPEGs, for a self-contained check"""
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        height, width = (int(v) for v in rng.integers(100, 1200, 2))
+        gray = i % 3 == 0
+        img = rng.integers(0, 256, (height, width) if gray else (height, width, 3), dtype=np.uint8)
+        img = cv2.GaussianBlur(img, (0, 0), 3)
+        path = os.path.join(directory, f"synthetic_{i:04d}.{'jpg' if i % 4 == 3 else 'png'}")
+        cv2.imwrite(path, img)
+        paths.append(path)
+    return paths
+
+
+def compact_roundtrip(img, size=INPUT_SIZE):
+    """What /predict receives for a decoded image in compact mode (the page's canvas sampling, packed)"""
+    rgb = resize_into(img, np.empty((size, size, CHANNELS), dtype=np.uint8))
+    gray = bool((rgb[:, :, 0] == rgb[:, :, 1]).all() and (rgb[:, :, 0] == rgb[:, :, 2]).all())
+    data = np.ascontiguousarray(rgb[:, :, 0] if gray else rgb).tobytes()
+    return compact_upload.decode(data, "gray8" if gray else "rgb8", size, size)
+
+
+def parity(paths, size=INPUT_SIZE, batch_size=32, compact=False):
+    """Per-file max absolute difference between serving and training tensors"""
+    results = []
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        images = [decode(path) for path in chunk]
+        if compact:
+            images = [compact_roundtrip(img, size) for img in images]
+        batch = preprocess_batch(images, size=size)
+        for path, tensor in zip(chunk, batch):
+            diff = np.abs(tensor - reference_tensor(path, size))
+            results.append({"path": path, "max_abs": float(diff.max()), "mean_abs": float(diff.mean()),
+                            "exact": bool(diff.max() == 0.0)})
+    return results
+
+
+def _cmd_parity(args):
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.synthetic:
+            paths = _synthetic_images(tmp, args.synthetic)
+        elif args.source:
+            paths = sorted(os.path.join(root, name) for root, _, files in os.walk(args.source) for name in files
+                           if name.rsplit(".", 1)[-1].lower() in {"png", "jpg", "jpeg", "bmp"})[:args.limit]
+        else:
+            raise SystemExit("Pass an image directory or --synthetic N")
+        results = parity(paths, compact=args.compact)
+
+    lossless = [r for r in results if not r["path"].lower().endswith((".jpg", ".jpeg"))]
+    worst = max(results, key=lambda r: r["max_abs"]) if results else None
+    summary = {
+        "images": len(results),
+        "exact": sum(r["exact"] for r in results),
+        "lossless_exact": f"{sum(r['exact'] for r in lossless)}/{len(lossless)}",
+        "max_abs": worst["max_abs"] if worst else 0.0,
+        "max_abs_levels": round(worst["max_abs"] * 255, 2) if worst else 0.0,
+        "mean_abs": float(np.mean([r["mean_abs"] for r in results])) if results else 0.0,
+        "worst": worst["path"] if worst else None,
+    }
+    print(json.dumps(summary, indent=2))
+    failed = any(not r["exact"] for r in lossless) or summary["max_abs"] > args.tolerance
+    print("❌ Parity check failed" if failed else "✅ Serving tensors match training tensors")
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("parity", help="Compare serving tensors with Keras load_img tensors")
+    p.add_argument("source", nargs="?", help="Directory of images (searched recursively)")
+    p.add_argument("--synthetic", type=int, default=0, help="Generate this many images instead")
+    p.add_argument("--limit", type=int, default=1000)
+    p.add_argument("--compact", action="store_true", help="Send each image through a compact upload first")
+    p.add_argument("--tolerance", type=float, default=4 / 255, help="Allowed max difference for lossy files")
+    p.set_defaults(func=_cmd_parity)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
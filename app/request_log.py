@@ -0,0 +1,256 @@
+"""Non-blocking, sampled, structured logging for the request path.
+
+Request threads only build a log record and drop it on a bounded queue; a
+listener thread formats it (plain text or one JSON object per line) and
+writes it. When the queue is full, records are dropped and counted instead
+of blocking a request.
+
+Each request is traced: stages record their durations on the request's
+``RequestTrace``, and one summary record per request carries the method,
+path, status, total time and stage timings. Per-route sampling
+(``"/predict=0.1,/health=0,*=1"``) decides up front whether a request is
+logged. For an unsampled request, its summary and any of its records below
+WARNING are dropped before they are queued. Warnings, errors, 5xx responses
+and slow requests are always kept.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+FORMATS = ("text", "json")
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+summary_logger = logging.getLogger("request")
+
+
+# -------------------------------
+# FORMATTING
+# -------------------------------
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record; structured fields come from `extra={"event": {...}}`"""
+
+    def format(self, record):
+        event = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "event", None)
+        if fields:
+            event.update(fields)
+        if record.exc_info:
+            event["exc"] = self.formatException(record.exc_info)
+        return json.dumps(event, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic text format, with structured fields appended as JSON"""
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, "event", None)
+        return f"{line} {json.dumps(fields, default=str, ensure_ascii=False)}" if fields else line
+
+
+# -------------------------------
+# QUEUEING
+# -------------------------------
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread; never blocks, counts what it drops"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Same process: formatting is left to the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RouteSampler:
+    """Per-path sampling rates parsed from "path=rate,...", with "*" as the default"""
+
+    def __init__(self, spec="", default=1.0):
+        self.rates = {}
+        self.default = default
+        for part in filter(None, (p.strip() for p in (spec or "").split(","))):
+            path, _, rate = part.rpartition("=")
+            if not path:
+                raise ValueError(f"Invalid sampling rule {part!r}; expected path=rate")
+            if path == "*":
+                self.default = float(rate)
+            else:
+                self.rates[path] = float(rate)
+
+    def rate(self, path):
+        return self.rates.get(path, self.default)
+
+    def sample(self, path):
+        rate = self.rate(path)
+        return rate >= 1.0 or (rate > 0.0 and random.random() < rate)
+
+
+# -------------------------------
+# REQUEST TRACES
+# -------------------------------
+class RequestTrace:
+    """Stage timings and fields of one request, emitted as a single summary record"""
+
+    def __init__(self, method, path, sampled):
+        self.method = method
+        self.path = path
+        self.sampled = sampled
+        self.start = time.perf_counter()
+        self.status = None
+        self.stages = {}
+        self.fields = {}
+
+    def add(self, name, seconds):
+        self.stages[name] = round(self.stages.get(name, 0.0) + seconds * 1000, 3)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+
+class _NoTrace(RequestTrace):
+    """Stand-in outside requests (startup, batch tools), so callers never check for None"""
+
+    def __init__(self):
+        super().__init__(None, None, False)
+
+    def add(self, name, seconds):
+        pass
+
+    def set(self, **fields):
+        pass
+
+
+_NO_TRACE = _NoTrace()
+_local = threading.local()
+
+
+class SampledRequestFilter(logging.Filter):
+    """Drops below-WARNING records logged while the thread serves an unsampled request"""
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        trace = getattr(_local, "trace", None)
+        return trace is None or trace.sampled
+
+
+# -------------------------------
+# SETUP
+# -------------------------------
+_state = {"handler": None, "listener": None, "sampler": RouteSampler(), "format": "text", "slow_ms": 0.0}
+
+
+def _start_listener(queue_size):
+    handler = _state["handler"]
+    handler.queue = queue.Queue(maxsize=queue_size)
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(JsonFormatter() if _state["format"] == "json" else TextFormatter(TEXT_FORMAT))
+    listener = logging.handlers.QueueListener(handler.queue, stream, respect_handler_level=True)
+    listener.start()
+    _state["listener"] = listener
+
+
+def configure(fmt="text", level="INFO", queue_size=10000, sample_rates="", slow_ms=0.0):
+    """Route the root logger through the queue; call once at startup"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown log format {fmt!r}; expected one of {FORMATS}")
+    if _state["handler"] is not None:
+        return
+    _state["format"] = fmt
+    _state["sampler"] = RouteSampler(sample_rates)
+    _state["slow_ms"] = slow_ms
+
+    handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    handler.addFilter(SampledRequestFilter())
+    _state["handler"] = handler
+    _start_listener(queue_size)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    atexit.register(shutdown)
+    # A forked worker (gunicorn --preload) inherits the queue but not the listener thread
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=lambda: _start_listener(queue_size))
+
+
+def shutdown():
+    """Flush queued records and stop the listener"""
+    listener = _state["listener"]
+    if listener is not None:
+        _state["listener"] = None
+        listener.stop()
+
+
+def begin(method, path, bind=True):
+    """Start tracing the calling thread's request; coroutines pass `bind=False` and keep the trace"""
+    trace = RequestTrace(method, path, _state["sampler"].sample(path))
+    if bind:
+        _local.trace = trace
+    return trace
+
+
+def current():
+    """The calling thread's request trace (a no-op trace outside requests)"""
+    return getattr(_local, "trace", None) or _NO_TRACE
+
+
+def finish(status=None, trace=None):
+    """Emit the request's summary record (if kept) and stop tracing; `trace` defaults to the thread's"""
+    if trace is None:
+        trace = getattr(_local, "trace", None)
+        if trace is None:
+            return
+        _local.trace = None
+    status = status if status is not None else trace.status
+    elapsed_ms = round((time.perf_counter() - trace.start) * 1000, 3)
+    slow = _state["slow_ms"] > 0 and elapsed_ms >= _state["slow_ms"]
+    if not (trace.sampled or slow or status is None or status >= 500):
+        return
+    event = {"method": trace.method, "path": trace.path, "status": status, "duration_ms": elapsed_ms}
+    if trace.stages:
+        event["stages"] = trace.stages
+    event.update(trace.fields)
+    level = logging.WARNING if status is None or status >= 500 or slow else logging.INFO
+    summary_logger.log(level, f"{trace.method} {trace.path} {status} {elapsed_ms:.1f}ms", extra={"event": event})
+
+
+def stats():
+    handler = _state["handler"]
+    sampler = _state["sampler"]
+    return {
+        "format": _state["format"],
+        "queued": handler.queue.qsize() if handler is not None else 0,
+        "dropped": handler.dropped if handler is not None else 0,
+        "sample_rates": dict(sampler.rates, **{"*": sampler.default}),
+    }
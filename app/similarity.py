@@ -0,0 +1,316 @@
+"""Similar-case retrieval over pooled DenseNet embeddings.
+
+An index directory holds L2-normalized embeddings in a compact memmap, so
+cosine similarity is a plain dot product::
+
+    meta.json       count, dim, dtype, lists, model_version
+    vectors.npy     (count, dim) int8 with one float32 scale per row, or float16
+    scales.npy      per-row int8 scales (int8 only)
+    entries.tsv     id and label of every row, in row order
+    centroids.npy   (lists, dim) coarse centroids (IVF only)
+    offsets.npy     (lists + 1,) row ranges; rows are grouped by list (IVF only)
+
+Search multiplies blocks of ``block_rows`` stored vectors with the query
+and keeps a running top-k, so memory stays bounded however large the index.
+With IVF (``--lists``), each query scans only the ``nprobe`` lists whose
+centroids are closest instead of every row.
+
+    python app/similarity.py build INDEX --features notebooks/X_train.npy --labels notebooks/y_train.npy
+    python app/similarity.py build INDEX --store feature_store --model-version densenet_new_finetuned_v3 --lists 1024
+    python app/similarity.py query INDEX --features notebooks/X_test.npy --row 0 --k 5
+    python app/similarity.py stats INDEX
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+DTYPES = ("float16", "int8")
+DEFAULT_BLOCK_ROWS = 4096
+DEFAULT_NPROBE = 8
+
+
+def normalize(vectors):
+    """Float32 copy of `vectors` scaled to unit L2 norm per row"""
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.maximum(norms, 1e-12, out=norms)
+    vectors /= norms
+    return vectors
+
+
+def quantize(vectors, dtype):
+    """Stored rows (and int8 scales) for unit-norm float32 `vectors`"""
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    np.maximum(scales, 1e-12, out=scales)
+    return np.rint(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def merge_topk(best_scores, best_rows, scores, rows, k):
+    """Keep the `k` highest of the running top-k plus a new block, per query"""
+    scores = np.concatenate([best_scores, scores], axis=1)
+    rows = np.concatenate([best_rows, np.broadcast_to(rows, (scores.shape[0], rows.shape[-1]))], axis=1)
+    if scores.shape[1] > k:
+        keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, keep, axis=1)
+        rows = np.take_along_axis(rows, keep, axis=1)
+    return scores, rows
+
+
+def spherical_kmeans(vectors, lists, iterations=10, seed=0):
+    """Unit-norm centroids of unit-norm `vectors`, by cosine k-means"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=lists, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=lists)
+        empty = counts == 0
+        sums = np.zeros_like(centroids)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums[~empty] = np.add.reduceat(vectors[order], starts[~empty], axis=0)
+        # Reseed empty lists with random points so every list stays in use
+        sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+# -------------------------------
+# BUILDING
+# -------------------------------
+def build(root, features, labels=None, ids=None, dtype="int8", lists=0, model_version="",
+          block_rows=DEFAULT_BLOCK_ROWS, train_rows=100000, iterations=10, seed=0):
+    """Write an index of `features` (any (n, dim) array, memmaps included) to `root`"""
+    if dtype not in DTYPES:
+        raise ValueError(f"Unknown index dtype {dtype!r}; expected one of {DTYPES}")
+    count, dim = features.shape
+    if lists and lists > count:
+        raise ValueError(f"Cannot split {count} vectors into {lists} lists")
+    os.makedirs(root, exist_ok=True)
+    ids = [str(i) for i in (ids if ids is not None else range(count))]
+    labels = [str(v) for v in labels] if labels is not None else [""] * count
+
+    order = np.arange(count)
+    centroids = offsets = None
+    if lists:
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(count, size=min(count, max(train_rows, lists)), replace=False))
+        centroids = spherical_kmeans(normalize(features[sample]), lists, iterations, seed)
+        assign = np.empty(count, dtype=np.int32)
+        for start in range(0, count, block_rows):
+            block = normalize(features[start:start + block_rows])
+            assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=lists))]).astype(np.int64)
+
+    vectors = np.lib.format.open_memmap(os.path.join(root, "vectors.npy"), mode="w+",
+                                        dtype=np.dtype(dtype), shape=(count, dim))
+    scales = np.empty(count, dtype=np.float32) if dtype == "int8" else None
+    for start in range(0, count, block_rows):
+        rows = order[start:start + block_rows]
+        # Sorted gathers keep memmapped sources reading forward
+        stored, block_scales = quantize(normalize(features[np.sort(rows)]), dtype)
+        position = np.argsort(np.argsort(rows))
+        vectors[start:start + len(rows)] = stored[position]
+        if scales is not None:
+            scales[start:start + len(rows)] = block_scales[position]
+    vectors.flush()
+    del vectors
+
+    if scales is not None:
+        np.save(os.path.join(root, "scales.npy"), scales)
+    if lists:
+        np.save(os.path.join(root, "centroids.npy"), centroids)
+        np.save(os.path.join(root, "offsets.npy"), offsets)
+    with open(os.path.join(root, "entries.tsv"), "w") as f:
+        f.writelines(f"{ids[i]}\t{labels[i]}\n" for i in order)
+
+    # meta.json last: an index without it is incomplete
+    meta = {"count": int(count), "dim": int(dim), "dtype": dtype, "lists": int(lists),
+            "model_version": model_version, "built": time.time()}
+    tmp = os.path.join(root, "meta.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(root, "meta.json"))
+    return meta
+
+
+# -------------------------------
+# SEARCHING
+# -------------------------------
+class SimilarityIndex:
+    """Read-only, memory-mapped cosine index"""
+
+    def __init__(self, root, block_rows=DEFAULT_BLOCK_ROWS, nprobe=DEFAULT_NPROBE):
+        self.root = root
+        self.block_rows = block_rows
+        self.nprobe = nprobe
+        meta_path = os.path.join(root, "meta.json")
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"No similarity index at {root}")
+        with open(meta_path) as f:
+            self.meta = json.load(f)
+        self.count, self.dim = self.meta["count"], self.meta["dim"]
+        self.model_version = self.meta.get("model_version", "")
+        self.vectors = np.load(os.path.join(root, "vectors.npy"), mmap_mode="r")
+        self.scales = np.load(os.path.join(root, "scales.npy")) if self.meta["dtype"] == "int8" else None
+        self.centroids = self.offsets = None
+        if self.meta.get("lists"):
+            self.centroids = np.load(os.path.join(root, "centroids.npy"))
+            self.offsets = np.load(os.path.join(root, "offsets.npy"))
+        self.ids, self.labels = [], []
+        with open(os.path.join(root, "entries.tsv")) as f:
+            for line in f:
+                image_id, _, label = line.rstrip("\n").partition("\t")
+                self.ids.append(image_id)
+                self.labels.append(label)
+
+    def _scan(self, queries, ranges, k):
+        """Blocked top-k over the row `ranges` for unit-norm `queries` (m, dim)"""
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for lo, hi in ranges:
+            for start in range(lo, hi, self.block_rows):
+                stop = min(start + self.block_rows, hi)
+                # (rows, dim) @ (dim, m) keeps the big operand row-major for BLAS
+                scores = (self.vectors[start:stop].astype(np.float32) @ queries.T).T
+                if self.scales is not None:
+                    scores *= self.scales[start:stop]
+                best_scores, best_rows = merge_topk(best_scores, best_rows, scores,
+                                                    np.arange(start, stop, dtype=np.int64)[None, :], k)
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_rows, order, axis=1)
+
+    def search(self, queries, k=5, nprobe=None):
+        """`(scores, rows)`, each (m, k), of the nearest rows to every query, best first.
+
+        `nprobe` lists are scanned per query on an IVF index; 0 scans every row.
+        """
+        queries = normalize(queries)
+        if queries.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-d queries, got {queries.shape[1]}-d")
+        k = min(k, self.count)
+        nprobe = self.nprobe if nprobe is None else nprobe
+        if self.centroids is None or not nprobe or nprobe >= len(self.centroids):
+            return self._scan(queries, [(0, self.count)], k)
+
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        for i, lists in enumerate(probes):
+            ranges = [(int(self.offsets[j]), int(self.offsets[j + 1])) for j in np.sort(lists)]
+            found_scores, found_rows = self._scan(queries[i:i + 1], ranges, k)
+            scores[i, :found_scores.shape[1]] = found_scores[0]
+            rows[i, :found_rows.shape[1]] = found_rows[0]
+        return scores, rows
+
+    def neighbours(self, query, k=5, nprobe=None):
+        """Top-k cases for one embedding as `[{"id", "label", "score"}]`"""
+        scores, rows = self.search(query, k, nprobe)
+        return [{"id": self.ids[row], "label": self.labels[row], "score": round(float(score), 4)}
+                for score, row in zip(scores[0], rows[0]) if row >= 0]
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "dim": self.dim,
+            "dtype": self.meta["dtype"],
+            "lists": self.meta.get("lists", 0),
+            "nprobe": self.nprobe if self.centroids is not None else None,
+            "model_version": self.model_version,
+            "bytes": int(self.vectors.nbytes + (self.scales.nbytes if self.scales is not None else 0)),
+        }
+
+
+# -------------------------------
+# COMMAND LINE
+# -------------------------------
+def _cmd_build(args):
+    from preprocessing import embedding_version
+
+    args.model_version = embedding_version(args.model_version or "")
+    if args.store:
+        from feature_store import FeatureStore
+
+        store = FeatureStore(args.store)
+        ids, labels, blocks = [], [], []
+        for rows, features in store.iter_batches(args.model_version or None, args.source):
+            ids += [e.id for e in rows]
+            labels += [e.label for e in rows]
+            blocks.append(np.asarray(features))
+        if not blocks:
+            print(f"No embeddings in {args.store} match the filters", file=sys.stderr)
+            return 1
+        features = np.concatenate(blocks)
+    else:
+        features = np.load(args.features, mmap_mode="r")
+        labels = np.load(args.labels) if args.labels else None
+        ids = [f"{args.source}:{i}" for i in range(len(features))]
+
+    start = time.perf_counter()
+    meta = build(args.index, features, labels, ids, dtype=args.dtype, lists=args.lists,
+                 model_version=args.model_version, block_rows=args.block_rows)
+    print(f"Indexed {meta['count']} {meta['dim']}-d vectors as {meta['dtype']}"
+          f"{f' in {args.lists} lists' if args.lists else ''} in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+def _cmd_query(args):
+    index = SimilarityIndex(args.index, nprobe=args.nprobe)
+    query = np.load(args.features, mmap_mode="r")[args.row]
+    start = time.perf_counter()
+    results = index.neighbours(query, args.k)
+    print(json.dumps({"latency_ms": round((time.perf_counter() - start) * 1000, 3), "neighbours": results},
+                     indent=2))
+    return 0
+
+
+def _cmd_stats(args):
+    print(json.dumps(SimilarityIndex(args.index).stats(), indent=2))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("build", help="Index an X_*.npy matrix or a feature store")
+    p.add_argument("index")
+    source = p.add_mutually_exclusive_group(required=True)
+    source.add_argument("--features", help="(n, dim) .npy embeddings")
+    source.add_argument("--store", help="Feature store directory")
+    p.add_argument("--labels", help="Labels .npy for --features")
+    p.add_argument("--source", default=None, help="Id prefix for --features, or source filter for --store")
+    p.add_argument("--model-version", default=None,
+                   help="CNN version of the embeddings (filters --store; the preprocessing version is appended)")
+    p.add_argument("--dtype", choices=DTYPES, default="int8",
+                   help="int8 halves the size and scans faster; float16 keeps more precision")
+    p.add_argument("--lists", type=int, default=0, help="IVF coarse lists (0 disables IVF)")
+    p.add_argument("--block-rows", type=int, default=DEFAULT_BLOCK_ROWS)
+    p.set_defaults(func=_cmd_build)
+
+    p = sub.add_parser("query", help="Nearest cases for one row of an .npy matrix")
+    p.add_argument("index")
+    p.add_argument("--features", required=True)
+    p.add_argument("--row", type=int, default=0)
+    p.add_argument("--k", type=int, default=5)
+    p.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE)
+    p.set_defaults(func=_cmd_query)
+
+    p = sub.add_parser("stats", help="Print index metadata")
+    p.add_argument("index")
+    p.set_defaults(func=_cmd_stats)
+
+    args = parser.parse_args(argv)
+    if args.command == "build" and args.features and args.source is None:
+        args.source = "train"
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
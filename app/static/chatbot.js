@@ -0,0 +1,385 @@
+function getDiseaseIndicator(disease) {
+    const indicators = {
+        "COPD": {class: "copd", text: "COPD - Chronic Obstructive Pulmonary Disease"},
+        "fibrosis": {class: "fibrosis", text: "Fibrosis - Lung Scarring"},
+        "normal": {class: "normal", text: "Normal - Healthy Lungs"},
+        "pneumonia": {class: "pneumonia", text: "Pneumonia - Lung Infection"},
+        "pulmonary tb": {class: "tb", text: "Tuberculosis - Bacterial Infection"}
+    };
+    return indicators[disease] || {class: "normal", text: "Normal - Healthy Lungs"};
+}
+
+const chatWindow = document.getElementById('chat-window');
+const uploadBtn = document.getElementById('upload-xray-btn');
+const fileInput = document.getElementById('file-input');
+const doctorsBtn = document.getElementById('find-doctors-btn');
+const reportBtn = document.getElementById('download-report-btn');
+const messageInput = document.getElementById('message-input');
+const statusDot = document.getElementById('status-dot');
+
+function addMessage(message, sender='bot', type='normal') {
+    const div = document.createElement('div');
+    let className = `message ${sender}-message`;
+    if (type === 'error') className += ' error-message';
+    if (type === 'success') className += ' success-message';
+    
+    div.className = className;
+    div.innerHTML = message;
+    chatWindow.appendChild(div);
+    chatWindow.scrollTop = chatWindow.scrollHeight;
+}
+
+function addLoadingMessage() {
+    const loadingHtml = `
+        Processing your X-ray image... 
+        <div class="loading-dots">
+            <div></div><div></div><div></div><div></div>
+        </div>
+    `;
+    addMessage(loadingHtml, 'bot');
+}
+
+function removeLastMessage() {
+    const messages = chatWindow.querySelectorAll('.message');
+    if (messages.length > 0) {
+        const lastMessage = messages[messages.length - 1];
+        if (lastMessage.innerHTML.includes('loading-dots')) {
+            lastMessage.remove();
+        }
+    }
+}
+
+function updateStatusDot(isHealthy) {
+    if (isHealthy) {
+        statusDot.classList.remove('error');
+    } else {
+        statusDot.classList.add('error');
+    }
+}
+
+let lastStatus = null;
+
+function handleStatus(data) {
+    updateStatusDot(data.ready);
+
+    // Only announce transitions, not every pushed update
+    if (data.status === lastStatus) return;
+    if (data.status === 'starting') {
+        addMessage("⚠️ <strong>System Warning:</strong> AI models are loading. Please wait a moment before uploading images.", 'bot', 'error');
+    } else if (data.status === 'ready' && lastStatus !== null) {
+        addMessage("✅ <strong>System Ready:</strong> AI models are loaded. You can upload an X-ray now.", 'bot');
+    } else if (data.status === 'degraded' || data.status === 'failed') {
+        addMessage(`⚠️ <strong>System Warning:</strong> ${data.message || 'The analysis service is having problems.'}`, 'bot', 'error');
+    }
+    lastStatus = data.status;
+}
+
+async function checkReady() {
+    try {
+        const response = await fetch('/readyz');
+        const data = await response.json();
+        handleStatus(data);
+        return data.ready;
+    } catch (error) {
+        updateStatusDot(false);
+        if (lastStatus !== 'disconnected') {
+            lastStatus = 'disconnected';
+            addMessage("❌ <strong>System Error:</strong> Cannot connect to server. Please refresh the page.", 'bot', 'error');
+        }
+        return false;
+    }
+}
+
+// Without a stream, poll /readyz until the models are ready, backing off from 2 s to 60 s meanwhile
+async function pollReady(delay = 2000) {
+    if (await checkReady()) return;
+    setTimeout(() => pollReady(Math.min(delay * 2, 60000)), delay);
+}
+
+// The server pushes readiness changes; the browser reconnects the stream on its own
+if (window.EventSource) {
+    let failures = 0;
+    let plannedClose = false;
+    const events = new EventSource('/events');
+    events.addEventListener('status', (event) => {
+        failures = 0;
+        handleStatus(JSON.parse(event.data));
+    });
+    // Sent just before the server ends a stream on purpose; the reconnect that follows is expected
+    events.addEventListener('end', () => {
+        plannedClose = true;
+    });
+    events.onerror = () => {
+        if (events.readyState === EventSource.CLOSED) {
+            // 204 (no streaming on this server) or a fatal error: poll /readyz instead
+            pollReady();
+            return;
+        }
+        if (plannedClose) {
+            plannedClose = false;
+            return;
+        }
+        failures += 1;
+        updateStatusDot(false);
+        if (failures >= 2 && lastStatus !== 'disconnected') {
+            lastStatus = 'disconnected';
+            addMessage("❌ <strong>System Error:</strong> Lost connection to server. Reconnecting...", 'bot', 'error');
+        }
+    };
+} else {
+    pollReady();
+}
+
+addMessage(`
+    <strong>Hello! Welcome to our AI Medical Assistant</strong><br>
+    <span style='color:#767c8b;font-size:.95em;'>
+        Upload your chest X-ray to begin advanced disease detection analysis.
+        Our AI system can identify multiple chronic conditions with high accuracy.
+    </span>
+`, 'bot');
+
+uploadBtn.addEventListener('click', () => fileInput.click());
+
+// Upload settings rendered into the page: "compact" resizes on a canvas before sending
+const uploadConfig = document.body.dataset;
+
+function loadImage(file) {
+    return new Promise((resolve, reject) => {
+        const url = URL.createObjectURL(file);
+        const img = new Image();
+        img.onload = () => { URL.revokeObjectURL(url); resolve(img); };
+        img.onerror = () => { URL.revokeObjectURL(url); reject(new Error('Browser cannot decode this image')); };
+        img.src = url;
+    });
+}
+
+async function gzipBytes(bytes) {
+    if (!window.CompressionStream) return null;
+    const stream = new Blob([bytes]).stream().pipeThrough(new CompressionStream('gzip'));
+    return new Uint8Array(await new Response(stream).arrayBuffer());
+}
+
+// Source index under the centre of each output pixel, accumulated in doubles exactly as
+// PIL's NEAREST filter (and preprocessing._nearest_index on the server) computes it
+function nearestIndex(src, dst) {
+    const scale = src / dst;
+    const index = new Int32Array(dst);
+    let x = scale * 0.5;
+    for (let i = 0; i < dst; i++) {
+        index[i] = Math.min(Math.floor(x), src - 1);
+        x += scale;
+    }
+    return index;
+}
+
+async function buildCompactUpload(file) {
+    const size = parseInt(uploadConfig.compactSize, 10) || 224;
+    const img = await loadImage(file);
+
+    // Draw unscaled, then sample like training did: canvas smoothing would blur what the model sees
+    const width = img.naturalWidth;
+    const height = img.naturalHeight;
+    const canvas = document.createElement('canvas');
+    canvas.width = width;
+    canvas.height = height;
+    const ctx = canvas.getContext('2d');
+    ctx.imageSmoothingEnabled = false;
+    ctx.drawImage(img, 0, 0);
+    const rgba = ctx.getImageData(0, 0, width, height).data;
+    const rows = nearestIndex(height, size);
+    const cols = nearestIndex(width, size);
+
+    // Model-size pixels, sent raw: one byte per pixel for grayscale X-rays, three for colour
+    const sampled = new Uint8Array(size * size * 3);
+    let gray = true;
+    for (let y = 0, p = 0; y < size; y++) {
+        const row = rows[y] * width;
+        for (let x = 0; x < size; x++, p += 3) {
+            const i = (row + cols[x]) * 4;
+            sampled[p] = rgba[i];
+            sampled[p + 1] = rgba[i + 1];
+            sampled[p + 2] = rgba[i + 2];
+            if (rgba[i] !== rgba[i + 1] || rgba[i] !== rgba[i + 2]) gray = false;
+        }
+    }
+    let pixels = sampled;
+    if (gray) {
+        pixels = new Uint8Array(size * size);
+        for (let p = 0; p < pixels.length; p++) pixels[p] = sampled[p * 3];
+    }
+    const packed = await gzipBytes(pixels);
+    const tensor = packed && packed.length < pixels.length ? packed : pixels;
+
+    const formData = new FormData();
+    formData.append('tensor', new Blob([tensor], {type: 'application/octet-stream'}), 'tensor.bin');
+    formData.append('format', gray ? 'gray8' : 'rgb8');
+    formData.append('width', size);
+    formData.append('height', size);
+    formData.append('encoding', tensor === packed ? 'gzip' : 'identity');
+    let bytes = tensor.length;
+
+    // A downscaled JPEG for the PDF report
+    const reportSide = parseInt(uploadConfig.reportMaxSide, 10) || 0;
+    if (reportSide > 0) {
+        const scale = Math.min(1, reportSide / Math.max(img.naturalWidth, img.naturalHeight));
+        const report = document.createElement('canvas');
+        report.width = Math.max(1, Math.round(img.naturalWidth * scale));
+        report.height = Math.max(1, Math.round(img.naturalHeight * scale));
+        report.getContext('2d').drawImage(img, 0, 0, report.width, report.height);
+        const jpeg = await new Promise(resolve => report.toBlob(resolve, 'image/jpeg', 0.85));
+        if (jpeg) {
+            formData.append('report', jpeg, 'xray.jpg');
+            bytes += jpeg.size;
+        }
+    }
+    return {formData, bytes};
+}
+
+fileInput.addEventListener('change', async(event) => {
+    const file = event.target.files[0];
+    if (!file) return;
+    
+    const validTypes = ['image/jpeg', 'image/png', 'image/gif', 'image/bmp', 'image/tiff'];
+    // Browsers rarely know a MIME type for DICOM, so match it by extension
+    const isDicom = file.type === 'application/dicom' || /\.(dcm|dicom)$/i.test(file.name);
+    if (!validTypes.includes(file.type) && !isDicom) {
+        addMessage("❌ <strong>Invalid File Type:</strong> Please upload a valid image file (JPEG, PNG, GIF, BMP, TIFF, or DICOM).", 'bot', 'error');
+        return;
+    }
+    
+    let formData = null;
+    let sendBytes = file.size;
+    if (uploadConfig.uploadMode === 'compact' && !isDicom) {
+        try {
+            ({formData, bytes: sendBytes} = await buildCompactUpload(file));
+        } catch (err) {
+            // e.g. a TIFF the browser cannot draw: fall back to sending the original file
+            formData = null;
+            sendBytes = file.size;
+        }
+    }
+    
+    if (!formData && file.size > 16 * 1024 * 1024) {
+        addMessage("❌ <strong>File Too Large:</strong> Please upload an image smaller than 16MB.", 'bot', 'error');
+        return;
+    }
+    
+    addMessage(`📤 <strong>Uploading:</strong> ${file.name}<br><span style='font-size:0.9em;color:#767c8b;'>File size: ${(file.size/1024/1024).toFixed(2)} MB` +
+        (formData ? `, sending ${(sendBytes/1024).toFixed(0)} KB after resizing` : '') + `</span>`, 'bot');
+    
+    if (!formData) {
+        formData = new FormData();
+        formData.append('file', file);
+    }
+
+    try {
+        addLoadingMessage();
+        uploadBtn.disabled = true;
+        uploadBtn.textContent = 'Processing...';
+        
+        const controller = new AbortController();
+        const timeoutId = setTimeout(() => controller.abort(), 180000); // 3 minutes timeout
+        
+        const response = await fetch('/predict', {
+            method: 'POST',
+            body: formData,
+            signal: controller.signal
+        });
+        
+        clearTimeout(timeoutId);
+        const data = await response.json();
+        
+        removeLastMessage();
+        
+        if (data.status === 'success') {
+            const indicatorInfo = getDiseaseIndicator(data.disease);
+            addMessage(
+                `<span class="disease-indicator ${indicatorInfo.class}" data-tooltip="${indicatorInfo.text}"></span>
+                 <strong>Analysis Complete!</strong><br>
+                 <strong>Detected Condition:</strong> ${data.disease.toUpperCase()}<br>
+                 <strong>Confidence:</strong> ${(data.confidence * 100).toFixed(1)}%<br>
+                 <span style='color:#767c8b;font-size:.9em;'>
+                    Hover over the colored indicator for more information
+                 </span>
+                `, 'bot', 'success');
+            doctorsBtn.disabled = false;
+            reportBtn.disabled = false;
+            messageInput.disabled = false;
+        } else {
+            addMessage(`❌ <strong>Error:</strong> ${data.error}`, 'bot', 'error');
+        }
+    } catch (err) {
+        removeLastMessage();
+        if (err.name === 'AbortError') {
+            addMessage("⏱️ <strong>Timeout:</strong> Processing took too long. Server may be under heavy load. Please try again later.", 'bot', 'error');
+        } else {
+            addMessage("⚠️ <strong>Connection Failed:</strong> Server resources may be exhausted. Please try again in a few moments.", 'bot', 'error');
+        }
+    } finally {
+        uploadBtn.disabled = false;
+        uploadBtn.textContent = 'Upload X-ray';
+    }
+});
+
+reportBtn.addEventListener('click', () => {
+    addMessage(`
+        <div class='pdf-preview'>
+            📄 <strong>Generating comprehensive medical report...</strong><br>
+            <span style='font-size:0.9em;color:#767c8b;'>Including analysis results, recommendations, and disclaimers</span><br>
+            <a href='/generate_report' target='_blank'>📥 View & Download PDF Report</a>
+        </div>
+    `, 'bot');
+});
+
+doctorsBtn.addEventListener('click', () => {
+    addMessage("🔍 <strong>Locating nearby medical specialists...</strong><br><span style='font-size:0.9em;color:#767c8b;'>Searching for respiratory and pulmonary experts in your area</span>", 'bot');
+    
+    if (!navigator.geolocation) {
+        addMessage("❌ <strong>Location Error:</strong> Geolocation is not supported by your browser. Please enable location services.", 'bot', 'error');
+        return;
+    }
+    
+    navigator.geolocation.getCurrentPosition(async(pos) => {
+        const {latitude, longitude} = pos.coords;
+        try {
+            const resp = await fetch('/get_doctors', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({latitude, longitude})
+            });
+            const data = await resp.json();
+            if (data.doctors && data.doctors.length > 0) {
+                let html = "🏥 <strong>Found Nearby Specialists:</strong><br><br>";
+                data.doctors.slice(0, 5).forEach((doc, index) => {
+                    html += `<div class='doctor-card'>
+                        <strong>${index + 1}. ${doc.name}</strong><br>
+                        <a href='https://www.google.com/maps/search/?api=1&query=${encodeURIComponent(doc.location)}' target='_blank'>
+                            📍 ${doc.location}
+                        </a>
+                    </div>`;
+                });
+                addMessage(html, 'bot');
+            } else {
+                addMessage("❌ <strong>No Results:</strong> No medical specialists found in your immediate area.", 'bot', 'error');
+            }
+        } catch (err) {
+            addMessage("⚠️ <strong>Search Failed:</strong> Unable to fetch doctor information. Please try again later.", 'bot', 'error');
+        }
+    }, (error) => {
+        addMessage("❌ <strong>Location Access Denied:</strong> Please enable location permissions.", 'bot', 'error');
+    });
+});
+
+messageInput.addEventListener('keypress', (e) => {
+    if (e.key === 'Enter' && !messageInput.disabled) {
+        const message = messageInput.value.trim();
+        if (message) {
+            addMessage(message, 'user');
+            messageInput.value = '';
+            
+            setTimeout(() => {
+                addMessage("Thank you for your message! For detailed medical advice, please consult with a healthcare professional or use our diagnostic tools.", 'bot');
+            }, 1000);
+        }
+    }
+});
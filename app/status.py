@@ -0,0 +1,97 @@
+"""Readiness state pushed to clients instead of polled.
+
+The service's readiness (starting, ready, degraded, failed) changes only
+a handful of times per process lifetime. ``StatusBroadcaster`` keeps that
+state with a pre-serialized JSON payload for ``/readyz``, and wakes
+Server-Sent Events subscribers only when it actually changes. An open
+chatbot tab therefore costs one idle connection rather than a request
+every 10 seconds.
+"""
+import json
+import threading
+import time
+
+STATES = ("starting", "ready", "degraded", "failed")
+
+# Sent while nothing changes so proxies keep the stream open
+HEARTBEAT_SECONDS = 25.0
+# Browsers wait this long before reconnecting a dropped stream
+RETRY_MS = 5000
+
+
+class StatusBroadcaster:
+    def __init__(self, **initial):
+        self._cond = threading.Condition()
+        self._listeners = set()
+        self.version = 0
+        self.state = {"status": "starting", "ready": False, "since": time.time()}
+        self.state.update(initial)
+        self.payload = json.dumps(self.state).encode()
+
+    @property
+    def ready(self):
+        return self.state["ready"]
+
+    def update(self, **fields):
+        """Merge `fields` into the state; subscribers are woken only on a real change"""
+        with self._cond:
+            if all(self.state.get(k) == v for k, v in fields.items()):
+                return False
+            state = dict(self.state, **fields)
+            if fields.get("status", state["status"]) != self.state["status"]:
+                state["since"] = time.time()
+            self.state = state
+            self.payload = json.dumps(state).encode()
+            self.version += 1
+            self._cond.notify_all()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+        return True
+
+    def snapshot(self):
+        """`(version, payload)` read together"""
+        with self._cond:
+            return self.version, self.payload
+
+    def add_listener(self, callback):
+        """Call `callback()` (from the updating thread) after every change"""
+        with self._cond:
+            self._listeners.add(callback)
+
+    def remove_listener(self, callback):
+        with self._cond:
+            self._listeners.discard(callback)
+
+    def wait(self, version, timeout):
+        """Block until the state moves past `version` or `timeout` passes"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != version, timeout)
+            return self.version, self.payload
+
+    def stream(self, max_seconds=None):
+        """Blocking SSE generator for threaded WSGI servers; ends after `max_seconds` and the browser reconnects"""
+        deadline = time.time() + max_seconds if max_seconds else None
+        version, payload = self.snapshot()
+        yield retry_event() + sse_event(payload, version)
+        while deadline is None or time.time() < deadline:
+            new_version, payload = self.wait(version, HEARTBEAT_SECONDS)
+            if new_version == version:
+                yield b": keepalive\n\n"
+            else:
+                version = new_version
+                yield sse_event(payload, version)
+        # Tells the page this close is planned, so its reconnect is not reported as a lost connection
+        yield end_event()
+
+
+def sse_event(payload, version, event="status"):
+    return b"event: " + event.encode() + b"\nid: " + str(version).encode() + b"\ndata: " + payload + b"\n\n"
+
+
+def end_event():
+    return b"event: end\ndata: {}\n\n"
+
+
+def retry_event():
+    return f"retry: {RETRY_MS}\n\n".encode()
@@ -0,0 +1,302 @@
+"""Cached tf.data input pipeline for DenseNet fine-tuning.
+
+`ImageDataGenerator.flow_from_directory` decodes, resizes and augments every
+JPEG in single-threaded Python on every epoch. This module decodes and
+resizes each split once into a uint8 memmap cache (`images.npy`,
+`labels.npy`, `meta.json`), then serves epochs from it through a tf.data
+pipeline. Batches are gathered from the memmap, augmented in one vectorized
+affine warp per batch on TensorFlow's thread pool, and prefetched.
+
+The augmentation mirrors the notebook's ImageDataGenerator settings:
+rotation 40 degrees, width/height shift 0.2, shear 0.2 degrees, zoom 0.2,
+horizontal flip and nearest fill.
+
+    python app/train_input.py cache /data/dataset/train train_cache
+    python app/train_input.py finetune --train-cache train_cache --val-cache val_cache \\
+        --model models/densenet_best.h5 --output models/densenet_finetuned.h5
+"""
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import sys
+from functools import partial
+
+import numpy as np
+
+import preprocessing
+from model_utils import allowed_file
+from pipeline import prefetch_batches, start_process_pool
+
+logger = logging.getLogger("train_input")
+
+IMAGE_SIZE = 224
+
+AUGMENT = {
+    "rotation_range": 40.0,      # degrees
+    "width_shift_range": 0.2,    # fraction of width
+    "height_shift_range": 0.2,   # fraction of height
+    "shear_range": 0.2,          # degrees, as in Keras
+    "zoom_range": 0.2,
+    "horizontal_flip": True,
+}
+
+
+# -------------------------------
+# CACHE BUILDING
+# -------------------------------
+def decode_uint8(path, size=IMAGE_SIZE):
+    """Executor task: decode to RGB and resize like Keras load_img (nearest)"""
+    try:
+        return path, preprocessing.load_rgb(path, size), None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def sources_digest(split_dir, paths):
+    """Digest of every source's relative path, mtime and size; changes when any file is added, replaced or edited"""
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        st = os.stat(path)
+        digest.update(f"{os.path.relpath(path, split_dir)}\0{st.st_mtime_ns}\0{st.st_size}\n".encode())
+    return digest.hexdigest()
+
+
+def build_cache(split_dir, cache_dir, size=IMAGE_SIZE, workers=None, batch_size=64):
+    """Decode a class-folder split once into a uint8 memmap cache"""
+    from extract_features import list_split
+
+    meta_path = os.path.join(cache_dir, "meta.json")
+    paths, labels, class_names = list_split(split_dir, allowed_file)
+    digest = sources_digest(split_dir, paths)
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if (meta.get("sources_digest") == digest and meta.get("size") == size
+                and meta.get("preprocessing") == preprocessing.VERSION):
+            logger.info(f"✅ Cache {cache_dir} is up to date ({meta['count']} images)")
+            return meta
+
+    os.makedirs(cache_dir, exist_ok=True)
+    images = np.lib.format.open_memmap(os.path.join(cache_dir, "images.npy"), mode="w+",
+                                       dtype=np.uint8, shape=(len(paths), size, size, 3))
+    label_of = dict(zip(paths, labels))
+    kept, failed = [], 0
+    pool = start_process_pool(workers)
+    try:
+        for batch in prefetch_batches(paths, pool, decode=partial(decode_uint8, size=size), batch_size=batch_size):
+            for path, img, err in batch:
+                if err is not None:
+                    failed += 1
+                    continue
+                images[len(kept)] = img
+                kept.append(label_of[path])
+            logger.info(f"🔄 Cached {len(kept)}/{len(paths)} images")
+    finally:
+        pool.shutdown()
+    images.flush()
+    del images
+
+    if failed:
+        # Drop the unused tail so the cache holds exactly the decoded images
+        full = np.load(os.path.join(cache_dir, "images.npy"), mmap_mode="r")
+        trimmed = np.lib.format.open_memmap(os.path.join(cache_dir, "images.tmp.npy"), mode="w+",
+                                            dtype=np.uint8, shape=(len(kept), size, size, 3))
+        trimmed[:] = full[:len(kept)]
+        trimmed.flush()
+        del full, trimmed
+        os.replace(os.path.join(cache_dir, "images.tmp.npy"), os.path.join(cache_dir, "images.npy"))
+        logger.warning(f"⚠️ {failed} images could not be decoded and were skipped")
+
+    np.save(os.path.join(cache_dir, "labels.npy"), np.asarray(kept, dtype=np.int64))
+    meta = {"count": len(kept), "sources": len(paths), "sources_digest": digest, "size": size,
+            "preprocessing": preprocessing.VERSION, "class_names": class_names}
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(meta_path + ".tmp", meta_path)
+    return meta
+
+
+def load_cache(cache_dir, in_memory=False):
+    """Return `(images, labels, meta)`; images stay memory-mapped unless `in_memory`"""
+    with open(os.path.join(cache_dir, "meta.json")) as f:
+        meta = json.load(f)
+    images = np.load(os.path.join(cache_dir, "images.npy"), mmap_mode=None if in_memory else "r")
+    labels = np.load(os.path.join(cache_dir, "labels.npy"))
+    return images, labels, meta
+
+
+def class_weights(labels, num_classes=None):
+    """Balanced weights, matching the notebook's total / (classes * count)"""
+    counts = np.bincount(labels, minlength=num_classes or 0)
+    return {i: len(labels) / (len(counts) * c) for i, c in enumerate(counts) if c}
+
+
+# -------------------------------
+# TF.DATA PIPELINE
+# -------------------------------
+def _affine_transforms(batch, height, width, params, tf):
+    """Per-image output->input affine maps in ImageProjectiveTransform layout"""
+    def uniform(limit):
+        return tf.random.uniform([batch], -limit, limit)
+
+    theta = uniform(params["rotation_range"]) * (math.pi / 180.0)
+    shear = uniform(params["shear_range"]) * (math.pi / 180.0)
+    zoom = 1.0 + uniform(params["zoom_range"])
+    zoom_y = 1.0 + uniform(params["zoom_range"])
+    tx = uniform(params["width_shift_range"]) * width
+    ty = uniform(params["height_shift_range"]) * height
+    if params["horizontal_flip"]:
+        flip = tf.where(tf.random.uniform([batch]) < 0.5, -1.0, 1.0)
+    else:
+        flip = tf.ones([batch])
+
+    cos, sin = tf.cos(theta), tf.sin(theta)
+    # A = rotation @ shear @ zoom @ flip, applied around the image centre
+    a00 = cos * zoom * flip
+    a01 = (-cos * tf.sin(shear) - sin * tf.cos(shear)) * zoom_y
+    a10 = sin * zoom * flip
+    a11 = (-sin * tf.sin(shear) + cos * tf.cos(shear)) * zoom_y
+
+    cx, cy = (width - 1) / 2.0, (height - 1) / 2.0
+    a02 = cx - a00 * cx - a01 * cy + tx
+    a12 = cy - a10 * cx - a11 * cy + ty
+    zeros = tf.zeros([batch])
+    return tf.stack([a00, a01, a02, a10, a11, a12, zeros, zeros], axis=1)
+
+
+def augment_batch(images, params=AUGMENT):
+    """Random affine augmentation of a float32 NHWC batch in one warp op"""
+    import tensorflow as tf
+
+    shape = tf.shape(images)
+    height, width = tf.cast(shape[1], tf.float32), tf.cast(shape[2], tf.float32)
+    transforms = _affine_transforms(shape[0], height, width, params, tf)
+    return tf.raw_ops.ImageProjectiveTransformV3(
+        images=images, transforms=transforms, output_shape=shape[1:3],
+        fill_value=0.0, interpolation="BILINEAR", fill_mode="NEAREST")
+
+
+def make_dataset(cache_dir, batch_size=16, training=True, augment=True, in_memory=False, seed=None):
+    """Batched, normalized (x in [0, 1], sparse y) tf.data.Dataset over a cache"""
+    import tensorflow as tf
+
+    images, labels, meta = load_cache(cache_dir, in_memory)
+    size = meta["size"]
+
+    def gather(idx):
+        # Sorted indices turn random access into forward reads through the memmap
+        idx = np.sort(idx)
+        return images[idx], labels[idx]
+
+    def load(idx):
+        x, y = tf.numpy_function(gather, [idx], [tf.uint8, tf.int64])
+        x.set_shape([None, size, size, 3])
+        y.set_shape([None])
+        return x, y
+
+    def finish(x, y):
+        x = tf.cast(x, tf.float32)
+        if training and augment:
+            x = augment_batch(x)
+        return x * (1.0 / 255.0), y
+
+    ds = tf.data.Dataset.range(len(labels))
+    if training:
+        ds = ds.shuffle(len(labels), seed=seed, reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size, drop_remainder=False)
+    ds = ds.map(load, num_parallel_calls=tf.data.AUTOTUNE, deterministic=not training)
+    ds = ds.map(finish, num_parallel_calls=tf.data.AUTOTUNE, deterministic=not training)
+    return ds.prefetch(tf.data.AUTOTUNE)
+
+
+# -------------------------------
+# FINE-TUNING ENTRY POINT
+# -------------------------------
+def build_model(num_classes=5):
+    """DenseNet121 with the notebook's head: first 100 layers frozen, GAP, Dropout(0.6), softmax"""
+    import tensorflow as tf
+    from tensorflow.keras.applications import DenseNet121
+    from tensorflow.keras.layers import Dense, Dropout, GlobalAveragePooling2D
+
+    base_model = DenseNet121(weights="imagenet", include_top=False, input_shape=(IMAGE_SIZE, IMAGE_SIZE, 3))
+    for layer in base_model.layers[:100]:
+        layer.trainable = False
+    for layer in base_model.layers[100:]:
+        layer.trainable = True
+    x = GlobalAveragePooling2D()(base_model.output)
+    x = Dropout(0.6)(x)
+    output = Dense(num_classes, activation="softmax")(x)
+    return tf.keras.Model(inputs=base_model.input, outputs=output)
+
+
+def finetune(train_cache, val_cache, output, model_path=None, checkpoint=None, epochs=15, batch_size=16,
+             learning_rate=1e-4, in_memory=False):
+    import tensorflow as tf
+
+    if model_path and os.path.exists(model_path):
+        logger.info(f"🔄 Resuming from {model_path}")
+        model = tf.keras.models.load_model(model_path)
+    else:
+        model = build_model()
+
+    _, train_labels, meta = load_cache(train_cache)
+    train_ds = make_dataset(train_cache, batch_size, training=True, in_memory=in_memory)
+    val_ds = make_dataset(val_cache, batch_size, training=False, in_memory=in_memory)
+
+    def scheduler(epoch, lr):
+        if epoch % 3 == 0:
+            return lr * 0.5  # Reduce by half every 3 epochs
+        return lr
+
+    callbacks = [
+        tf.keras.callbacks.LearningRateScheduler(scheduler),
+        tf.keras.callbacks.EarlyStopping(monitor="val_loss", patience=3, restore_best_weights=True),
+    ]
+    if checkpoint:
+        callbacks.append(tf.keras.callbacks.ModelCheckpoint(checkpoint, save_best_only=True))
+
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+                  loss="sparse_categorical_crossentropy", metrics=["accuracy"])
+    model.fit(train_ds, validation_data=val_ds, epochs=epochs,
+              class_weight=class_weights(train_labels, len(meta["class_names"])), callbacks=callbacks)
+    model.save(output)
+    logger.info(f"💾 Model saved to {output}")
+    return model
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("cache", help="Decode a class-folder split into a uint8 memmap cache")
+    p.add_argument("split_dir")
+    p.add_argument("cache_dir")
+    p.add_argument("--size", type=int, default=IMAGE_SIZE)
+    p.add_argument("--workers", type=int, help="Decode processes (default: all cores)")
+
+    p = sub.add_parser("finetune", help="Fine-tune DenseNet121 from cached splits")
+    p.add_argument("--train-cache", required=True)
+    p.add_argument("--val-cache", required=True)
+    p.add_argument("--output", required=True, help="Where to save the final .h5")
+    p.add_argument("--model", help="Existing .h5 to resume from (otherwise ImageNet DenseNet121)")
+    p.add_argument("--checkpoint", help="Best-val_loss checkpoint path")
+    p.add_argument("--epochs", type=int, default=15)
+    p.add_argument("--batch-size", type=int, default=16)
+    p.add_argument("--learning-rate", type=float, default=1e-4)
+    p.add_argument("--in-memory", action="store_true", help="Load the caches into RAM instead of mapping them")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.command == "cache":
+        build_cache(args.split_dir, args.cache_dir, args.size, args.workers)
+    else:
+        finetune(args.train_cache, args.val_cache, args.output, args.model, args.checkpoint,
+                 args.epochs, args.batch_size, args.learning_rate, args.in_memory)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""Reproducible training of the RF + XGBoost stacking classifier.
+
+Scripts the notebook that produced ``fast_rf_xgb_stack2.pkl``: a random
+forest and XGBoost are fitted on the DenseNet embeddings, then a
+``StackingClassifier`` (prefit bases, passthrough features) trains a meta
+model on their probabilities plus the 1024 raw features. Compared with the
+notebook:
+
+* features are memory-mapped from ``X_*.npy`` and copied once, as float32
+* XGBoost uses the ``hist`` tree method, and the meta model is a multi-core
+  histogram learner (``HistGradientBoostingClassifier``, or LightGBM with
+  ``--meta lightgbm``) instead of the single-threaded ``GradientBoostingClassifier``
+* ``--warm-start VERSION`` continues an earlier version as new labelled
+  embeddings arrive (``--extra-features``/``--extra-labels``): the forest
+  grows ``--rf-trees`` more trees and XGBoost boosts ``--xgb-rounds`` more
+  rounds from the previous booster, and then the meta model is refitted
+* the result is a new registry version (``model_registry`` layout) with the
+  CNN, the stack, ``manifest.json`` and a ``report.json`` of training times
+  and accuracy
+
+    python app/train_stack.py --data notebooks --cnn models/densenet_new_finetuned_v3.h5
+    python app/train_stack.py --data notebooks --warm-start stack-20250101-120000 \\
+        --extra-features new/X_labelled.npy --extra-labels new/y_labelled.npy --promote
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+import model_registry
+from preprocessing import embedding_version
+
+logger = logging.getLogger("train_stack")
+
+META_MODELS = ("hist", "lightgbm")
+SEED = 42
+
+
+def load_split(data_dir, split):
+    """Memory-mapped `(X, y)` for X_<split>.npy / y_<split>.npy, or None when absent"""
+    path = os.path.join(data_dir, f"X_{split}.npy")
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode="r"), np.load(os.path.join(data_dir, f"y_{split}.npy")).astype(np.int64)
+
+
+def stack_rows(parts):
+    """Concatenate memmapped parts into one contiguous float32 matrix (the only copy)"""
+    rows = sum(len(X) for X, _ in parts)
+    X_all = np.empty((rows, parts[0][0].shape[1]), dtype=np.float32)
+    offset = 0
+    for X, _ in parts:
+        X_all[offset:offset + len(X)] = X
+        offset += len(X)
+    return X_all, np.concatenate([y for _, y in parts])
+
+
+# -------------------------------
+# MODELS
+# -------------------------------
+def build_meta(kind, jobs):
+    if kind == "lightgbm":
+        from lightgbm import LGBMClassifier
+
+        return LGBMClassifier(n_estimators=200, learning_rate=0.05, num_leaves=31, colsample_bytree=0.5,
+                              random_state=SEED, n_jobs=jobs, verbose=-1)
+    from sklearn.ensemble import HistGradientBoostingClassifier
+
+    return HistGradientBoostingClassifier(max_iter=200, learning_rate=0.1, max_depth=4, early_stopping=False,
+                                          random_state=SEED)
+
+
+def fit_rf(X, y, trees, jobs, previous=None):
+    from sklearn.ensemble import RandomForestClassifier
+
+    if previous is not None:
+        # warm_start keeps the fitted trees and grows only the new ones
+        previous.set_params(warm_start=True, n_estimators=previous.n_estimators + trees, n_jobs=jobs)
+        return previous.fit(X, y)
+    return RandomForestClassifier(n_estimators=trees, max_depth=15, random_state=SEED, n_jobs=jobs).fit(X, y)
+
+
+def fit_xgb(X, y, rounds, jobs, previous=None):
+    from xgboost import XGBClassifier
+
+    params = dict(n_estimators=rounds, max_depth=6, learning_rate=0.1, subsample=0.8, colsample_bytree=0.8,
+                  tree_method="hist", random_state=SEED, n_jobs=jobs, eval_metric="mlogloss")
+    if previous is not None:
+        model = XGBClassifier(**dict(previous.get_params(), n_estimators=rounds, tree_method="hist", n_jobs=jobs))
+        return model.fit(X, y, xgb_model=previous.get_booster())
+    return XGBClassifier(**params).fit(X, y)
+
+
+def fit_stack(rf, xgb, meta, X, y, jobs):
+    from sklearn.ensemble import StackingClassifier
+
+    stack = StackingClassifier(estimators=[("rf", rf), ("xgb", xgb)], final_estimator=meta,
+                               cv="prefit", passthrough=True, n_jobs=jobs)
+    return stack.fit(X, y)
+
+
+def evaluate(model, X, y):
+    from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
+
+    start = time.perf_counter()
+    predicted = model.predict(X)
+    elapsed = time.perf_counter() - start
+    return {
+        "rows": int(len(y)),
+        "accuracy": round(float(accuracy_score(y, predicted)), 4),
+        "predict_ms_per_row": round(elapsed * 1000 / max(len(y), 1), 4),
+        "classification_report": classification_report(y, predicted, output_dict=True, zero_division=0),
+        "confusion_matrix": confusion_matrix(y, predicted).tolist(),
+    }
+
+
+# -------------------------------
+# TRAINING
+# -------------------------------
+def train(args):
+    import joblib
+    from threadpoolctl import threadpool_limits
+
+    timings = {}
+    start = time.perf_counter()
+    train_split = load_split(args.data, "train")
+    val_split = load_split(args.data, "val")
+    test_split = load_split(args.data, "test")
+    if train_split is None:
+        raise SystemExit(f"No X_train.npy in {args.data}")
+    parts = [train_split]
+    if val_split is not None and not args.holdout_val:
+        parts.append(val_split)
+    for features, labels in zip(args.extra_features, args.extra_labels):
+        parts.append((np.load(features, mmap_mode="r"), np.load(labels).astype(np.int64)))
+    X, y = stack_rows(parts)
+    timings["load_s"] = round(time.perf_counter() - start, 2)
+    logger.info(f"📂 Training on {X.shape[0]} x {X.shape[1]} embeddings from {len(parts)} part(s)")
+
+    parent = previous = None
+    if args.warm_start:
+        parent = model_registry.resolve(args.registry, args.warm_start)
+        previous = joblib.load(parent.stack_path)
+        logger.info(f"♻️ Warm start from {parent.version}")
+
+    jobs = args.jobs
+    # HistGradientBoosting threads come from OpenMP rather than an n_jobs argument
+    with threadpool_limits(limits=jobs if jobs > 0 else None):
+        start = time.perf_counter()
+        rf = fit_rf(X, y, args.rf_trees, jobs, previous.named_estimators_["rf"] if previous else None)
+        timings["rf_s"] = round(time.perf_counter() - start, 2)
+        logger.info(f"🌲 Random forest: {rf.n_estimators} trees in {timings['rf_s']}s")
+
+        start = time.perf_counter()
+        xgb = fit_xgb(X, y, args.xgb_rounds, jobs, previous.named_estimators_["xgb"] if previous else None)
+        timings["xgb_s"] = round(time.perf_counter() - start, 2)
+        logger.info(f"🚀 XGBoost: {xgb.get_booster().num_boosted_rounds()} rounds in {timings['xgb_s']}s")
+
+        start = time.perf_counter()
+        stack = fit_stack(rf, xgb, build_meta(args.meta, jobs), X, y, jobs)
+        timings["meta_s"] = round(time.perf_counter() - start, 2)
+        logger.info(f"🧮 Meta model ({args.meta}) in {timings['meta_s']}s")
+
+        start = time.perf_counter()
+        scores = {"train": evaluate(stack, X, y)}
+        if val_split is not None and args.holdout_val:
+            scores["val"] = evaluate(stack, np.asarray(val_split[0], dtype=np.float32), val_split[1])
+        if test_split is not None:
+            scores["test"] = evaluate(stack, np.asarray(test_split[0], dtype=np.float32), test_split[1])
+        timings["evaluate_s"] = round(time.perf_counter() - start, 2)
+
+    version = args.version or datetime.now().strftime("stack-%Y%m%d-%H%M%S")
+    directory = write_version(args, version, stack, parent, timings, scores, X.shape)
+    summary = ", ".join(f"{split} {s['accuracy']:.4f}" for split, s in scores.items())
+    logger.info(f"✅ Version {version} written to {directory} (accuracy: {summary})")
+    if args.promote:
+        model_registry.promote(args.registry, version)
+        logger.info(f"📌 CURRENT -> {version}")
+    return version
+
+
+def write_version(args, version, stack, parent, timings, scores, shape):
+    """Write <registry>/<version>/ with the CNN, stack, manifest and report"""
+    import joblib
+    import sklearn
+
+    directory = os.path.join(args.registry, version)
+    if os.path.exists(directory):
+        raise SystemExit(f"Version {version} already exists in {args.registry}")
+    tmp = directory + ".tmp"
+    os.makedirs(tmp)
+
+    cnn_path = args.cnn or (parent.cnn_path if parent else None)
+    if cnn_path is None:
+        raise SystemExit("Pass --cnn (or --warm-start from a version that has one)")
+    cnn_name = os.path.basename(cnn_path)
+    try:
+        os.link(cnn_path, os.path.join(tmp, cnn_name))
+    except OSError:
+        shutil.copy2(cnn_path, os.path.join(tmp, cnn_name))
+    stack_name = "stack.pkl"
+    joblib.dump(stack, os.path.join(tmp, stack_name))
+
+    # The embeddings came from this CNN, whatever the version is called
+    cnn_version = embedding_version(args.cnn_version
+                                    or (parent.cnn_version if parent else os.path.splitext(cnn_name)[0]))
+    with open(os.path.join(tmp, "manifest.json"), "w") as f:
+        json.dump({"cnn": cnn_name, "stack": stack_name, "cnn_version": cnn_version}, f, indent=2)
+
+    report = {
+        "version": version,
+        "created": datetime.now().isoformat(),
+        "parent": parent.version if parent else None,
+        "rows": int(shape[0]),
+        "dim": int(shape[1]),
+        "meta": args.meta,
+        "rf_trees": int(stack.named_estimators_["rf"].n_estimators),
+        "xgb_rounds": int(stack.named_estimators_["xgb"].get_booster().num_boosted_rounds()),
+        "jobs": args.jobs,
+        "timings": timings,
+        "stack_mb": round(os.path.getsize(os.path.join(tmp, stack_name)) / 1024 / 1024, 1),
+        "scores": scores,
+        "sklearn": sklearn.__version__,
+    }
+    with open(os.path.join(tmp, "report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp, directory)
+    return directory
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default="notebooks", help="Directory of X_{train,val,test}.npy / y_*.npy")
+    parser.add_argument("--registry", default=os.path.join("models", "registry"))
+    parser.add_argument("--cnn", help="DenseNet .h5 that produced the features (default: the warm-start version's)")
+    parser.add_argument("--cnn-version", help="CNN version recorded in the manifest (default: the CNN file name)")
+    parser.add_argument("--version", help="Name of the new version (default: stack-<timestamp>)")
+    parser.add_argument("--warm-start", help="Registry version to continue from")
+    parser.add_argument("--extra-features", nargs="*", default=[], help="Additional labelled X .npy files")
+    parser.add_argument("--extra-labels", nargs="*", default=[], help="Labels matching --extra-features")
+    parser.add_argument("--holdout-val", action="store_true", help="Report on X_val instead of training on it")
+    parser.add_argument("--rf-trees", type=int, default=100, help="Trees to grow (added trees on warm start)")
+    parser.add_argument("--xgb-rounds", type=int, default=100, help="Boosting rounds (added rounds on warm start)")
+    parser.add_argument("--meta", choices=META_MODELS, default="hist")
+    parser.add_argument("--jobs", type=int, default=-1, help="Threads per learner (-1 = all cores)")
+    parser.add_argument("--promote", action="store_true", help="Point CURRENT at the new version")
+    args = parser.parse_args(argv)
+    if len(args.extra_features) != len(args.extra_labels):
+        parser.error("--extra-features and --extra-labels must pair up")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    train(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
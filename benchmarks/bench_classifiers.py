@@ -0,0 +1,188 @@
+"""Accuracy, size, load time and predict latency of candidate serving classifiers.
+
+Every candidate is trained on the saved DenseNet features (train + val, as
+for the production stack) or loaded from `--load-dir/<name>.pkl`, then
+pickled with joblib like the served model. For each thread count, every
+candidate is timed on `predict_proba` for test-set batches of 1 to 256 rows.
+Thread pools are pinned with the model's own thread parameter and
+threadpoolctl. Candidates whose library is not installed are skipped.
+
+* ``rf``       - RandomForestClassifier (the stack's forest)
+* ``histgb``   - HistGradientBoostingClassifier
+* ``xgb``      - XGBoost, hist tree method
+* ``lightgbm`` - LightGBM
+* ``catboost`` - CatBoost
+* ``stack``    - RF + XGBoost stack from app/train_stack.py, or `--stack` (e.g. models/fast_rf_xgb_stack2.pkl)
+
+    python benchmarks/bench_classifiers.py --data notebooks --threads 1 4 --output classifiers.json
+    python benchmarks/bench_classifiers.py --models xgb lightgbm stack --stack models/fast_rf_xgb_stack2.pkl
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import train_stack  # noqa: E402
+
+CANDIDATES = ("rf", "histgb", "xgb", "lightgbm", "catboost", "stack")
+SEED = 42
+
+
+def build(name, X, y, jobs, stack_path=None):
+    """Fit candidate `name` (or load the given stack)"""
+    if name == "rf":
+        return train_stack.fit_rf(X, y, 100, jobs)
+    if name == "histgb":
+        from sklearn.ensemble import HistGradientBoostingClassifier
+
+        return HistGradientBoostingClassifier(max_iter=200, learning_rate=0.1, early_stopping=False,
+                                              random_state=SEED).fit(X, y)
+    if name == "xgb":
+        return train_stack.fit_xgb(X, y, 100, jobs)
+    if name == "lightgbm":
+        return train_stack.build_meta("lightgbm", jobs).fit(X, y)
+    if name == "catboost":
+        from catboost import CatBoostClassifier
+
+        return CatBoostClassifier(iterations=300, depth=6, learning_rate=0.1, random_seed=SEED,
+                                  thread_count=jobs, verbose=0).fit(X, y)
+    if name == "stack":
+        if stack_path:
+            import joblib
+
+            return joblib.load(stack_path)
+        rf = train_stack.fit_rf(X, y, 100, jobs)
+        xgb = train_stack.fit_xgb(X, y, 100, jobs)
+        return train_stack.fit_stack(rf, xgb, train_stack.build_meta("hist", jobs), X, y, jobs)
+    raise ValueError(f"Unknown candidate {name!r}")
+
+
+def set_threads(model, threads):
+    """Pin a model's own thread pool, including a stack's base and meta models"""
+    for estimator in [model] + list(getattr(model, "estimators_", [])) + [getattr(model, "final_estimator_", None)]:
+        if estimator is None or not hasattr(estimator, "get_params"):
+            continue
+        params = estimator.get_params(deep=False)
+        if "n_jobs" in params:
+            estimator.set_params(n_jobs=threads)
+        elif "thread_count" in params:
+            estimator.set_params(thread_count=threads)
+
+
+def measure_latency(model, X, batch_size, repeats, threads):
+    from threadpoolctl import threadpool_limits
+
+    rng = np.random.default_rng(0)
+    starts = rng.integers(0, max(1, len(X) - batch_size + 1), repeats)
+    latencies = np.empty(repeats)
+    with threadpool_limits(limits=threads):
+        model.predict_proba(X[:batch_size])  # warm-up
+        for i, start in enumerate(starts):
+            batch = X[start:start + batch_size]
+            t = time.perf_counter()
+            model.predict_proba(batch)
+            latencies[i] = (time.perf_counter() - t) * 1000
+    return {
+        "batch_size": batch_size,
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "rows_per_s": round(batch_size * 1000 / float(np.median(latencies)), 1),
+    }
+
+
+def load_data(data_dir):
+    train = train_stack.load_split(data_dir, "train")
+    val = train_stack.load_split(data_dir, "val")
+    test = train_stack.load_split(data_dir, "test")
+    if train is None or test is None:
+        raise SystemExit(f"Need X_train.npy and X_test.npy in {data_dir}")
+    X, y = train_stack.stack_rows([train] + ([val] if val is not None else []))
+    return X, y, np.ascontiguousarray(test[0], dtype=np.float32), test[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default="notebooks", help="Directory of X_*.npy / y_*.npy")
+    parser.add_argument("--models", nargs="+", choices=CANDIDATES, default=list(CANDIDATES))
+    parser.add_argument("--stack", help="Serving stack .pkl to benchmark instead of training one")
+    parser.add_argument("--load-dir", help="Load <name>.pkl from here instead of training (missing ones are trained)")
+    parser.add_argument("--save-dir", help="Keep the trained models here as <name>.pkl")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1], help="Thread counts to time predict under")
+    parser.add_argument("--train-jobs", type=int, default=-1, help="Threads for training (-1 = all cores)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 16, 64, 256])
+    parser.add_argument("--repeats", type=int, default=200, help="Timed calls per batch size")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    import joblib
+    from sklearn.metrics import accuracy_score, f1_score
+
+    X, y, X_test, y_test = load_data(args.data)
+    print(f"Training rows {len(X)}, test rows {len(X_test)}, dim {X.shape[1]}")
+    results = {"train_rows": int(len(X)), "test_rows": int(len(X_test)), "dim": int(X.shape[1]),
+               "threads": args.threads, "models": []}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        save_dir = args.save_dir or tmp
+        os.makedirs(save_dir, exist_ok=True)
+        for name in args.models:
+            path = os.path.join(args.load_dir, f"{name}.pkl") if args.load_dir else None
+            train_s = None
+            try:
+                if path and os.path.exists(path):
+                    model = joblib.load(path)
+                else:
+                    start = time.perf_counter()
+                    model = build(name, X, y, args.train_jobs, args.stack)
+                    train_s = None if name == "stack" and args.stack else round(time.perf_counter() - start, 2)
+            except ImportError as e:
+                print(f"{name}: skipped ({e})")
+                continue
+
+            path = os.path.join(save_dir, f"{name}.pkl")
+            joblib.dump(model, path)
+            load_times = []
+            for _ in range(3):
+                start = time.perf_counter()
+                model = joblib.load(path)
+                load_times.append(time.perf_counter() - start)
+
+            predicted = np.asarray(model.predict(X_test)).astype(np.int64).ravel()
+            entry = {
+                "model": name,
+                "accuracy": round(float(accuracy_score(y_test, predicted)), 4),
+                "macro_f1": round(float(f1_score(y_test, predicted, average="macro")), 4),
+                "size_mb": round(os.path.getsize(path) / 1024 / 1024, 2),
+                "load_ms": round(float(np.median(load_times)) * 1000, 1),
+                "train_s": train_s,
+                "latency": [],
+            }
+            for threads in args.threads:
+                set_threads(model, threads)
+                for batch_size in args.batch_sizes:
+                    entry["latency"].append(dict(measure_latency(model, X_test, batch_size, args.repeats, threads),
+                                                 threads=threads))
+            results["models"].append(entry)
+
+    header = f"{'model':>9} {'acc':>7} {'f1':>7} {'size':>8} {'load':>8} {'threads':>7} " + " ".join(
+        f"{f'p50/p99@{b}':>17}" for b in args.batch_sizes)
+    print(header)
+    for entry in results["models"]:
+        for threads in args.threads:
+            cells = [r for r in entry["latency"] if r["threads"] == threads]
+            print(f"{entry['model']:>9} {entry['accuracy']:>7.4f} {entry['macro_f1']:>7.4f} "
+                  f"{entry['size_mb']:>6.1f}MB {entry['load_ms']:>6.0f}ms {threads:>7} "
+                  + " ".join(f"{r['p50_ms']:.2f}/{r['p99_ms']:.2f}ms".rjust(17) for r in cells))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Compare the allocating /predict preprocessing path with the pooled one.
+
+The legacy path mirrors the original route: fresh resize/float32/expand_dims
+copies per request plus two forced `gc.collect()` calls. The pooled path
+resizes and normalizes into a thread's preallocated buffers and leaves
+collection to the configured GC policy. A heap of long-lived objects stands
+in for a loaded TensorFlow graph so full collections cost what they do in
+production.
+
+    python benchmarks/bench_hotpath.py --iterations 500 --heap-objects 2000000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import gc_policy  # noqa: E402
+from buffers import BufferPool, resize_normalize_into  # noqa: E402
+
+
+def make_xray(path, size):
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, size=(size, size), dtype=np.uint8)
+    img = cv2.GaussianBlur(img, (0, 0), 8)
+    cv2.imwrite(path, img)
+
+
+def legacy_step(path, weights):
+    img = cv2.imread(path)
+    img = cv2.resize(img, (224, 224))
+    img = img.astype(np.float32) / 255.0
+    img = np.expand_dims(img, axis=0)
+    features = (img.reshape(1, -1)[:, :weights.shape[0]] @ weights).reshape(1, -1)
+    del img
+    gc.collect()
+    label = int(features.argmax())
+    del features
+    gc.collect()
+    return label
+
+
+def pooled_step(path, weights, pool):
+    buffers = pool.get()
+    batch = resize_normalize_into(cv2.imread(path), buffers)
+    features = buffers.feature_row(weights.shape[1])
+    np.matmul(batch.reshape(1, -1)[:, :weights.shape[0]], weights, out=features)
+    return int(features.argmax())
+
+
+def run(name, step, iterations):
+    # Warm up so one-time buffer allocation is not counted per request
+    for _ in range(5):
+        step()
+
+    latencies = []
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    peak_total = 0
+    for _ in range(iterations):
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        step()
+        latencies.append((time.perf_counter() - start) * 1000)
+        peak_total += tracemalloc.get_traced_memory()[1]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    allocations = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+    lat = np.array(latencies)
+    return {
+        "path": name,
+        "iterations": iterations,
+        "p50_ms": round(float(np.percentile(lat, 50)), 3),
+        "p95_ms": round(float(np.percentile(lat, 95)), 3),
+        "p99_ms": round(float(np.percentile(lat, 99)), 3),
+        "max_ms": round(float(lat.max()), 3),
+        "mean_peak_traced_kb": round(peak_total / iterations / 1024, 1),
+        "retained_blocks": allocations,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=300)
+    parser.add_argument("--image-size", type=int, default=2048, help="Side of the synthetic X-ray in pixels")
+    parser.add_argument("--heap-objects", type=int, default=1_000_000,
+                        help="Long-lived objects kept alive to make full collections realistic")
+    parser.add_argument("--gc-policy", default="thresholds", choices=gc_policy.POLICIES)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    heap = [{"i": i} for i in range(args.heap_objects)]
+    weights = np.random.default_rng(1).standard_normal((4096, 1024)).astype(np.float32)
+    pool = BufferPool()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "xray.png")
+        make_xray(path, args.image_size)
+
+        legacy = run("legacy", lambda: legacy_step(path, weights), args.iterations)
+
+        gc_policy.configure(args.gc_policy)
+        gc_policy.freeze()
+        pooled = run("pooled", lambda: pooled_step(path, weights, pool), args.iterations)
+
+    results = {"image_size": args.image_size, "heap_objects": len(heap), "gc_policy": args.gc_policy,
+               "runs": [legacy, pooled]}
+    for r in results["runs"]:
+        print(f"{r['path']:>7}: p50={r['p50_ms']:.2f}ms p95={r['p95_ms']:.2f}ms p99={r['p99_ms']:.2f}ms "
+              f"peak={r['mean_peak_traced_kb']:.0f}KB/req retained_blocks={r['retained_blocks']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Cold-start cost of importing the web app, per startup profile.
+
+Each profile runs in a fresh interpreter with `python -X importtime` and
+reports wall time, peak RSS and the heaviest top-level imports:
+
+* ``web``   - `import app` with APP_ROLE=web; heavy dependencies stay lazy
+* ``full``  - `import app` with APP_ROLE=full; heavy dependencies are still lazy at import
+* ``eager`` - `import app` followed by `lazy_imports.preload()`, which pays
+  what the module-level imports used to cost (tensorflow, cv2, fpdf, requests, joblib)
+
+    python benchmarks/bench_import.py --repeat 3 --output imports.json
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+PROFILES = {
+    "web": ("web", "import app"),
+    "full": ("full", "import app"),
+    "eager": ("full", "import app, lazy_imports; lazy_imports.preload()"),
+}
+
+# "import time: self [us] | cumulative | imported package", nesting shown by leading spaces
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+REPORT_RSS = "import resource, sys; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, file=sys.stderr)"
+
+
+def parse_importtime(stderr):
+    """Top-level modules and their cumulative import time in ms"""
+    top = {}
+    for line in stderr.splitlines():
+        m = IMPORTTIME_LINE.match(line)
+        if m and len(m.group(3)) == 1:
+            top[m.group(4)] = int(m.group(2)) / 1000
+    return top
+
+
+def run_profile(role, code):
+    env = dict(os.environ, APP_ROLE=role, GC_POLICY="default")
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"{code}; {REPORT_RSS}"],
+                          cwd=APP_DIR, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"Profile {role!r} failed:\n{proc.stderr[-2000:]}")
+    lines = proc.stderr.strip().splitlines()
+    return {
+        "wall_s": wall,
+        "max_rss_mb": int(lines[-1]) / 1024,
+        "imports_ms": parse_importtime(proc.stderr),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", default="web,full,eager")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters per profile (median is reported)")
+    parser.add_argument("--top", type=int, default=8, help="Heaviest top-level imports to list")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = {}
+    for name in [p for p in args.profiles.split(",") if p]:
+        role, code = PROFILES[name]
+        runs = [run_profile(role, code) for _ in range(args.repeat)]
+        heaviest = sorted(runs[-1]["imports_ms"].items(), key=lambda kv: kv[1], reverse=True)[:args.top]
+        results[name] = {
+            "wall_s": round(statistics.median(r["wall_s"] for r in runs), 3),
+            "max_rss_mb": round(statistics.median(r["max_rss_mb"] for r in runs), 1),
+            "import_ms": round(statistics.median(sum(r["imports_ms"].values()) for r in runs), 1),
+            "heaviest": [{"module": m, "ms": round(ms, 1)} for m, ms in heaviest],
+        }
+
+    for name, r in results.items():
+        print(f"{name:>6}: wall={r['wall_s']:.2f}s imports={r['import_ms']:.0f}ms rss={r['max_rss_mb']:.0f}MB")
+        print("        " + ", ".join(f"{h['module']} {h['ms']:.0f}ms" for h in r["heaviest"]))
+    if "eager" in results and "web" in results:
+        saved = results["eager"]["wall_s"] - results["web"]["wall_s"]
+        print(f"web profile starts {saved:.2f}s faster and {results['eager']['max_rss_mb'] - results['web']['max_rss_mb']:.0f}MB "
+              f"smaller than eager imports")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""Recall and latency of the similar-case index against exact float32 search.
+
+Builds float16, int8 and int8 + IVF indexes over the same embeddings, then
+compares each query's top-k with an exact brute-force search over the
+float32 originals. Without `--features`, clustered synthetic 1024-d
+embeddings stand in for the DenseNet ones.
+
+    python benchmarks/bench_similarity.py --rows 200000 --queries 200 --lists 512 --nprobe 4 8 16
+    python benchmarks/bench_similarity.py --features notebooks/X_train.npy --query-features notebooks/X_test.npy
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import similarity  # noqa: E402
+
+
+def synthetic(rows, dim, clusters, seed):
+    """Clustered non-negative vectors, like ReLU-pooled embeddings"""
+    rng = np.random.default_rng(seed)
+    centers = np.abs(rng.standard_normal((clusters, dim))).astype(np.float32)
+    assign = rng.integers(0, clusters, rows)
+    data = np.empty((rows, dim), dtype=np.float32)
+    for start in range(0, rows, 65536):
+        stop = min(start + 65536, rows)
+        noise = rng.standard_normal((stop - start, dim)).astype(np.float32)
+        data[start:stop] = np.abs(centers[assign[start:stop]] + 0.6 * noise)
+    return data, assign % 5
+
+
+def exact_topk(data, queries, k, block_rows=65536):
+    """Exact float32 cosine top-k, in blocks"""
+    queries = similarity.normalize(queries)
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+    for start in range(0, len(data), block_rows):
+        block = similarity.normalize(data[start:start + block_rows])
+        best_scores, best_rows = similarity.merge_topk(
+            best_scores, best_rows, queries @ block.T,
+            np.arange(start, start + len(block), dtype=np.int64)[None, :], k)
+    return best_rows
+
+
+def run(name, index, queries, truth, k, nprobe):
+    ids = np.array([int(i) for i in index.ids], dtype=np.int64)
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        _, rows = index.search(query, k, nprobe)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found = ids[rows[0][rows[0] >= 0]]
+        hits += len(set(found.tolist()) & set(expected.tolist()))
+    lat = np.array(latencies)
+    return {
+        "index": name,
+        "nprobe": nprobe if index.centroids is not None else None,
+        "recall_at_k": round(hits / (len(queries) * k), 4),
+        "p50_ms": round(float(np.percentile(lat, 50)), 3),
+        "p99_ms": round(float(np.percentile(lat, 99)), 3),
+        "index_mb": round(index.stats()["bytes"] / 1024 / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--features", help="(n, dim) .npy embeddings to index (default: synthetic)")
+    parser.add_argument("--query-features", help="(m, dim) .npy queries (default: perturbed indexed rows)")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--lists", type=int, default=256, help="IVF lists (0 skips the IVF index)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--block-rows", type=int, default=similarity.DEFAULT_BLOCK_ROWS)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    if args.features:
+        data, labels = np.load(args.features, mmap_mode="r"), None
+    else:
+        data, labels = synthetic(args.rows, args.dim, args.clusters, seed=0)
+    if args.query_features:
+        queries = np.asarray(np.load(args.query_features, mmap_mode="r")[:args.queries], dtype=np.float32)
+    else:
+        picks = rng.choice(len(data), size=args.queries, replace=False)
+        queries = np.asarray(data[picks], dtype=np.float32)
+        queries += 0.05 * np.abs(queries).mean() * rng.standard_normal(queries.shape).astype(np.float32)
+
+    start = time.perf_counter()
+    truth = exact_topk(data, queries, args.k)
+    print(f"Exact float32 search: {(time.perf_counter() - start) * 1000 / len(queries):.2f} ms/query "
+          f"over {len(data)} x {data.shape[1]}")
+
+    configs = [("float16", 0), ("int8", 0)] + ([("int8", args.lists)] if args.lists else [])
+    results = {"rows": int(len(data)), "dim": int(data.shape[1]), "queries": int(len(queries)), "k": args.k,
+               "runs": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        for dtype, lists in configs:
+            name = f"{dtype}{f'+ivf{lists}' if lists else ''}"
+            root = os.path.join(tmp, name)
+            start = time.perf_counter()
+            similarity.build(root, data, labels, dtype=dtype, lists=lists, block_rows=args.block_rows)
+            build_s = time.perf_counter() - start
+            index = similarity.SimilarityIndex(root, block_rows=args.block_rows)
+            for nprobe in (args.nprobe if lists else [0]):
+                r = run(name, index, queries, truth, args.k, nprobe)
+                r["build_s"] = round(build_s, 2)
+                results["runs"].append(r)
+
+    for r in results["runs"]:
+        probe = f" nprobe={r['nprobe']}" if r["nprobe"] else ""
+        print(f"{r['index'] + probe:>22}: recall@{args.k}={r['recall_at_k']:.3f} p50={r['p50_ms']:.2f}ms "
+              f"p99={r['p99_ms']:.2f}ms size={r['index_mb']:.1f}MB build={r['build_s']:.1f}s")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""End-to-end load test for the Flask service.
+
+Starts `app/app.py` in a subprocess against stand-in models and a stubbed
+maps API (see stubs.py), drives /predict, /generate_report, /get_doctors and
+/health at a fixed concurrency, and records throughput, latency percentiles
+and server RSS. Results are written as JSON; pass `--baseline` with an
+earlier result file to flag routes whose p95 regressed.
+
+    python benchmarks/loadtest.py --concurrency 8 --requests 200
+    python benchmarks/loadtest.py --baseline benchmarks/results/before.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import requests
+
+import stubs
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(HERE, "..", "app", "app.py")
+ROUTES = ("predict", "generate_report", "get_doctors", "health")
+
+
+def read_rss_mb(pid):
+    """Resident set size of `pid` in MB, from /proc (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid, interval=0.25):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            rss = read_rss_mb(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def start_server(port, models_dir, maps_url, workdir, extra_env=None):
+    env = dict(os.environ, PORT=str(port), MODELS_DIR=models_dir,
+               GOMAPS_API_KEY="stub", GOMAPS_PLACES_URL=maps_url)
+    env.update(extra_env or {})
+    proc = subprocess.Popen([sys.executable, os.path.abspath(APP_PATH)], cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 300
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"app exited with code {proc.returncode} during startup")
+        try:
+            if requests.get(f"{base}/health", timeout=2).json().get("models_loaded"):
+                return proc, base
+        except (requests.RequestException, ValueError):
+            pass
+        time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError("app did not become ready within 300s")
+
+
+def make_client(base, images):
+    """Session that has already run one prediction, so /generate_report has data"""
+    session = requests.Session()
+    name, data = images[0]
+    session.post(f"{base}/predict", files={"file": (name, data)}, timeout=180)
+    return session
+
+
+def call(route, session, base, image, rng):
+    if route == "predict":
+        name, data = image
+        return session.post(f"{base}/predict", files={"file": (name, data)}, timeout=180)
+    if route == "generate_report":
+        return session.get(f"{base}/generate_report", timeout=60)
+    if route == "get_doctors":
+        lat, lon = 17.385 + rng.random() * 0.1, 78.486 + rng.random() * 0.1
+        return session.post(f"{base}/get_doctors", json={"latitude": lat, "longitude": lon}, timeout=30)
+    return session.get(f"{base}/health", timeout=10)
+
+
+def drive(route, base, images, concurrency, total):
+    """Issue `total` requests to one route from `concurrency` client threads"""
+    sessions = [make_client(base, images) for _ in range(concurrency)]
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def worker(i):
+        nonlocal errors
+        rng = np.random.default_rng(i)
+        session = sessions[i % concurrency]
+        image = images[i % len(images)]
+        start = time.perf_counter()
+        try:
+            ok = call(route, session, base, image, rng).status_code < 400
+        except requests.RequestException:
+            ok = False
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(total)))
+    wall = time.perf_counter() - start
+
+    lat = np.array(latencies)
+    return {
+        "requests": total,
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(total / wall, 2),
+        "mean_ms": round(float(lat.mean()), 2),
+        "p50_ms": round(float(np.percentile(lat, 50)), 2),
+        "p95_ms": round(float(np.percentile(lat, 95)), 2),
+        "p99_ms": round(float(np.percentile(lat, 99)), 2),
+        "max_ms": round(float(lat.max()), 2),
+    }
+
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = []
+    for route, current in results["routes"].items():
+        before = baseline.get("routes", {}).get(route)
+        if not before:
+            continue
+        ratio = current["p95_ms"] / max(before["p95_ms"], 1e-9)
+        status = "REGRESSION" if ratio > 1 + tolerance else "ok"
+        print(f"  {route:<16} p95 {before['p95_ms']:>9.2f} -> {current['p95_ms']:>9.2f} ms ({ratio:5.2f}x) {status}")
+        if status != "ok":
+            regressions.append(route)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=100, help="Requests per route")
+    parser.add_argument("--routes", default=",".join(ROUTES))
+    parser.add_argument("--image-sizes", default="1024,2048,2800", help="Synthetic X-ray sides in pixels")
+    parser.add_argument("--maps-delay", type=float, default=0.05, help="Simulated maps API latency (s)")
+    parser.add_argument("--port", type=int, default=5057)
+    parser.add_argument("--models-dir", help="Reuse stand-in models from this directory")
+    parser.add_argument("--output", help="Result JSON path (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--baseline", help="Earlier result JSON to compare p95 latency against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed p95 slowdown vs baseline")
+    parser.add_argument("--env", action="append", default=[], help="Extra KEY=VALUE for the server process")
+    args = parser.parse_args()
+
+    routes = [r for r in args.routes.split(",") if r]
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        models_dir = stubs.build_models(args.models_dir or os.path.join(workdir, "models"))
+        maps_server, maps_url = stubs.start_maps_stub(delay=args.maps_delay)
+        sizes = [int(s) for s in args.image_sizes.split(",")]
+        images = [(f"xray_{size}.png", stubs.synthetic_xray(size, seed=i)) for i, size in enumerate(sizes)]
+        extra_env = dict(item.split("=", 1) for item in args.env)
+
+        proc, base = start_server(args.port, models_dir, maps_url, workdir, extra_env)
+        sampler = RssSampler(proc.pid)
+        sampler.start()
+        idle_rss = read_rss_mb(proc.pid)
+        try:
+            results = {"routes": {}}
+            for route in routes:
+                results["routes"][route] = drive(route, base, images, args.concurrency, args.requests)
+                r = results["routes"][route]
+                print(f"{route:<16} {r['throughput_rps']:>8.2f} req/s  p50={r['p50_ms']:.1f}ms "
+                      f"p95={r['p95_ms']:.1f}ms p99={r['p99_ms']:.1f}ms errors={r['errors']}")
+        finally:
+            sampler.stop()
+            proc.terminate()
+            proc.wait(timeout=30)
+            maps_server.shutdown()
+
+    results.update({
+        "timestamp": datetime.now().isoformat(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "concurrency": args.concurrency,
+        "requests_per_route": args.requests,
+        "image_sizes": sizes,
+        "server_env": extra_env,
+        "rss_mb": {
+            "idle": idle_rss,
+            "peak": max(sampler.samples) if sampler.samples else None,
+            "final": sampler.samples[-1] if sampler.samples else None,
+        },
+    })
+    print(f"RSS: idle={results['rss_mb']['idle']}MB peak={results['rss_mb']['peak']}MB")
+
+    output = args.output or os.path.join(HERE, "results", datetime.now().strftime("%Y%m%d_%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        print(f"Comparing against {args.baseline}:")
+        if compare(results, args.baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
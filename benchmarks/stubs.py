@@ -0,0 +1,120 @@
+"""Local stand-ins for the production models, the maps API and X-ray uploads.
+
+The real DenseNet and stacking artifacts live in Git LFS and are too slow to
+load for quick benchmark runs, so `build_models` writes small, randomly
+initialized replacements with the same layer names, input shape, feature
+width and output classes into a models directory that `app/app.py` can be
+pointed at through `MODELS_DIR`.
+"""
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+NUM_CLASSES = 5
+FEATURE_DIM = 1024
+CNN_FILENAME = "densenet_new_finetuned_v3.h5"
+STACK_FILENAME = "fast_rf_xgb_stack2.pkl"
+
+
+def build_cnn(feature_dim=FEATURE_DIM, seed=0):
+    """DenseNet-shaped Keras model: 224x224x3 in, pooled features, 5-way softmax"""
+    import tensorflow as tf
+    from tensorflow.keras import layers
+
+    tf.random.set_seed(seed)
+    inputs = layers.Input(shape=(224, 224, 3))
+    x = layers.Conv2D(32, 7, strides=4, padding="same", activation="relu")(inputs)
+    x = layers.Conv2D(64, 3, strides=2, padding="same", activation="relu")(x)
+    x = layers.Conv2D(128, 3, strides=2, padding="same", activation="relu")(x)
+    x = layers.Conv2D(feature_dim, 1, activation="relu", name="relu")(x)
+    x = layers.GlobalAveragePooling2D(name="global_average_pooling2d")(x)
+    x = layers.Dropout(0.6)(x)
+    outputs = layers.Dense(NUM_CLASSES, activation="softmax")(x)
+    return tf.keras.Model(inputs, outputs)
+
+
+def build_stack(feature_dim=FEATURE_DIM, samples=600, seed=0):
+    """RF + XGB stack with a GradientBoosting meta-model, fitted on random features"""
+    from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier, StackingClassifier
+    from xgboost import XGBClassifier
+
+    rng = np.random.default_rng(seed)
+    y = np.arange(samples) % NUM_CLASSES
+    centers = rng.standard_normal((NUM_CLASSES, feature_dim)).astype(np.float32)
+    X = centers[y] + rng.standard_normal((samples, feature_dim)).astype(np.float32)
+
+    rf = RandomForestClassifier(n_estimators=100, max_depth=15, random_state=seed, n_jobs=-1).fit(X, y)
+    xgb = XGBClassifier(n_estimators=100, max_depth=6, learning_rate=0.1, random_state=seed,
+                        n_jobs=-1, eval_metric="mlogloss").fit(X, y)
+    meta = GradientBoostingClassifier(n_estimators=100, learning_rate=0.1, max_depth=4, random_state=seed)
+    stack = StackingClassifier(estimators=[("rf", rf), ("xgb", xgb)], final_estimator=meta,
+                               cv="prefit", passthrough=True)
+    return stack.fit(X, y)
+
+
+def build_models(models_dir, feature_dim=FEATURE_DIM):
+    """Write stand-in CNN and stacking artifacts to `models_dir` unless present"""
+    import joblib
+
+    os.makedirs(models_dir, exist_ok=True)
+    cnn_path = os.path.join(models_dir, CNN_FILENAME)
+    stack_path = os.path.join(models_dir, STACK_FILENAME)
+    if not os.path.exists(cnn_path):
+        build_cnn(feature_dim).save(cnn_path)
+    if not os.path.exists(stack_path):
+        joblib.dump(build_stack(feature_dim), stack_path)
+    return models_dir
+
+
+def synthetic_xray(size, seed=0, ext=".png"):
+    """Encode a grayscale chest-X-ray-like image of `size` x `size` pixels"""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    # Two dark lung fields on a bright mediastinum, plus rib banding and film noise
+    lungs = np.exp(-(((xx - 0.32) / 0.16) ** 2 + ((yy - 0.5) / 0.3) ** 2))
+    lungs += np.exp(-(((xx - 0.68) / 0.16) ** 2 + ((yy - 0.5) / 0.3) ** 2))
+    ribs = 0.08 * np.sin(yy * 60 + xx * 8)
+    img = 200 - 120 * lungs + 40 * ribs * lungs + rng.normal(0, 6, (size, size))
+    img = np.clip(img, 0, 255).astype(np.uint8)
+    ok, buf = cv2.imencode(ext, img)
+    if not ok:
+        raise RuntimeError(f"Could not encode synthetic image as {ext}")
+    return buf.tobytes()
+
+
+class _PlacesHandler(BaseHTTPRequestHandler):
+    delay = 0.0
+    payload = b""
+
+    def do_GET(self):
+        if self.delay:
+            time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.payload)))
+        self.end_headers()
+        self.wfile.write(self.payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_maps_stub(delay=0.05, results=10):
+    """Serve canned Places nearby-search responses; returns (server, url)"""
+    payload = json.dumps({
+        "status": "OK",
+        "results": [
+            {"name": f"Pulmonology Clinic {i}", "vicinity": f"{i} Health Street", "rating": 4.5, "place_id": f"stub{i}"}
+            for i in range(results)
+        ],
+    }).encode()
+    handler = type("PlacesHandler", (_PlacesHandler,), {"delay": delay, "payload": payload})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/maps/api/place/nearbysearch/json"
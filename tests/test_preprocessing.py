@@ -0,0 +1,65 @@
+"""Serving tensors must match the training tensors (PIL convert("RGB") + NEAREST resize) bit for bit."""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+Image = pytest.importorskip("PIL.Image")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import preprocessing  # noqa: E402
+
+SIZE = preprocessing.INPUT_SIZE
+
+# (height, width): odd sizes, exact multiples, upscaling and degenerate strips
+SHAPES = [(224, 224), (1000, 750), (513, 389), (97, 131), (31, 700), (1, 224), (448, 17), (225, 223)]
+
+
+def pil_reference(path):
+    with Image.open(path) as image:
+        array = np.asarray(image.convert("RGB").resize((SIZE, SIZE), Image.NEAREST), dtype=np.float32)
+    return array * preprocessing.INV_255
+
+
+def write_png(directory, name, shape, gray, seed):
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 256, shape if gray else shape + (3,), dtype=np.uint8)
+    path = os.path.join(str(directory), f"{name}.png")
+    cv2.imwrite(path, img)
+    return path
+
+
+@pytest.mark.parametrize("gray", [False, True], ids=["colour", "gray"])
+@pytest.mark.parametrize("shape", SHAPES, ids=[f"{h}x{w}" for h, w in SHAPES])
+def test_preprocess_batch_matches_pil(tmp_path, shape, gray):
+    path = write_png(tmp_path, "xray", shape, gray, seed=shape[0] * 1000 + shape[1])
+    batch = preprocessing.preprocess_batch([preprocessing.decode(path)])
+    assert batch.shape == (1, SIZE, SIZE, 3)
+    assert batch.dtype == np.float32
+    np.testing.assert_array_equal(batch[0], pil_reference(path))
+
+
+def test_mixed_batch_matches_pil(tmp_path):
+    paths = [write_png(tmp_path, f"img{i}", shape, gray=i % 2 == 0, seed=i) for i, shape in enumerate(SHAPES)]
+    batch = preprocessing.preprocess_batch([preprocessing.decode(path) for path in paths])
+    for path, tensor in zip(paths, batch):
+        np.testing.assert_array_equal(tensor, pil_reference(path))
+
+
+@pytest.mark.parametrize("gray", [False, True], ids=["colour", "gray"])
+def test_compact_upload_matches_pil(tmp_path, gray):
+    path = write_png(tmp_path, "xray", (613, 487), gray, seed=7)
+    compact = preprocessing.compact_roundtrip(preprocessing.decode(path))
+    batch = preprocessing.preprocess_batch([compact])
+    np.testing.assert_array_equal(batch[0], pil_reference(path))
+
+
+@pytest.mark.parametrize("src", [1, 3, 97, 224, 225, 448, 513, 1000, 4096])
+def test_nearest_index_matches_pil(src):
+    # A 1-pixel-high ramp resized by PIL reveals which source column each output column took
+    ramp = np.arange(src, dtype=np.int32).reshape(1, src)
+    picked = np.asarray(Image.fromarray(ramp, mode="I").resize((SIZE, 1), Image.NEAREST))[0]
+    np.testing.assert_array_equal(preprocessing._nearest_index(src, SIZE), picked)